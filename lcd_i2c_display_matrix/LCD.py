@@ -1,10 +1,21 @@
-import smbus
+from errno import EOPNOTSUPP, EINVAL
 import time
-# NOTE: Install python3-smbus
+try:
+    # smbus2 offers i2c_rdwr which can send a whole line in one transfer
+    from smbus2 import SMBus, i2c_msg
+except ImportError:
+    # NOTE: Install python3-smbus
+    from smbus import SMBus
+    i2c_msg = None
+from .timing import get_profile
+from .glyphs import GlyphManager
+from .charmap import CharacterMap
 
 
 class LCD:
-    def __init__(self, pi_rev=2, i2c_addr=0x3F, backlight=True):
+    def __init__(self, pi_rev=2, i2c_addr=0x3F, backlight=True,
+                 block_write=True, bus=None, timing=None, glyphs=None,
+                 rom="A00", init=True):
 
         # device constants
         self.I2C_ADDR = i2c_addr
@@ -12,6 +23,7 @@ class LCD:
 
         self.LCD_CHR = 1  # Mode - Sending data
         self.LCD_CMD = 0  # Mode - Sending command
+        self.LCD_READ = 0b00000010  # R/W bit - Reading from the controller
 
         self.LCD_LINE_1 = 0x80  # LCD RAM addr for line one
         self.LCD_LINE_2 = 0xC0  # LCD RAM addr for line two
@@ -26,28 +38,104 @@ class LCD:
         self.ENABLE = 0b00000100  # Enable bit
 
         # Timing constants
-        self.E_PULSE = 0.0005
-        self.E_DELAY = 0.0005
+        # Block transfers are paced by the bus clock, the profile is used
+        # for single byte writes and the long clear/home commands.
+        self.set_timing(timing)
+
+        # Block transfer limits
+        # write_i2c_block_data sends one "command" byte plus up to 32 bytes.
+        # The PCF8574 latches every byte to its port, so the command byte is
+        # just the first byte of the sequence.
+        self.BLOCK_SIZE = 33
+
+        # Send whole byte sequences in one transfer if the adapter allows it.
+        # Falls back to the per byte path otherwise.
+        self.block_write = block_write
+
+        # Bytes and transfers sent to the PCF8574
+        self.bus_bytes = 0
+        self.bus_transactions = 0
 
         # Open I2C interface
-        if pi_rev == 2:
+        # A bus handle can be shared between multiple displays
+        if bus is not None:
+            self.bus = bus
+        elif pi_rev == 2:
             # Rev 2 Pi uses 1
-            self.bus = smbus.SMBus(1)
+            self.bus = SMBus(1)
         elif pi_rev == 1:
             # Rev 1 Pi uses 0
-            self.bus = smbus.SMBus(0)
+            self.bus = SMBus(0)
         else:
             raise ValueError('pi_rev param must be 1 or 2')
 
+        # Shadow copy of the DDRAM content visible on both lines.
+        # Unknown until the display is initialised.
+        self.shadow = []
+        self.invalidate()
+        self.initialised = False
+
+        # Without init the display is initialised later, e.g. together
+        # with the other displays on the bus, or is warm started
+        if init:
+            self.initialise()
+
+        # Custom chars are loaded into the CGRAM when they are used.
+        # glyphs is the registry of their bitmaps, see glyphs.GLYPHS
+        self.glyphs = GlyphManager(self, glyphs)
+        # Text is translated for the character ROM of the controller,
+        # A00 (Japanese) or A02 (European)
+        self.charmap = CharacterMap(rom, self.glyphs.registry)
+
+    # 110011, 110010 Initialise 4 bit mode
+    # 000110 Cursor move direction
+    # 001100 Display On,Cursor Off, Blink Off
+    # 101000 Data length, number of lines, font size
+    # 000001 Clear display
+    INIT_COMMANDS = [0x33, 0x32, 0x06, 0x0C, 0x28, 0x01]
+
+    def initialise(self):
         # Initialise display
-        self.lcd_byte(0x33, self.LCD_CMD)  # 110011 Initialise
-        self.lcd_byte(0x32, self.LCD_CMD)  # 110010 Initialise
-        self.lcd_byte(0x06, self.LCD_CMD)  # 000110 Cursor move direction
-        # 001100 Display On,Cursor Off, Blink Off
-        self.lcd_byte(0x0C, self.LCD_CMD)
-        # 101000 Data length, number of lines, font size
-        self.lcd_byte(0x28, self.LCD_CMD)
-        self.lcd_byte(0x01, self.LCD_CMD)  # 000001 Clear display
+        for command in self.INIT_COMMANDS:
+            self.lcd_byte(command, self.LCD_CMD)
+        # A clear fills the DDRAM with spaces.
+        self.invalidate(0x20)
+        self.initialised = True
+
+    def warm_start(self, shadow):
+        # Take over a display which kept its state instead of
+        # initialising it. shadow is the last known content of both lines
+        # saved on the last stop. Only the first cell of both lines and
+        # the address counter are read back to check it. After a power
+        # loss the controller is in 8 bit mode, so the address counter
+        # does not match the address set in 4 bit mode.
+        # Returns False if the display has to be initialised.
+        if not shadow or [len(codes) for codes in shadow] != \
+                [self.LCD_WIDTH, self.LCD_WIDTH]:
+            return False
+        self.write_sequence(self.byte_sequence([self.LCD_LINE_1],
+                                               self.LCD_CMD))
+        if self.read_byte(self.LCD_CHR) != shadow[0][0]:
+            return False
+        self.write_sequence(self.byte_sequence([self.LCD_LINE_2],
+                                               self.LCD_CMD))
+        if self.read_byte(self.LCD_CMD) & 0x7F != 0x40 \
+                or self.read_byte(self.LCD_CHR) != shadow[1][0]:
+            return False
+        # Undo the shift of a marquee, the DDRAM is kept
+        self.write_sequence(self.byte_sequence([0x02], self.LCD_CMD))
+        time.sleep(self.CMD_DELAY)
+        self.shadow = [list(codes) for codes in shadow]
+        self.power(True)
+        self.initialised = True
+        return True
+
+    def set_timing(self, timing):
+        # timing is a TimingProfile or the name of a profile
+        self.timing = get_profile(timing)
+        self.E_PULSE = self.timing.e_pulse
+        self.E_DELAY = self.timing.e_delay
+        self.CMD_DELAY = self.timing.cmd_delay
 
     def lcd_byte(self, bits, mode):
         # Send byte to data pins
@@ -57,6 +145,9 @@ class LCD:
         bits_high = mode | (bits & 0xF0) | self.LCD_BACKLIGHT
         bits_low = mode | ((bits << 4) & 0xF0) | self.LCD_BACKLIGHT
 
+        self.bus_bytes += 6
+        self.bus_transactions += 6
+
         # High bits
         self.bus.write_byte(self.I2C_ADDR, bits_high)
         self.toggle_enable(bits_high)
@@ -65,6 +156,10 @@ class LCD:
         self.bus.write_byte(self.I2C_ADDR, bits_low)
         self.toggle_enable(bits_low)
 
+        # Clear and return home need ~1.5ms to execute
+        if mode == self.LCD_CMD and bits in (0x01, 0x02, 0x03):
+            time.sleep(self.CMD_DELAY)
+
     def toggle_enable(self, bits):
         time.sleep(self.E_DELAY)
         self.bus.write_byte(self.I2C_ADDR, (bits | self.ENABLE))
@@ -72,8 +167,131 @@ class LCD:
         self.bus.write_byte(self.I2C_ADDR, (bits & ~self.ENABLE))
         time.sleep(self.E_DELAY)
 
+    def read_byte(self, mode):
+        # Read a byte from the controller
+        # mode = 1 for DDRAM data, 0 for busy flag and address counter
+        # The data pins are set high so the PCF8574 can read them
+        bits = mode | self.LCD_READ | 0xF0 | self.LCD_BACKLIGHT
+        value = 0
+        for shift in (0, 4):
+            time.sleep(self.E_DELAY)
+            self.bus.write_byte(self.I2C_ADDR, (bits | self.ENABLE))
+            time.sleep(self.E_PULSE)
+            value |= (self.bus.read_byte(self.I2C_ADDR) & 0xF0) >> shift
+            self.bus.write_byte(self.I2C_ADDR, bits)
+        time.sleep(self.E_DELAY)
+        # Return to write mode
+        self.bus.write_byte(self.I2C_ADDR, mode | self.LCD_BACKLIGHT)
+        return value
+
+    def read_ddram(self, address, count):
+        # Read count bytes from the DDRAM starting at the address command
+        # (0x80 + position)
+        self.lcd_byte(address, self.LCD_CMD)
+        return [self.read_byte(self.LCD_CHR) for _ in range(count)]
+
+    def nibble_sequence(self, bits, mode):
+        # Port bytes for one byte: for each nibble the data is set,
+        # enable is raised and dropped again.
+        # Every byte on the bus takes ~90us at 100kHz, which is well above
+        # the enable pulse width and settle time the controller needs.
+        sequence = []
+        for nibble in (bits & 0xF0, (bits << 4) & 0xF0):
+            data = mode | nibble | self.LCD_BACKLIGHT
+            sequence += [data, data | self.ENABLE, data & ~self.ENABLE]
+        return sequence
+
+    def byte_sequence(self, data, mode):
+        # Port bytes for a list of bytes using the same mode
+        sequence = []
+        for bits in data:
+            sequence += self.nibble_sequence(bits, mode)
+        return bytes(sequence)
+
+    def write_sequence(self, sequence):
+        # Send a prepared port byte sequence to the PCF8574.
+        # Uses one i2c_rdwr transfer if possible, blocks of 33 bytes
+        # otherwise. Adapters without block support fall back to
+        # single byte writes with timed enable strobes.
+        self.bus_bytes += len(sequence)
+        if self.block_write:
+            try:
+                if i2c_msg is not None and hasattr(self.bus, "i2c_rdwr"):
+                    self.bus.i2c_rdwr(i2c_msg.write(self.I2C_ADDR, sequence))
+                    self.bus_transactions += 1
+                else:
+                    for start in range(0, len(sequence), self.BLOCK_SIZE):
+                        block = sequence[start:start + self.BLOCK_SIZE]
+                        self.bus.write_i2c_block_data(
+                            self.I2C_ADDR, block[0], list(block[1:])
+                        )
+                        self.bus_transactions += 1
+                return
+            except (AttributeError, NotImplementedError):
+                self.block_write = False
+            except OSError as e:
+                if e.errno not in (EOPNOTSUPP, EINVAL):
+                    raise
+                self.block_write = False
+        # Every nibble uses 3 bytes: data, enable high, enable low
+        self.bus_transactions += len(sequence)
+        for start in range(0, len(sequence), 3):
+            self.bus.write_byte(self.I2C_ADDR, sequence[start])
+            self.toggle_enable(sequence[start])
+
+    def invalidate(self, code=None):
+        # Reset the shadow DDRAM.
+        # None marks the cells as unknown so the next message rewrites them
+        self.shadow = [
+            [code] * self.LCD_WIDTH,
+            [code] * self.LCD_WIDTH
+        ]
+
+    def changed_runs(self, codes, line):
+        # Compare codes with the shadow of the line and return a list of
+        # [start, end] runs which need to be written.
+        # Jumping to a new address costs one command byte, so runs which
+        # are separated by a single unchanged cell are merged.
+        shadow = self.shadow[line - 1]
+        runs = []
+        for i in range(self.LCD_WIDTH):
+            if shadow[i] == codes[i]:
+                continue
+            if runs and i - runs[-1][1] <= 1:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        return runs
+
+    def encode(self, string, line):
+        # Character codes of a string written to line 1 or 2.
+        # Chars missing in the ROM use a CGRAM slot if a glyph is
+        # registered. Slots visible on the other line or holding a glyph
+        # of this line are not replaced.
+        protected = {
+            code for code in self.shadow[2 - line]
+            if code is not None and code < 8
+        }
+        checked = []
+
+        def glyph(char):
+            if not checked:
+                # Glyphs of the line which are loaded already
+                checked.append(True)
+                for other in set(string):
+                    slot = self.glyphs.loaded_slot(other)
+                    if slot is not None:
+                        protected.add(slot)
+            slot = self.glyphs.slot(char, protected)
+            if slot is not None:
+                protected.add(slot)
+            return slot
+
+        return self.charmap.encode(string, glyph)
+
     def message(self, string, line=1):
         # display message string on LCD line 1 or 2
+        # Only cells which differ from the shadow DDRAM are written
         if line == 1:
             lcd_line = self.LCD_LINE_1
         elif line == 2:
@@ -81,13 +299,65 @@ class LCD:
         else:
             raise ValueError('line number must be 1 or 2')
 
-        string = string.ljust(self.LCD_WIDTH, " ")
+        string = string[:self.LCD_WIDTH].ljust(self.LCD_WIDTH, " ")
+        codes = self.encode(string, line)
 
-        self.lcd_byte(lcd_line, self.LCD_CMD)
+        runs = self.changed_runs(codes, line)
+        if not runs:
+            return
+        # Every run costs one address command plus its characters.
+        # If that is not cheaper than rewriting the whole line do so.
+        if sum(1 + end - start for start, end in runs) >= 1 + self.LCD_WIDTH:
+            runs = [[0, self.LCD_WIDTH]]
 
-        for i in range(self.LCD_WIDTH):
-            self.lcd_byte(ord(string[i]), self.LCD_CHR)
+        # Address commands and characters are sent as one sequence
+        sequence = b""
+        for start, end in runs:
+            sequence += self.byte_sequence([lcd_line + start], self.LCD_CMD)
+            sequence += self.byte_sequence(codes[start:end], self.LCD_CHR)
+        self.write_sequence(sequence)
+        self.shadow[line - 1] = codes
 
     def clear(self):
         # clear LCD display
         self.lcd_byte(0x01, self.LCD_CMD)
+        self.invalidate(0x20)
+
+    def power(self, on):
+        # Switch backlight and display on or off in one transfer.
+        # The DDRAM, CGRAM and shadow are kept, so nothing has to be
+        # written again when the display is turned on.
+        self.LCD_BACKLIGHT = 0x08 if on else 0x00
+        # 001100 Display On / 001000 Display Off, Cursor Off, Blink Off
+        self.write_sequence(
+            self.byte_sequence([0x0C if on else 0x08], self.LCD_CMD)
+        )
+
+    def set_backlight(self, on):
+        # Only switch the backlight, a single write to the PCF8574
+        self.LCD_BACKLIGHT = 0x08 if on else 0x00
+        self.bus_bytes += 1
+        self.bus_transactions += 1
+        self.bus.write_byte(self.I2C_ADDR, self.LCD_BACKLIGHT)
+
+    def write_ddram(self, line, cell, codes):
+        # Write codes to the DDRAM of line 0 or 1 starting at cell 0-39.
+        # Cells beyond the visible window are not kept in the shadow.
+        lcd_line = self.LCD_LINE_2 if line else self.LCD_LINE_1
+        self.write_sequence(
+            self.byte_sequence([lcd_line + cell], self.LCD_CMD)
+            + self.byte_sequence(codes, self.LCD_CHR)
+        )
+
+    def shift_display(self, right=False):
+        # Shift the visible window of both lines by one DDRAM cell
+        # 0x18 moves the content left, 0x1C moves it right
+        self.write_sequence(
+            self.byte_sequence([0x1C if right else 0x18], self.LCD_CMD)
+        )
+
+    def return_home(self):
+        # Undo all display shifts, the DDRAM content is kept.
+        # The visible cells are unknown afterwards.
+        self.lcd_byte(0x02, self.LCD_CMD)
+        self.invalidate()
@@ -1,3 +1,5 @@
 from .matrix import Matrix
 from .lcd_websocket_listener import MatrixCommandReceiver
 from .lcd_websocket_sender import MatrixCommandSender
+from .lcd_websocket_sender import MatrixDatagramSender
+from .lcd_websocket_sender import AsyncMatrixCommandSender
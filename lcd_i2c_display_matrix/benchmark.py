@@ -0,0 +1,223 @@
+from argparse import ArgumentParser
+from json import dumps
+from sys import stderr, exit
+from socket import socket, AF_INET, SOCK_STREAM
+from threading import Thread, Lock
+from time import perf_counter, sleep
+from .emulator import simulated_buses
+from .matrix import Matrix
+from .lcd_websocket_listener import MatrixCommandReceiver
+from .lcd_websocket_sender import MatrixCommandSender
+
+# Runs the display pipeline on a simulated bus without any hardware.
+# Example usage:
+#     python -m lcd_i2c_display_matrix.benchmark --displays 8 --rate 50
+#     python -m lcd_i2c_display_matrix.benchmark --scenario shift --json
+# Fail with exit status 1 if a scenario gets slower, e.g. in CI:
+#     python -m lcd_i2c_display_matrix.benchmark --max-p95-ms 50 \
+#         --max-bytes-per-frame 400
+
+SCENARIOS = ["on_next", "shift", "receiver"]
+
+
+class GlassWatcher:
+    def __init__(self) -> None:
+        """
+            Records when a pushed frame becomes visible on a display.
+            Every frame carries its sequence number as "#000042" in the
+            first line, the bus listener looks for it after every write.
+        """
+        self.lock = Lock()
+        self.pushed = {}
+        self.latencies = []
+
+    def push(self, seq: int) -> list:
+        """ Remember the push time and return the lines of the frame """
+        with self.lock:
+            self.pushed[seq] = perf_counter()
+        return [f"#{seq:06d}", "benchmark"]
+
+    def listener(self, address: int, device) -> None:
+        line = device.visible_lines()[0]
+        if not line.startswith("#") or len(line) < 7:
+            return
+        try:
+            seq = int(line[1:7])
+        except ValueError:
+            return
+        with self.lock:
+            pushed = self.pushed.pop(seq, None)
+            if pushed is not None:
+                self.latencies.append(perf_counter() - pushed)
+
+
+def _free_port() -> int:
+    with socket(AF_INET, SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run_benchmark(scenario: str = "on_next", displays: int = 8,
+                  rate: float = 50, duration: float = 5,
+                  ids: int = 4, clock: int = 100000,
+                  drain: float = 1) -> dict:
+    """ Pushes frames at a fixed rate through the given scenario and
+        returns frames per second, bus bytes per frame and the latency
+        from push to glass.
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError(f"scenario must be one of {', '.join(SCENARIOS)}")
+    watcher = GlassWatcher()
+    identifiers, buses = simulated_buses(
+        displays, clock, listener=watcher.listener
+    )
+    matrix = Matrix(identifiers, bus_factory=lambda number: buses[number])
+    if scenario == "on_next":
+        def push(lines, data_id):
+            matrix.display_on_next(lines, data_id)
+    elif scenario == "shift":
+        def push(lines, data_id):
+            matrix.display_and_shift(lines, data_id)
+    else:
+        port = _free_port()
+        receiver = MatrixCommandReceiver(matrix, "127.0.0.1", port)
+        Thread(target=receiver.start, args=(), daemon=True).start()
+        receiver.ready.wait()
+        sender = MatrixCommandSender("127.0.0.1", port)
+
+        def push(lines, data_id):
+            sender.send("on_next", lines, data_id)
+    # Wait for the initialisation of all displays to be written
+    sleep(.2)
+    for bus in buses.values():
+        bus.reset_counters()
+
+    seq = 0
+    start = perf_counter()
+    while perf_counter() - start < duration:
+        push(watcher.push(seq), f"id{seq % ids}")
+        seq += 1
+        delay = start + seq / rate - perf_counter()
+        if delay > 0:
+            sleep(delay)
+    elapsed = perf_counter() - start
+    sleep(drain)
+
+    with watcher.lock:
+        latencies = list(watcher.latencies)
+    on_glass = len(latencies)
+    bus_bytes = sum(bus.bytes for bus in buses.values())
+    result = {
+        "scenario": scenario,
+        "displays": displays,
+        "rate": rate,
+        "pushed": seq,
+        "on_glass": on_glass,
+        "coalesced": seq - on_glass,
+        "frames_per_second": on_glass / elapsed,
+        "buses": len(buses),
+        "bus_bytes": bus_bytes,
+        "bus_transactions":
+            sum(bus.transactions for bus in buses.values()),
+        "bus_bytes_per_frame": bus_bytes / on_glass if on_glass else 0,
+        "bus_utilisation": max(
+            bus.bus_time for bus in buses.values()
+        ) / (elapsed + drain),
+        "latency_ms_mean":
+            1000 * sum(latencies) / on_glass if on_glass else 0,
+        "latency_ms_p50": 1000 * _percentile(latencies, 50),
+        "latency_ms_p95": 1000 * _percentile(latencies, 95),
+        "latency_ms_max": 1000 * max(latencies, default=0),
+    }
+    matrix.stop()
+    return result
+
+
+def check_thresholds(result: dict, max_bytes_per_frame: float = None,
+                     max_p95_ms: float = None,
+                     min_fps: float = None) -> list:
+    """ Returns a message for every threshold the result misses """
+    failures = []
+    if max_bytes_per_frame is not None \
+            and result["bus_bytes_per_frame"] > max_bytes_per_frame:
+        failures.append(
+            f"{result['scenario']}: {result['bus_bytes_per_frame']:.1f} "
+            f"bus bytes per frame > {max_bytes_per_frame}"
+        )
+    if max_p95_ms is not None and result["latency_ms_p95"] > max_p95_ms:
+        failures.append(
+            f"{result['scenario']}: p95 latency "
+            f"{result['latency_ms_p95']:.2f}ms > {max_p95_ms}ms"
+        )
+    if min_fps is not None and result["frames_per_second"] < min_fps:
+        failures.append(
+            f"{result['scenario']}: {result['frames_per_second']:.1f} "
+            f"frames per second < {min_fps}"
+        )
+    return failures
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Benchmark the display pipeline on a simulated bus"
+    )
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"],
+                        default="all")
+    parser.add_argument("--displays", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=50,
+                        help="frames pushed per second")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--ids", type=int, default=4,
+                        help="number of distinct data ids")
+    parser.add_argument("--clock", type=int, default=100000,
+                        help="simulated I2C clock in Hz")
+    parser.add_argument("--json", action="store_true",
+                        help="print one json object per scenario")
+    parser.add_argument("--max-bytes-per-frame", type=float,
+                        help="fail if a frame needs more bus bytes")
+    parser.add_argument("--max-p95-ms", type=float,
+                        help="fail if the p95 latency to glass is higher")
+    parser.add_argument("--min-fps", type=float,
+                        help="fail if fewer frames per second reach glass")
+    args = parser.parse_args()
+
+    failures = []
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+    for scenario in scenarios:
+        result = run_benchmark(
+            scenario,
+            args.displays,
+            args.rate,
+            args.duration,
+            args.ids,
+            args.clock
+        )
+        failures += check_thresholds(
+            result,
+            args.max_bytes_per_frame,
+            args.max_p95_ms,
+            args.min_fps
+        )
+        if args.json:
+            print(dumps(result))
+            continue
+        print(f"{scenario}:")
+        for key, value in result.items():
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            print(f"    {key:20} {value}")
+    for failure in failures:
+        print(f"Threshold exceeded, {failure}", file=stderr)
+    if failures:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+from .glyphs import progress_bar, sparkline, FULL_BLOCK
+
+# Example usage:
+# matrix = Matrix([
+#     {"location": (0, 0), "identifier": 0x20},
+#     {"location": (1, 0), "identifier": 0x21},
+#     {"location": (0, 1), "identifier": 0x22},
+#     {"location": (1, 1), "identifier": 0x23}
+# ])
+# canvas = matrix.create_canvas()    # 32x4 characters
+# canvas.draw_text(10, 0, "Text across two panels")
+# canvas.draw_big_number(0, 2, 1234)
+# canvas.commit()
+
+DISPLAY_WIDTH = 16
+DISPLAY_HEIGHT = 2
+
+BLOCK = FULL_BLOCK
+
+# Digits of draw_big_number, 3 characters wide and 2 lines high
+BIG_DIGITS = {
+    "0": ["#-#", "#_#"],
+    "1": [" # ", " # "],
+    "2": ["--#", "#__"],
+    "3": ["--#", "__#"],
+    "4": ["#_#", "  #"],
+    "5": ["#--", "__#"],
+    "6": ["#--", "#_#"],
+    "7": ["--#", "  #"],
+    "8": ["#-#", "#-#"],
+    "9": ["#-#", "__#"],
+    "-": ["   ", "---"],
+    ".": ["   ", " . "],
+    " ": ["   ", "   "],
+}
+
+
+class Canvas:
+    def __init__(self, matrix) -> None:
+        """
+            Character canvas spanning all displays of the matrix which
+            have a location. A display at location (column, row) covers
+            the cells from (column * 16, row * 2) on.
+            Every cell is mapped to (display, line, column) by a lookup
+            table built once. Drawing only changes the canvas, commit
+            sends the changed lines to the displays.
+        """
+        self.matrix = matrix
+        located = [
+            display for display in matrix.displays if display.location
+        ]
+        self.width = DISPLAY_WIDTH * (
+            max([display.location[0] for display in located], default=-1)
+            + 1
+        )
+        self.height = DISPLAY_HEIGHT * (
+            max([display.location[1] for display in located], default=-1)
+            + 1
+        )
+        # Text of every display line, changed by drawing
+        self.lines = {
+            display: [[" "] * DISPLAY_WIDTH for _ in range(DISPLAY_HEIGHT)]
+            for display in located
+        }
+        # (x, y) -> (display, line, column), None without a display
+        self.lookup = [[None] * self.width for _ in range(self.height)]
+        for display in located:
+            column, row = display.location
+            for line in range(DISPLAY_HEIGHT):
+                for cell in range(DISPLAY_WIDTH):
+                    self.lookup[row * DISPLAY_HEIGHT + line][
+                        column * DISPLAY_WIDTH + cell
+                    ] = (display, line, cell)
+        # (display, line) pairs changed since the last commit.
+        # The first commit sends the whole canvas.
+        self.dirty = {
+            (display, line)
+            for display in located
+            for line in range(DISPLAY_HEIGHT)
+        }
+
+    def set_char(self, x: int, y: int, char: str) -> None:
+        """ Set a single cell, cells outside of the canvas are ignored """
+        if x not in range(self.width) or y not in range(self.height):
+            return
+        target = self.lookup[y][x]
+        if not target:
+            return
+        display, line, column = target
+        if self.lines[display][line][column] == char:
+            return
+        self.lines[display][line][column] = char
+        self.dirty.add((display, line))
+
+    def get_char(self, x: int, y: int) -> str:
+        if x not in range(self.width) or y not in range(self.height):
+            return None
+        target = self.lookup[y][x]
+        if not target:
+            return None
+        display, line, column = target
+        return self.lines[display][line][column]
+
+    def clear(self) -> None:
+        """ Fill the whole canvas with spaces """
+        self.fill(0, 0, self.width, self.height)
+
+    def fill(self, x: int, y: int, width: int, height: int,
+             char: str = " ") -> None:
+        for row in range(y, y + height):
+            for column in range(x, x + width):
+                self.set_char(column, row, char)
+
+    def draw_text(self, x: int, y: int, text: str) -> None:
+        """ Draw text starting at x, y. The text is not wrapped. """
+        for offset, char in enumerate(f"{text}"):
+            self.set_char(x + offset, y, char)
+
+    def draw_table(self, x: int, y: int, rows: list,
+                   widths: list = None, separator: str = " ") -> None:
+        """ Draw rows of cells as columns. Without widths every column
+            is as wide as its longest cell. Cells are cut to the width
+            of their column, numbers are aligned to the right.
+        """
+        if widths is None:
+            widths = []
+            for row in rows:
+                for index, cell in enumerate(row):
+                    if index == len(widths):
+                        widths.append(0)
+                    widths[index] = max(widths[index], len(f"{cell}"))
+        for offset, row in enumerate(rows):
+            text = []
+            for index, cell in enumerate(row[:len(widths)]):
+                if isinstance(cell, (int, float)):
+                    text.append(f"{cell}"[:widths[index]].rjust(widths[index]))
+                else:
+                    text.append(f"{cell}"[:widths[index]].ljust(widths[index]))
+            self.draw_text(x, y + offset, separator.join(text))
+
+    def draw_big_number(self, x: int, y: int, number) -> None:
+        """ Draw a number two lines high, every digit is 3 characters
+            wide with one character space between the digits.
+        """
+        for index, char in enumerate(f"{number}"):
+            if char not in BIG_DIGITS:
+                continue
+            for line, text in enumerate(BIG_DIGITS[char]):
+                self.draw_text(
+                    x + index * 4, y + line, text.replace("#", BLOCK)
+                )
+
+    def draw_progress(self, x: int, y: int, width: int,
+                      value: float) -> None:
+        """ Draw a bar of width cells filled to value (0-1) """
+        self.draw_text(x, y, progress_bar(value, width))
+
+    def draw_sparkline(self, x: int, y: int, values: list,
+                       minimum: float = None, maximum: float = None) -> None:
+        """ Draw one bar of a cell per value """
+        self.draw_text(x, y, sparkline(values, minimum, maximum))
+
+    def commit(self) -> None:
+        """ Send the changed lines to their displays.
+            All lines are enqueued in one matrix transaction, unchanged
+            lines of a display are not sent.
+        """
+        if not self.dirty:
+            return
+        changed = {}
+        for display, line in self.dirty:
+            changed.setdefault(display, [None, None])[line] = \
+                "".join(self.lines[display][line])
+        self.dirty = set()
+        with self.matrix.transaction():
+            for display, lines in changed.items():
+                if not display.is_on():
+                    display.toggle_display()
+                display.set_text(lines[0], lines[1])
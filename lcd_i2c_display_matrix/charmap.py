@@ -0,0 +1,108 @@
+from unicodedata import normalize
+
+# Example usage:
+# charmap = CharacterMap("A02")
+# charmap.encode("Grüße → 21°C")    # bytes for the DDRAM
+#
+# Text is converted to character codes of the controller ROM with a
+# single str.translate. Both ROM variants of the HD44780 are supported:
+#     A00    Japanese ROM, ASCII, katakana and some greek/math symbols
+#     A02    European ROM, ASCII and Latin-1
+# Chars which are not part of the ROM are shown by a custom glyph if one
+# is registered, or by their base char (é -> e), or as "?".
+
+# Marks a char in the translated text which needs a custom glyph
+GLYPH = "\uffff"
+
+# Codes 0-7 show the CGRAM slots and are passed through
+_CGRAM = {code: code for code in range(8)}
+_ASCII = {code: code for code in range(0x20, 0x7F)}
+
+A00 = dict(_CGRAM)
+A00.update(_ASCII)
+# The backslash and tilde cells hold yen and arrows
+del A00[ord("\\")]
+del A00[ord("~")]
+A00.update({
+    ord("¥"): 0x5C, ord("→"): 0x7E, ord("←"): 0x7F,
+    ord("·"): 0xA5, ord("°"): 0xDF,
+    ord("α"): 0xE0, ord("ä"): 0xE1, ord("β"): 0xE2, ord("ß"): 0xE2,
+    ord("ε"): 0xE3, ord("μ"): 0xE4, ord("µ"): 0xE4, ord("σ"): 0xE5,
+    ord("ρ"): 0xE6, ord("√"): 0xE8, ord("¢"): 0xEC, ord("£"): 0xED,
+    ord("ñ"): 0xEE, ord("ö"): 0xEF, ord("θ"): 0xF2, ord("∞"): 0xF3,
+    ord("Ω"): 0xF4, ord("ü"): 0xF5, ord("Σ"): 0xF6, ord("π"): 0xF7,
+    ord("千"): 0xFA, ord("万"): 0xFB, ord("円"): 0xFC, ord("÷"): 0xFD,
+    ord("█"): 0xFF,
+})
+# Halfwidth katakana U+FF61-U+FF9F are in the same order as 0xA1-0xDF
+A00.update({0xFF61 + index: 0xA1 + index for index in range(0x3F)})
+
+A02 = dict(_CGRAM)
+A02.update(_ASCII)
+# The upper half follows Latin-1
+A02.update({code: code for code in range(0xA0, 0x100)})
+
+ROMS = {"A00": A00, "A02": A02}
+
+
+class Translation(dict):
+    def __init__(self, rom: dict, glyphs: dict) -> None:
+        """
+            Translation table of str.translate mapping every code point
+            to a char of the ROM code. Code points which are not part of
+            the ROM are resolved once when they are used first.
+        """
+        super().__init__({code: chr(value) for code, value in rom.items()})
+        self.rom = rom
+        self.glyphs = glyphs
+
+    def __missing__(self, code: int) -> str:
+        char = chr(code)
+        if char in self.glyphs:
+            value = GLYPH
+        else:
+            value = chr(self.fallback(char))
+        self[code] = value
+        return value
+
+    def fallback(self, char: str) -> int:
+        """ ROM code of the base char, "?" if there is none """
+        for base in normalize("NFKD", char):
+            if ord(base) in self.rom:
+                return self.rom[ord(base)]
+        return self.rom[ord("?")]
+
+
+class CharacterMap:
+    def __init__(self, rom: str = "A00", glyphs: dict = None) -> None:
+        """
+            Converts text to the character codes of a ROM variant.
+            glyphs is the registry of custom chars, registered chars which
+            are not part of the ROM are marked to be shown by a glyph.
+        """
+        if rom not in ROMS:
+            raise ValueError(f"rom must be one of {', '.join(ROMS)}")
+        self.rom = rom
+        self.table = Translation(ROMS[rom], {} if glyphs is None else glyphs)
+
+    def forget(self, char: str) -> None:
+        """ Resolve char again, e.g. after a glyph was registered """
+        if ord(char) not in self.table.rom:
+            self.table.pop(ord(char), None)
+
+    def encode(self, string: str, glyph=None) -> bytes:
+        """ Returns the character codes of string.
+            glyph is called with every char which needs a custom glyph
+            and returns its code, None uses the fallback char.
+        """
+        translated = string.translate(self.table)
+        if GLYPH not in translated:
+            return translated.encode("latin-1")
+        codes = bytearray(translated.replace(GLYPH, "?").encode("latin-1"))
+        index = translated.find(GLYPH)
+        while index >= 0:
+            char = string[index]
+            code = glyph(char) if glyph else None
+            codes[index] = self.table.fallback(char) if code is None else code
+            index = translated.find(GLYPH, index + 1)
+        return bytes(codes)
@@ -0,0 +1,169 @@
+from json import dump, load
+from json.decoder import JSONDecodeError
+from os import makedirs
+from os.path import dirname, expanduser
+from threading import Thread
+from time import sleep
+from .LCD import SMBus
+
+# Example usage:
+# scan([1, 3])                  # {1: [0x20, 0x27], 3: [0x3f]}
+# matrix = Matrix([0x20, 0x21, (3, 0x3f)], warm=True)
+# print(matrix.report)
+# matrix.stop()                 # saves the state for the next warm start
+
+# Addresses of the PCF8574 (0x20-0x27) and PCF8574A (0x38-0x3F)
+PCF8574_ADDRESSES = list(range(0x20, 0x28)) + list(range(0x38, 0x40))
+
+# Seconds to wait after the init commands needing more time
+INIT_DELAYS = {0x33: 0.0045, 0x32: 0.00015, 0x01: 0.002}
+
+
+def probe_address(bus, address: int) -> bool:
+    """ Check if a device acknowledges the address """
+    try:
+        if hasattr(bus, "write_quick"):
+            bus.write_quick(address)
+        else:
+            bus.read_byte(address)
+        return True
+    except OSError:
+        return False
+
+
+def scan_bus(bus, addresses: list = None) -> list:
+    """ Returns the addresses answering on an open bus """
+    if addresses is None:
+        addresses = PCF8574_ADDRESSES
+    return [address for address in addresses if probe_address(bus, address)]
+
+
+def scan(bus_numbers: list = None, addresses: list = None,
+         bus_factory=None) -> dict:
+    """ Scans several buses at the same time.
+        Returns {bus_number: [addresses]}.
+    """
+    if bus_numbers is None:
+        bus_numbers = [1]
+    found = {}
+
+    def scan_thread(bus_number):
+        try:
+            bus = (bus_factory or SMBus)(bus_number)
+        except OSError:
+            # The bus does not exist
+            found[bus_number] = []
+            return
+        found[bus_number] = scan_bus(bus, addresses)
+
+    threads = [
+        Thread(target=scan_thread, args=(bus_number,))
+        for bus_number in bus_numbers
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return found
+
+
+def initialise_interleaved(lcds: list, select=None) -> None:
+    """ Initialise LCDs on the same bus together.
+        Every init command is sent to all LCDs before waiting once for
+        the slowest command instead of waiting for every LCD.
+        select is called with every LCD before writing to it, e.g. to
+        select its multiplexer channel.
+    """
+    for command in lcds[0].INIT_COMMANDS if lcds else []:
+        for lcd in lcds:
+            if select:
+                select(lcd)
+            lcd.write_sequence(lcd.byte_sequence([command], lcd.LCD_CMD))
+        delay = INIT_DELAYS.get(command)
+        if delay:
+            sleep(max([delay] + [
+                lcd.CMD_DELAY for lcd in lcds if command == 0x01
+            ]))
+    for lcd in lcds:
+        lcd.invalidate(0x20)
+        lcd.initialised = True
+
+
+def _name(identifier) -> str:
+    if isinstance(identifier, int):
+        return hex(identifier)
+    return f"{identifier}"
+
+
+class DiscoveryReport:
+    def __init__(self) -> None:
+        """ Result of bringing up the displays of a matrix """
+        # Names of displays which were initialised
+        self.found = []
+        # Names of displays which kept their state
+        self.warm = []
+        # Identifiers which did not answer
+        self.missing = []
+        # Identifier -> error of displays which answered but failed
+        self.failed = {}
+        self.seconds = 0.0
+
+    def fail(self, identifier, error: Exception) -> None:
+        """ Record the error of a display, list identifiers of json
+            configurations are kept as tuples
+        """
+        if isinstance(identifier, list):
+            identifier = tuple(identifier)
+        self.failed[identifier] = error
+
+    def __str__(self) -> str:
+        lines = [
+            f"{len(self.found) + len(self.warm)} displays ready in "
+            f"{self.seconds:.3f}s"
+        ]
+        if self.warm:
+            lines.append(f"Warm started: {', '.join(self.warm)}")
+        if self.missing:
+            lines.append(f"Missing: {', '.join(map(_name, self.missing))}")
+        for identifier, error in self.failed.items():
+            lines.append(f"Failed: {_name(identifier)}: {error}")
+        return "\n".join(lines)
+
+
+class StateStore:
+    def __init__(self, path: str = None) -> None:
+        """
+            Keeps the shadow DDRAM of every display in a json file so a
+            restarted matrix can take over displays which kept their text.
+            A state is only used once, a matrix which is not stopped
+            cleanly leaves nothing to take over.
+        """
+        self.path = expanduser(
+            path or "~/.config/lcd_i2c_display_matrix/state.json"
+        )
+
+    def take(self) -> dict:
+        """ Returns {display name: shadow} and forgets the states """
+        try:
+            with open(self.path) as f:
+                states = load(f)
+        except (OSError, JSONDecodeError):
+            return {}
+        self.save({})
+        return states if isinstance(states, dict) else {}
+
+    def save(self, states: dict) -> None:
+        """ Saves {display name: shadow}, shadows with unknown cells are
+            left out
+        """
+        states = {
+            name: [list(codes) for codes in shadow]
+            for name, shadow in states.items()
+            if None not in list(shadow[0]) + list(shadow[1])
+        }
+        try:
+            makedirs(dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as f:
+                dump(states, f)
+        except OSError as e:
+            print(f"Could not save display states to {self.path}: {e}")
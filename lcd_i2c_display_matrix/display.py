@@ -1,7 +1,10 @@
-from .LCD import LCD
-from threading import Thread, Event
-from queue import Queue
-from time import sleep
+from .LCD import LCD, SMBus
+from .timing import calibrate
+from .scheduler import parse_identifier
+from .marquee import Marquee
+from .glyphs import GLYPHS
+from threading import Thread, Event, Condition
+from time import monotonic, perf_counter
 
 
 class LCDIdentifierDoesNotExist(Exception):
@@ -34,39 +37,339 @@ class LCDUnkownError(Exception):
             return "Unkown Exception"
 
 
+class Mailbox:
+    def __init__(self, listener=None) -> None:
+        """
+            Holds the latest pending lines of a display.
+            A new frame replaces the pending one, a line set to None keeps
+            the pending text of that line. The listener is called after
+            every put so a BusScheduler can be woken up.
+            A marquee command (a Marquee to start or False to stop),
+            power and backlight commands are delivered the same way.
+            While framed new lines are collected in a back buffer which
+            is only handed to the writer by swap.
+            replaced tells if the last put replaced a line which was not
+            written yet.
+        """
+        self.condition = Condition()
+        self.pending = [None, None]
+        # perf_counter of the put of the pending lines, only recorded
+        # with timestamps
+        self.timestamps = False
+        self.since = [None, None]
+        self.marquee = None
+        self.power = None
+        self.backlight = None
+        self.listener = listener
+        self.framed = False
+        self.back = [None, None]
+        self.back_since = [None, None]
+        # Lines taken by the writer which are not in current_lines yet
+        self.writing = [None, None]
+        self.replaced = False
+
+    def put(self, line1: str = None, line2: str = None) -> None:
+        """ Merge new lines into the pending frame and wake the writer """
+        with self.condition:
+            lines, since = self.pending, self.since
+            if self.framed:
+                lines, since = self.back, self.back_since
+            self.replaced = False
+            for index, line in enumerate((line1, line2)):
+                if line is None:
+                    continue
+                self.replaced |= lines[index] is not None
+                if self.timestamps and lines[index] is None:
+                    # A replaced line keeps the time it was queued first
+                    since[index] = perf_counter()
+                lines[index] = line
+            if self.framed:
+                # The writer is woken by the next swap
+                return
+            self.condition.notify_all()
+        if self.listener:
+            self.listener()
+
+    def swap(self) -> bool:
+        """ Hand the lines of the back buffer to the writer.
+            Returns True if a line was handed over.
+        """
+        with self.condition:
+            swapped = False
+            for index, line in enumerate(self.back):
+                if line is None:
+                    continue
+                if self.pending[index] is None:
+                    self.since[index] = self.back_since[index]
+                self.pending[index] = line
+                self.back[index] = None
+                self.back_since[index] = None
+                swapped = True
+            if not swapped:
+                return False
+            self.condition.notify_all()
+        if self.listener:
+            self.listener()
+        return True
+
+    def set_framed(self, framed: bool) -> None:
+        """ Collect lines in the back buffer until swap.
+            Ending it hands over the lines collected so far.
+        """
+        with self.condition:
+            self.framed = framed
+        if not framed:
+            self.swap()
+
+    def put_marquee(self, marquee) -> None:
+        """ Replace the pending marquee command and wake the writer """
+        with self.condition:
+            self.marquee = marquee
+            self.condition.notify_all()
+        if self.listener:
+            self.listener()
+
+    def put_power(self, on: bool) -> None:
+        """ Replace the pending power command and wake the writer """
+        with self.condition:
+            self.power = on
+            self.condition.notify_all()
+        if self.listener:
+            self.listener()
+
+    def put_backlight(self, on: bool) -> None:
+        """ Replace the pending backlight command and wake the writer """
+        with self.condition:
+            self.backlight = on
+            self.condition.notify_all()
+        if self.listener:
+            self.listener()
+
+    def has_lines(self) -> bool:
+        """ Check if a line is waiting to be written """
+        with self.condition:
+            return self.pending != [None, None]
+
+    def has_pending(self) -> bool:
+        """ Check if a line, marquee, power or backlight command is
+            waiting
+        """
+        with self.condition:
+            return self.pending != [None, None] \
+                or self.marquee is not None or self.power is not None \
+                or self.backlight is not None
+
+    def take_power(self) -> bool:
+        """ Remove the pending power command and return it.
+            Returns None if no command is pending.
+        """
+        with self.condition:
+            power, self.power = self.power, None
+            return power
+
+    def take_backlight(self) -> bool:
+        """ Remove the pending backlight command and return it.
+            Returns None if no command is pending.
+        """
+        with self.condition:
+            backlight, self.backlight = self.backlight, None
+            return backlight
+
+    def take_marquee(self):
+        """ Remove the pending marquee command and return it.
+            Returns None if no command is pending.
+        """
+        with self.condition:
+            marquee, self.marquee = self.marquee, None
+            return marquee
+
+    def take_line(self) -> tuple:
+        """ Remove the first pending line and return
+            (index, text, time it was queued).
+            Returns None if nothing is pending.
+        """
+        with self.condition:
+            for index, line in enumerate(self.pending):
+                if line is not None:
+                    self.pending[index] = None
+                    self.writing[index] = line
+                    return index, line, self.since[index]
+        return None
+
+    def line_written(self, index: int) -> None:
+        """ The writer is done with the line taken by take_line """
+        with self.condition:
+            self.writing[index] = None
+
+    def depth(self) -> int:
+        """ Number of pending lines and commands """
+        with self.condition:
+            return len([
+                line for line in self.pending + self.back if line is not None
+            ]) + (self.marquee is not None) + (self.power is not None) \
+                + (self.backlight is not None)
+
+    def wait(self, stop: Event, timeout: float = None) -> None:
+        """ Block until something is pending, the stop event is set or
+            the timeout in seconds passed.
+        """
+        end = None if timeout is None else monotonic() + timeout
+        with self.condition:
+            while not self.has_pending() and not stop.is_set():
+                remaining = None if end is None else end - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                self.condition.wait(remaining)
+
+    def wake(self) -> None:
+        """ Wake up all waiting writers to check their stop event """
+        with self.condition:
+            self.condition.notify_all()
+
+
 class Display:
-    def __init__(self, identifier: hex) -> None:
+    def __init__(self, identifier: hex, scheduler=None, timing=None,
+                 timing_store=None, bus_factory=None,
+                 rom: str = "A00", init: bool = True) -> None:
         """
             Creates the display.
             location and identifier is given by the matrix via user input.
             locked_display and data_id is used by the matrix to decide if it
             is the correct display to display text on.
-            A msg queue and thread is created to deliver message in realtime to
-            the board.
+            A mailbox is created to deliver message in realtime to
+            the board. If a BusScheduler is given, its worker writes the
+            queued messages, otherwise the display starts its own thread.
+            timing is a TimingProfile, a profile name or "calibrate".
+            A profile saved in the timing_store is used instead of
+            calibrating again.
+            bus_factory opens the bus of a display without scheduler.
+            The identifier is an address on bus 1, a (bus, address) tuple
+            or (bus, address, mux_address, mux_channel) for a display
+            behind a TCA9548A multiplexer.
+            rom is the character ROM of the controller, "A00" or "A02".
+            Without init the LCD is not initialised, the caller has to
+            initialise or warm start it. Calibrating always initialises.
         """
         self.identifier = identifier
+        self.rom = rom
+        self.init = init
+        self.bus_number, self.address, self.mux = \
+            parse_identifier(identifier)
+        if self.mux and not scheduler:
+            raise ValueError(
+                "Displays behind a multiplexer need a BusScheduler"
+            )
+        self.scheduler = scheduler
+        self.bus_factory = bus_factory
+        self.timing_store = timing_store
+        if timing_store and timing in [None, "calibrate"]:
+            timing = timing_store.load(self.name) or timing
+        self.timing = timing
+        # Bitmaps of the custom chars, shared with every LCD of the display
+        self.glyphs = dict(GLYPHS)
         self.lcd = self.create_lcd()
-        self.locked = False
-        self.data_id = None
+        if timing_store:
+            timing_store.save(self.name, self.timing)
+        # position and location in the matrix and callback on data_id or
+        # lock changes, all are set by the matrix
+        self.position = None
+        self.location = None
+        self.on_change = None
+        self._locked = False
+        self._data_id = None
+        # Priority class of the shown data, lower is written first by
+        # the BusScheduler. Set by the FlowController.
+        self.priority = 1
+        # Metrics recording latency and write time, None disables them
+        self.metrics = None
         self.current_lines = ["", ""]
-        self.msg_queue = Queue()
-        self.thread = Thread(
-            target=self.display_thread,
-            args=()
-        )
+        # Running Marquee, only used by the thread writing to the board
+        self.marquee = None
+        self.mailbox = Mailbox()
+        self.thread = None
         self.thread_exit = Event()
-        self.thread.start()
+        # Set by stop, the thread writes the pending lines and ends
+        self.stopping = False
+        if self.scheduler:
+            self.mailbox.listener = lambda: self.scheduler.notify(self)
+            self.scheduler.register(self)
+        else:
+            self.start_thread()
 
     def create_lcd(self) -> LCD:
         try:
-            lcd = LCD(2, self.identifier, True)
-            return lcd
+            if self.scheduler:
+                with self.scheduler.bus_lock:
+                    self.scheduler.select_channel(self.mux)
+                    return self.init_lcd(self.scheduler.bus)
+            if self.bus_factory:
+                return self.init_lcd(self.bus_factory(self.bus_number))
+            return self.init_lcd(SMBus(self.bus_number))
         except OSError as e:
             if e.errno == 5:
                 raise LCDIdentifierDoesNotExist(self.identifier)
             else:
                 raise LCDUnkownError("Display Create", e)
 
+    @property
+    def data_id(self):
+        return self._data_id
+
+    @data_id.setter
+    def data_id(self, data_id) -> None:
+        old = self._data_id
+        if self.on_change and old != data_id:
+            # Update the index first so a failure keeps the old data_id
+            self.on_change(self, "data_id", old, data_id)
+        self._data_id = data_id
+
+    @property
+    def locked(self) -> bool:
+        return self._locked
+
+    @locked.setter
+    def locked(self, locked: bool) -> None:
+        old = self._locked
+        self._locked = locked
+        if self.on_change and old != locked:
+            self.on_change(self, "locked", old, locked)
+
+    @property
+    def name(self) -> str:
+        """ Readable identifier, the address for displays on bus 1 """
+        name = hex(self.address)
+        if self.bus_number != 1 or self.mux:
+            name = f"{self.bus_number}:{name}"
+        if self.mux:
+            name += f"/{hex(self.mux[0])}.{self.mux[1]}"
+        return name
+
+    def init_lcd(self, bus=None) -> LCD:
+        """ Initialise the LCD and calibrate its timing if requested """
+        if self.timing == "calibrate":
+            lcd = LCD(2, self.address, True, bus=bus, glyphs=self.glyphs,
+                      rom=self.rom)
+            self.timing = calibrate(lcd)
+            return lcd
+        lcd = LCD(2, self.address, True, bus=bus, timing=self.timing,
+                  glyphs=self.glyphs, rom=self.rom, init=self.init)
+        self.timing = lcd.timing
+        return lcd
+
+    def enable_metrics(self, metrics) -> None:
+        """ Record the time from queueing a line until it is shown and
+            the time writing it takes in metrics
+        """
+        self.metrics = metrics
+        self.mailbox.timestamps = metrics is not None
+
+    def register_glyph(self, char: str, bitmap: list) -> None:
+        """ Show char using a 5x8 bitmap of 8 rows with 5 bits each.
+            The bitmap is loaded into the CGRAM when char is displayed.
+        """
+        self.lcd.glyphs.register(char, bitmap)
+        self.lcd.charmap.forget(char)
+
     def is_on(self) -> bool:
         """ Check if the Event flag is set"""
         if self.thread_exit.is_set():
@@ -82,23 +385,61 @@ class Display:
 
     def turn_off(self) -> None:
         """ Toggle display off by setting Backlight off and setting the
-            Event flag """
-        self.lcd = self.create_lcd()
+            Event flag. The text of the display is kept.
+        """
         if self.is_on():
+            self.mailbox.put_power(False)
             self.thread_exit.set()
+            self.mailbox.wake()
 
     def turn_on(self) -> None:
         """ Toggle display on by setting the Backlight to on and removing
             the Event Flag. Creating a thread to handle displaying data
         """
         if not self.is_on():
-            self.lcd = self.create_lcd()
             self.thread_exit.clear()
-            self.thread = Thread(
-                target=self.display_thread,
-                args=()
-            )
-            self.thread.start()
+            if self.scheduler:
+                self.mailbox.put_power(True)
+                return
+            if self.thread:
+                # Wait for the thread to switch the display off
+                self.thread.join()
+            self.mailbox.put_power(True)
+            self.start_thread()
+
+    def set_backlight(self, on: bool) -> None:
+        """ Switch only the backlight with a single write to the
+            PCF8574. The text stays visible and nothing is rewritten.
+            Given while the display is off it is applied after turning
+            the display on, which switches the backlight on otherwise.
+        """
+        self.mailbox.put_backlight(on)
+
+    def start_thread(self) -> None:
+        """ Start the thread writing the queued messages to the board. """
+        self.thread = Thread(
+            target=self.display_thread,
+            args=()
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ End the thread of a display without BusScheduler after the
+            pending lines are written. The display stays on.
+        """
+        if not self.thread:
+            return
+        if not self.is_on():
+            # The thread ends after switching the board off
+            self.thread.join()
+            return
+        self.stopping = True
+        self.thread_exit.set()
+        self.mailbox.wake()
+        self.thread.join()
+        self.thread = None
+        self.thread_exit.clear()
+        self.stopping = False
 
     def set_long_line(self, text) -> None:
         """ Split a long line into 2 parts containing 16 chars.
@@ -106,16 +447,31 @@ class Display:
         """
         self.set_text(line1=text[:16], line2=text[16:32])
 
+    def start_marquee(self, line1: str, line2: str = None,
+                      speed: float = 4.0, offset: int = 0,
+                      start: float = None) -> None:
+        """ Scroll up to 40 chars per line from right to left with speed
+            steps per second. Longer text is scrolled as well, but the
+            DDRAM has to be rewritten while the window wraps.
+            Setting text or starting another marquee ends the marquee.
+        """
+        self.mailbox.put_marquee(
+            Marquee([line1, line2], speed, offset, start,
+                    encode=self.lcd.charmap.encode)
+        )
+
+    def stop_marquee(self) -> None:
+        """ End a running marquee, the display is shown unshifted """
+        self.mailbox.put_marquee(False)
+
     def set_text(self, line1: str, line2: str) -> None:
-        """ Remove all current data from the message queue.
-            Adding the new data to the queue.
+        """ Replace the pending text in the mailbox with the new data.
+            A line set to None keeps its pending or current text.
         """
-        while self.msg_queue.qsize() > 0:
-            self.msg_queue.get()
-        self.msg_queue.put([
-            f"{line1}",
-            f"{line2}"
-        ])
+        self.mailbox.put(
+            None if line1 is None else f"{line1}",
+            None if line2 is None else f"{line2}"
+        )
 
     def set_line(self, text: str, line: int = 1) -> None:
         """ If there is the need to just modify one line of a display
@@ -129,23 +485,119 @@ class Display:
         else:
             self.set_text(line1=None, line2=text)
 
+    def pending_lines(self) -> list:
+        """ Text of both lines once the pending lines are written """
+        with self.mailbox.condition:
+            lines = []
+            for back, pending, writing, current in zip(
+                self.mailbox.back, self.mailbox.pending,
+                self.mailbox.writing, self.current_lines
+            ):
+                if back is not None:
+                    lines.append(back)
+                elif pending is not None:
+                    lines.append(pending)
+                elif writing is not None:
+                    lines.append(writing)
+                else:
+                    lines.append(current or "")
+            return lines
+
+    def write_pending(self) -> bool:
+        """ Write a single pending line to the board.
+            Returns True if there are more lines waiting to be written.
+            Power commands are applied first, other commands are not
+            written while the display is turned off.
+        """
+        power = self.mailbox.take_power()
+        if power is not None:
+            self.lcd.power(power)
+        if not self.is_on() and not self.stopping:
+            return False
+        backlight = self.mailbox.take_backlight()
+        if backlight is not None:
+            self.lcd.set_backlight(backlight)
+        command = self.mailbox.take_marquee()
+        if command is not None:
+            self.end_marquee(freeze=not command)
+            if command:
+                command.reset()
+                self.marquee = command
+            return self.mailbox.has_pending()
+        pending = self.mailbox.take_line()
+        if pending:
+            self.end_marquee()
+            index, line, since = pending
+            try:
+                if self.current_lines[index] != line:
+                    start = perf_counter()
+                    self.lcd.message(line, index + 1)
+                    self.current_lines[index] = line
+                    if self.metrics is not None:
+                        self.metrics.observe(
+                            "line_write_seconds", perf_counter() - start,
+                            (("display", self.name),)
+                        )
+            finally:
+                self.mailbox.line_written(index)
+            if self.metrics is not None and since is not None:
+                self.metrics.observe(
+                    "glass_latency_seconds", perf_counter() - since,
+                    (("display", self.name),)
+                )
+        elif self.marquee and self.marquee.due():
+            self.step_marquee()
+        return self.mailbox.has_pending()
+
+    def step_marquee(self) -> None:
+        """ Write the cells scrolling into view and shift the display.
+            The first step loads the whole DDRAM.
+        """
+        marquee = self.marquee
+        for line, cell, codes in marquee.writes(marquee.step):
+            self.lcd.write_ddram(line, cell, codes)
+        if marquee.step:
+            self.lcd.shift_display()
+        marquee.advance()
+
+    def end_marquee(self, freeze: bool = True) -> None:
+        """ Undo the display shift of a running marquee.
+            With freeze the text visible right now is kept on the display.
+        """
+        if not self.marquee:
+            return
+        marquee = self.marquee
+        self.marquee = None
+        self.lcd.return_home()
+        self.current_lines = [None, None]
+        if not freeze:
+            return
+        for line, visible in enumerate(marquee.visible()):
+            self.lcd.message(visible, line + 1)
+            self.current_lines[line] = visible
+
+    def next_deadline(self) -> float:
+        """ monotonic time of the next marquee step, None without one """
+        if not self.marquee or not self.is_on():
+            return None
+        return self.marquee.next_step
+
     def display_thread(self) -> None:
         """ Thread to set the text of a display.
             It takes some time to display the text to the display.
-            So while the data is printed new text may be added to the queue.
+            So while the data is printed new text may be added to the mailbox.
             The thread picks it up and displays it after finishing displaying
-            the previous text.
+            the previous text. Without pending text the thread sleeps until
+            it is woken by the mailbox. The thread ends when the display is
+            turned off after switching off the board or after writing the
+            pending lines when the display is stopped.
         """
         while not self.thread_exit.is_set():
-            if self.msg_queue.qsize() > 0:
-                new_lines = self.msg_queue.get()
-                if (new_lines[0] is not None
-                        and self.current_lines[0] != new_lines[0]):
-                    self.lcd.message(f"{new_lines[0]}", 1)
-                    self.current_lines[0] = new_lines[0]
-                if (new_lines[1] is not None
-                        and self.current_lines[1] != new_lines[1]):
-                    self.lcd.message(f"{new_lines[1]}", 2)
-                    self.current_lines[1] = new_lines[1]
-            else:
-                sleep(.1)
+            if not self.write_pending():
+                deadline = self.next_deadline()
+                self.mailbox.wait(
+                    self.thread_exit,
+                    None if deadline is None else deadline - monotonic()
+                )
+        while self.write_pending() and self.stopping:
+            pass
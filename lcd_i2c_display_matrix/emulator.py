@@ -0,0 +1,277 @@
+from threading import RLock
+from time import sleep
+
+# Example usage:
+# bus = SimulatedSMBus(addresses=[0x20, 0x21])
+# matrix = Matrix([0x20, 0x21], bus_factory=lambda number: bus)
+# matrix.display_on_next(["Hello", "World"], "hello")
+# print(bus.devices[0x20].visible_lines())
+#
+# A wall of 20 displays on 3 simulated buses
+#     identifiers, buses = simulated_buses(20)
+#     matrix = Matrix(identifiers, bus_factory=lambda number: buses[number])
+
+# PCF8574 port bits of the common 1602 I2C backpack
+RS = 0b00000001
+RW = 0b00000010
+ENABLE = 0b00000100
+BACKLIGHT = 0b00001000
+
+DDRAM_LINE_LENGTH = 40
+
+
+class HD44780Emulator:
+    def __init__(self, width: int = 16) -> None:
+        """
+            In memory model of a HD44780 connected to a PCF8574.
+            Decodes the port bytes written to the expander into nibbles on
+            the falling edge of enable and executes the resulting commands
+            on a DDRAM of two lines with 40 cells each.
+        """
+        self.width = width
+        self.port = 0
+        self.eight_bit = True
+        self.high_nibble = None
+        self.read_nibble = 0
+        self.ddram = [
+            [0x20] * DDRAM_LINE_LENGTH,
+            [0x20] * DDRAM_LINE_LENGTH
+        ]
+        self.cgram = [0] * 64
+        self.address = 0
+        self.cgram_mode = False
+        self.increment = 1
+        self.shift = 0
+        self.display_on = False
+        self.backlight = False
+        self.commands = 0
+        self.characters = 0
+
+    def write(self, value: int) -> None:
+        """ A byte written to the PCF8574 port """
+        falling = self.port & ENABLE and not value & ENABLE
+        self.port = value
+        self.backlight = bool(value & BACKLIGHT)
+        if not falling:
+            return
+        if value & RW:
+            self._read_strobe(value)
+            return
+        nibble = value >> 4
+        if self.eight_bit:
+            # Only the upper 4 data pins are connected
+            self._execute(nibble << 4, value & RS)
+        elif self.high_nibble is None:
+            self.high_nibble = nibble
+        else:
+            self._execute((self.high_nibble << 4) | nibble, value & RS)
+            self.high_nibble = None
+
+    def read(self) -> int:
+        """ The byte read back from the PCF8574 port """
+        if not self.port & RW or not self.port & ENABLE:
+            return self.port
+        if self.port & RS:
+            data = self.ddram_read()
+        else:
+            # Busy flag is never set, the controller is emulated instantly
+            data = self.address & 0x7F
+        if self.read_nibble == 0:
+            nibble = data >> 4
+        else:
+            nibble = data & 0x0F
+        return (self.port & 0x0F) | (nibble << 4)
+
+    def _read_strobe(self, value: int) -> None:
+        """ Enable dropped while reading, advance to the next nibble """
+        if self.read_nibble == 0:
+            self.read_nibble = 1
+            return
+        self.read_nibble = 0
+        if value & RS:
+            self._advance()
+
+    def ddram_read(self) -> int:
+        line, cell = divmod(self.address, 0x40)
+        return self.ddram[line % 2][cell % DDRAM_LINE_LENGTH]
+
+    def _advance(self) -> None:
+        """ Move the address counter like the controller does """
+        if self.cgram_mode:
+            self.address = (self.address + self.increment) % 64
+            return
+        line, cell = divmod(self.address, 0x40)
+        cell += self.increment
+        if cell >= DDRAM_LINE_LENGTH:
+            line, cell = (line + 1) % 2, 0
+        elif cell < 0:
+            line, cell = (line + 1) % 2, DDRAM_LINE_LENGTH - 1
+        self.address = (line % 2) * 0x40 + cell
+
+    def _execute(self, bits: int, data: bool) -> None:
+        if data:
+            self.characters += 1
+            if self.cgram_mode:
+                self.cgram[self.address % 64] = bits & 0x1F
+            else:
+                line, cell = divmod(self.address, 0x40)
+                self.ddram[line % 2][cell % DDRAM_LINE_LENGTH] = bits
+            self._advance()
+            return
+        self.commands += 1
+        if bits & 0x80:
+            self.cgram_mode = False
+            self.address = bits & 0x7F
+        elif bits & 0x40:
+            self.cgram_mode = True
+            self.address = bits & 0x3F
+        elif bits & 0x20:
+            # Function set, DL bit selects 8 or 4 bit mode
+            self.eight_bit = bool(bits & 0x10)
+            self.high_nibble = None
+        elif bits & 0x10:
+            # Cursor or display shift
+            if bits & 0x08:
+                step = 1 if bits & 0x04 else -1
+                self.shift = (self.shift - step) % DDRAM_LINE_LENGTH
+        elif bits & 0x08:
+            self.display_on = bool(bits & 0x04)
+        elif bits & 0x04:
+            self.increment = 1 if bits & 0x02 else -1
+        elif bits & 0x02:
+            self.address = 0
+            self.cgram_mode = False
+            self.shift = 0
+        elif bits & 0x01:
+            self.ddram = [
+                [0x20] * DDRAM_LINE_LENGTH,
+                [0x20] * DDRAM_LINE_LENGTH
+            ]
+            self.address = 0
+            self.cgram_mode = False
+            self.increment = 1
+            self.shift = 0
+
+    def visible_codes(self) -> list:
+        """ Character codes currently visible on both lines """
+        return [
+            [
+                line[(self.shift + column) % DDRAM_LINE_LENGTH]
+                for column in range(self.width)
+            ]
+            for line in self.ddram
+        ]
+
+    def visible_lines(self) -> list:
+        """ Text currently visible on both lines """
+        if not self.display_on:
+            return ["", ""]
+        return [
+            "".join(chr(code) for code in line).rstrip()
+            for line in self.visible_codes()
+        ]
+
+
+class SimulatedSMBus:
+    def __init__(self, bus_number: int = 1, addresses: list = None,
+                 clock: int = 100000, realtime: bool = False,
+                 listener=None) -> None:
+        """
+            SMBus replacement with an emulated display for every address.
+            Transactions and bytes are counted and the time each transaction
+            takes on a bus with the given clock is added to bus_time.
+            With realtime the calls sleep for that time like a real bus.
+            The listener is called with (address, device) after every
+            write transaction.
+        """
+        self.bus_number = bus_number
+        if addresses is None:
+            addresses = list(range(0x20, 0x28))
+        self.devices = {address: HD44780Emulator() for address in addresses}
+        self.clock = clock
+        self.realtime = realtime
+        self.listener = listener
+        self.lock = RLock()
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_time = 0.0
+        self.address_bytes = {address: 0 for address in addresses}
+
+    def _device(self, address: int) -> HD44780Emulator:
+        if address not in self.devices:
+            # Nobody acknowledged the address
+            raise OSError(5, "Input/output error")
+        return self.devices[address]
+
+    def _transaction(self, address: int, length: int) -> None:
+        """ Account one transaction with length data bytes """
+        # Start, address byte and every data byte with ack, stop
+        duration = (2 + 9 * (length + 1)) / self.clock
+        self.transactions += 1
+        self.bytes += length + 1
+        self.address_bytes[address] += length + 1
+        self.bus_time += duration
+        if self.realtime:
+            sleep(duration)
+
+    def _write(self, address: int, data) -> None:
+        with self.lock:
+            device = self._device(address)
+            self._transaction(address, len(data))
+            for value in data:
+                device.write(value)
+        if self.listener:
+            self.listener(address, device)
+
+    def write_byte(self, address: int, value: int) -> None:
+        self._write(address, [value])
+
+    def write_i2c_block_data(self, address: int, register: int,
+                             data: list) -> None:
+        self._write(address, [register] + list(data))
+
+    def read_byte(self, address: int) -> int:
+        with self.lock:
+            device = self._device(address)
+            self._transaction(address, 1)
+            return device.read()
+
+    def i2c_rdwr(self, *messages) -> None:
+        for message in messages:
+            self._write(message.addr, list(message))
+
+    def close(self) -> None:
+        pass
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.transactions = 0
+            self.bytes = 0
+            self.bus_time = 0.0
+            self.address_bytes = {address: 0 for address in self.devices}
+
+
+def simulated_buses(displays: int = 8, clock: int = 100000,
+                    realtime: bool = True, listener=None) -> tuple:
+    """ Identifiers for displays displays and the SimulatedSMBus of
+        every bus number. Every bus holds 8 displays, larger walls use
+        additional buses.
+        Returns (identifiers, {bus number: SimulatedSMBus}).
+    """
+    identifiers = [
+        (1 + index // 8, 0x20 + index % 8) for index in range(displays)
+    ]
+    addresses = {}
+    for bus_number, address in identifiers:
+        addresses.setdefault(bus_number, []).append(address)
+    buses = {
+        bus_number: SimulatedSMBus(
+            bus_number,
+            addresses=bus_addresses,
+            clock=clock,
+            realtime=realtime,
+            listener=listener
+        )
+        for bus_number, bus_addresses in addresses.items()
+    }
+    return identifiers, buses
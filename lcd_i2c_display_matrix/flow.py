@@ -0,0 +1,247 @@
+from collections import Counter
+from heapq import heappush, heappop
+from itertools import count
+from threading import Thread, Condition, RLock
+from time import monotonic
+from .matrix import id_key
+
+# Example usage:
+# flow = FlowController(
+#     matrix,
+#     rate=2,                           # every data_id at most 2 frames/s
+#     rates={"sensor": 5},
+#     classes={"fire": "alert", "news": "ticker"},
+#     max_age={"ticker": 1}             # drop ticker frames older than 1s
+# )
+# server = MatrixCommandReceiver(matrix, flow=flow)
+
+# Priority classes, a lower value is written first by the BusScheduler
+PRIORITIES = {"alert": 0, "normal": 1, "ticker": 2}
+# Classes of data_ids used unless classes sets them
+DEFAULT_CLASSES = {"maintainance": "alert", "service": "alert"}
+
+
+class Update:
+    def __init__(self, function, lines: list, data_id, priority: str,
+                 deadline: float, due: float = None) -> None:
+        """ Latest frame of a data_id waiting for its rate window
+            until due
+        """
+        self.function = function
+        self.lines = list(lines)
+        self.data_id = data_id
+        self.priority = priority
+        self.deadline = deadline
+        self.due = due
+
+    def merge(self, function, lines: list, deadline: float) -> None:
+        """ The latest frame wins, a line set to None keeps the pending one
+        """
+        self.function = function
+        for index, line in enumerate(lines[:2]):
+            if line is not None:
+                self.lines[index] = line
+        self.deadline = deadline
+
+
+class FlowController:
+    def __init__(self, matrix, rate: float = None, rates: dict = None,
+                 classes: dict = None, max_age: dict = None,
+                 executor=None) -> None:
+        """
+            Sits between the receiver and the matrix and limits how often
+            every data_id is written.
+            rate is the maximum number of frames per second of a data_id,
+            rates sets it for single data_ids, None is unlimited. Frames
+            arriving within the window of a data_id replace each other,
+            only the latest one is written when the window ends.
+            classes maps data_ids to a priority class of PRIORITIES.
+            Displays showing a higher class are written first by their
+            BusScheduler and a frame of the alert class is never delayed.
+            max_age sets for a class how long a frame may wait before it
+            is dropped instead of written. The age of a frame deferred by
+            the rate limit is counted from the end of its window, so the
+            latest frame of a data_id is not dropped for waiting on it.
+            Deferred frames are applied through executor.submit if given,
+            the MatrixCommandReceiver sets its matrix worker.
+            Frames without data_id are always written at once.
+        """
+        self.matrix = matrix
+        self.rate = rate
+        # Keyed by id_key, json data_ids may be lists or dicts
+        self.rates = {
+            id_key(data_id): value for data_id, value in (rates or {}).items()
+        }
+        self.classes = {
+            id_key(data_id): value
+            for data_id, value in DEFAULT_CLASSES.items()
+        }
+        self.classes.update(
+            (id_key(data_id), value)
+            for data_id, value in (classes or {}).items()
+        )
+        # Longest window of all data_ids, older entries of last_sent
+        # no longer defer anything
+        self.window = max(
+            (1 / value for value in [rate, *self.rates.values()] if value),
+            default=0
+        )
+        self.max_age = max_age or {}
+        self.executor = executor
+        # Serialises applying frames from the caller and the flow thread
+        self.lock = RLock()
+        self.condition = Condition()
+        # id_key -> monotonic time of the last written frame, oldest first
+        self.last_sent = {}
+        # id_key -> Update waiting for its window
+        self.pending = {}
+        # (due, priority, sequence, id_key) of the pending updates
+        self.queue = []
+        self.sequence = count()
+        # (counter, class) -> number of frames
+        # counters: received, written, coalesced, dropped
+        self.counters = Counter()
+        self.running = True
+        self.thread = Thread(target=self.flow_thread, args=(), daemon=True)
+        self.thread.start()
+
+    def priority_class(self, data_id) -> str:
+        return self.classes.get(id_key(data_id), "normal")
+
+    def interval(self, data_id, priority: str) -> float:
+        """ Minimal time between two frames of a data_id """
+        if priority == "alert":
+            return 0
+        rate = self.rates.get(id_key(data_id), self.rate)
+        return 1 / rate if rate else 0
+
+    def mark_sent(self, key: str, now: float) -> None:
+        """ Start the window of a data_id and forget the data_ids whose
+            window ended, called with the condition held
+        """
+        self.last_sent.pop(key, None)
+        self.last_sent[key] = now
+        while self.last_sent:
+            oldest = next(iter(self.last_sent))
+            if self.last_sent[oldest] + self.window > now:
+                return
+            del self.last_sent[oldest]
+
+    def submit(self, function, lines: list, data_id) -> tuple:
+        """ Write lines using a print function of the matrix, e.g.
+            matrix.display_on_next_or_id, or defer them until the rate
+            window of the data_id ends.
+            Returns ("written", result of function) or ("deferred", None),
+            ("coalesced", None) if a deferred frame was replaced and
+            ("dropped", None).
+        """
+        priority = self.priority_class(data_id)
+        self.count("received", priority)
+        if data_id is None:
+            return self.apply(
+                Update(function, lines, data_id, priority, None)
+            )
+        now = monotonic()
+        age = self.max_age.get(priority)
+        deadline = None if age is None else now + age
+        key = id_key(data_id)
+        with self.condition:
+            update = self.pending.get(key)
+            if update:
+                update.merge(function, lines,
+                             None if age is None else update.due + age)
+                self.counters["coalesced", priority] += 1
+                return "coalesced", None
+            due = self.last_sent.get(key, -1e9) \
+                + self.interval(data_id, priority)
+            if due > now:
+                self.pending[key] = Update(
+                    function, lines, data_id, priority,
+                    None if age is None else due + age, due
+                )
+                heappush(self.queue, (
+                    due, PRIORITIES[priority], next(self.sequence), key
+                ))
+                self.condition.notify()
+                return "deferred", None
+            self.mark_sent(key, now)
+        return self.apply(
+            Update(function, lines, data_id, priority, deadline)
+        )
+
+    def count(self, counter: str, priority: str) -> None:
+        with self.condition:
+            self.counters[counter, priority] += 1
+
+    def apply(self, update: Update) -> tuple:
+        """ Write an update and mark the displays showing it with its
+            priority class. An update waiting beyond its deadline, e.g.
+            behind other work of the matrix worker, is dropped.
+            Returns ("written", result of the function) or ("dropped", None).
+        """
+        if update.deadline is not None and update.deadline < monotonic():
+            self.count("dropped", update.priority)
+            return "dropped", None
+        with self.lock:
+            result = update.function(update.lines, update.data_id)
+            for position in self.matrix.data_id_positions(update.data_id):
+                self.matrix.displays[position].priority = \
+                    PRIORITIES[update.priority]
+        self.count("written", update.priority)
+        return "written", result
+
+    def flow_thread(self) -> None:
+        """ Writes the pending updates when their window ends """
+        while True:
+            with self.condition:
+                while self.running and (
+                    not self.queue or self.queue[0][0] > monotonic()
+                ):
+                    timeout = None
+                    if self.queue:
+                        timeout = self.queue[0][0] - monotonic()
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                now = monotonic()
+                due = []
+                while self.queue and self.queue[0][0] <= now:
+                    key = heappop(self.queue)[3]
+                    due.append(self.pending.pop(key))
+                    self.mark_sent(key, now)
+            for update in due:
+                if self.executor:
+                    self.executor.submit(self.apply, update)
+                else:
+                    self.apply(update)
+
+    def depth(self) -> int:
+        """ Number of frames waiting for their window """
+        with self.condition:
+            return len(self.pending)
+
+    def stats(self) -> dict:
+        """ Returns {counter: {class: frames}} """
+        stats = {}
+        with self.condition:
+            counters = list(self.counters.items())
+        for (counter, priority), value in counters:
+            stats.setdefault(counter, {})[priority] = value
+        return stats
+
+    def collect_metrics(self) -> list:
+        """ Frame counters for Metrics """
+        with self.condition:
+            counters = list(self.counters.items())
+        return [
+            ("flow_frames_total", "counter",
+             (("counter", counter), ("class", priority)), value)
+            for (counter, priority), value in counters
+        ]
+
+    def stop(self) -> None:
+        """ Stops the thread, pending updates are not written """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
@@ -0,0 +1,165 @@
+from collections import OrderedDict
+
+# Example usage:
+# display.register_glyph("♥", [0, 10, 31, 31, 14, 4, 0, 0])
+# display.set_text(f"I {'♥'} LCDs", progress_bar(0.42, 16))
+
+# Number of CGRAM slots of the HD44780, DDRAM codes 0-7 show them
+CGRAM_SLOTS = 8
+
+# Full block, part of the A00 ROM and a glyph on A02
+FULL_BLOCK = "█"
+
+
+def _columns(count: int) -> list:
+    """ Bitmap with the left count columns of all rows set """
+    return [(0b11111 << (5 - count)) & 0b11111] * 8
+
+
+def _rows(count: int) -> list:
+    """ Bitmap with the bottom count rows set """
+    return [0] * (8 - count) + [0b11111] * count
+
+
+# 5x8 bitmaps of chars which are missing in one of the character ROMs.
+# Chars which are part of the ROM in use are never shown by a glyph.
+# Every row is given by 5 bits, the first row is the top one.
+GLYPHS = {
+    "Ä": [0b01010, 0b00000, 0b01110, 0b10001,
+          0b11111, 0b10001, 0b10001, 0b00000],
+    "Ö": [0b01010, 0b00000, 0b01110, 0b10001,
+          0b10001, 0b10001, 0b01110, 0b00000],
+    "Ü": [0b01010, 0b00000, 0b10001, 0b10001,
+          0b10001, 0b10001, 0b01110, 0b00000],
+    "↑": [0b00100, 0b01110, 0b10101, 0b00100,
+          0b00100, 0b00100, 0b00100, 0b00000],
+    "↓": [0b00100, 0b00100, 0b00100, 0b00100,
+          0b10101, 0b01110, 0b00100, 0b00000],
+    "→": [0b00000, 0b00100, 0b00010, 0b11111,
+          0b00010, 0b00100, 0b00000, 0b00000],
+    "←": [0b00000, 0b00100, 0b01000, 0b11111,
+          0b01000, 0b00100, 0b00000, 0b00000],
+    "\\": [0b00000, 0b10000, 0b01000, 0b00100,
+           0b00010, 0b00001, 0b00000, 0b00000],
+    "~": [0b00000, 0b00000, 0b01000, 0b10101,
+          0b00010, 0b00000, 0b00000, 0b00000],
+    "€": [0b00110, 0b01001, 0b11110, 0b01000,
+          0b11110, 0b01001, 0b00110, 0b00000],
+    # Horizontal bars, 1-4 of 5 columns and the full block
+    "▏": _columns(1),
+    "▎": _columns(2),
+    "▍": _columns(3),
+    "▌": _columns(4),
+    "█": _columns(5),
+    # Vertical bars, 1-7 of 8 rows
+    "▁": _rows(1),
+    "▂": _rows(2),
+    "▃": _rows(3),
+    "▄": _rows(4),
+    "▅": _rows(5),
+    "▆": _rows(6),
+    "▇": _rows(7),
+}
+
+# Partial cells of progress_bar and levels of sparkline
+HORIZONTAL_BARS = " ▏▎▍▌"
+VERTICAL_BARS = " ▁▂▃▄▅▆▇" + FULL_BLOCK
+
+
+def progress_bar(value: float, width: int = 16) -> str:
+    """ Bar of width cells filled to value (0-1) in steps of a column """
+    columns = round(min(max(value, 0), 1) * width * 5)
+    full, partial = divmod(columns, 5)
+    bar = FULL_BLOCK * full
+    if full < width:
+        bar += HORIZONTAL_BARS[partial]
+    return bar.ljust(width)
+
+
+def sparkline(values: list, minimum: float = None,
+              maximum: float = None) -> str:
+    """ One cell per value, scaled from minimum to maximum """
+    if not values:
+        return ""
+    minimum = min(values) if minimum is None else minimum
+    maximum = max(values) if maximum is None else maximum
+    span = (maximum - minimum) or 1
+    levels = len(VERTICAL_BARS) - 1
+    return "".join(
+        VERTICAL_BARS[round(min(max((value - minimum) / span, 0), 1) * levels)]
+        for value in values
+    )
+
+
+class GlyphManager:
+    def __init__(self, lcd, registry: dict = None) -> None:
+        """
+            Loads the bitmaps of custom chars into the 8 CGRAM slots of
+            an LCD on demand.
+            registry maps chars to their bitmap, it defaults to GLYPHS and
+            can be shared with the owner of the LCD to register chars.
+            A slot is identified by its bitmap, so a bitmap which is
+            already loaded is never uploaded again. If all slots are used
+            the least recently used bitmap which is not visible is
+            replaced.
+        """
+        self.lcd = lcd
+        self.registry = GLYPHS if registry is None else registry
+        # Bitmap of every slot, None if the slot is empty
+        self.slots = [None] * CGRAM_SLOTS
+        # Slots ordered from least to most recently used
+        self.usage = OrderedDict()
+        self.uploads = 0
+
+    def register(self, char: str, bitmap: list) -> None:
+        if len(bitmap) != 8:
+            raise ValueError("A glyph bitmap needs 8 rows")
+        self.registry[char] = [row & 0b11111 for row in bitmap]
+
+    def upload(self, slot: int, bitmap: tuple) -> None:
+        """ Write a bitmap to a CGRAM slot """
+        self.lcd.write_sequence(
+            self.lcd.byte_sequence([0x40 | slot << 3], self.lcd.LCD_CMD)
+            + self.lcd.byte_sequence(bitmap, self.lcd.LCD_CHR)
+        )
+        self.slots[slot] = bitmap
+        self.uploads += 1
+
+    def loaded_slot(self, char: str) -> int:
+        """ Returns the slot holding the glyph of char, None if it is not
+            loaded
+        """
+        bitmap = self.registry.get(char)
+        if bitmap is None or tuple(bitmap) not in self.slots:
+            return None
+        return self.slots.index(tuple(bitmap))
+
+    def slot(self, char: str, protected: set) -> int:
+        """ Returns the slot showing char, loads it if needed.
+            Slots in protected are visible and are not replaced.
+            Returns None if the char is not registered or no slot is free.
+        """
+        bitmap = self.registry.get(char)
+        if bitmap is None:
+            return None
+        bitmap = tuple(bitmap)
+        if bitmap in self.slots:
+            slot = self.slots.index(bitmap)
+        elif None in self.slots:
+            slot = self.slots.index(None)
+            self.upload(slot, bitmap)
+        else:
+            slot = next(
+                (slot for slot in self.usage if slot not in protected), None
+            )
+            if slot is None:
+                return None
+            self.upload(slot, bitmap)
+        self.usage.pop(slot, None)
+        self.usage[slot] = True
+        return slot
+
+    def invalidate(self) -> None:
+        """ Forget the CGRAM content, e.g. after the LCD was reset """
+        self.slots = [None] * CGRAM_SLOTS
+        self.usage.clear()
@@ -1,137 +1,594 @@
-from socket import socket, AF_INET, SOCK_STREAM
-from selectors import DefaultSelector, EVENT_READ
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_REUSEADDR
+from socket import IPPROTO_IP, IP_ADD_MEMBERSHIP, inet_aton
 from types import SimpleNamespace
-from json import loads
+from json import loads, dumps
 from json.decoder import JSONDecodeError
 from netifaces import ifaddresses
-from time import sleep
 from .matrix import Matrix as LCDMatrix
+from .protocol import LineDecoder, BinaryDecoder, BINARY_MAGIC
+from .protocol import FLAG_NO_ID, PRINT_COMMANDS, OPCODE_NAMES
+from .protocol import OP_CLOSE, OP_EXIT, OP_SELFTEST, OP_INTERN
+from .protocol import OP_LOCK_ID, OP_LOCK_INDEX
+from .protocol import OP_UNLOCK_ID, OP_UNLOCK_INDEX
+from .protocol import OP_BATCH_BEGIN, OP_BATCH_END
+from .protocol import DATAGRAM_COMMANDS, MAX_INTERNED, MAX_SEQUENCES
+from .protocol import OUTCOME_DISPLAYED, OUTCOME_COALESCED, OUTCOME_OK
+from .protocol import OUTCOME_NO_DISPLAY, OUTCOME_LOCKED, OUTCOME_INVALID
 
 # Example usage:
 # if __name__ == "__main__":
 #     matrix = LCDMatrix([...])
 #     server = MatrixCommandReceiver(matrix)
 #     server.start()
+#
+# Listen on a fixed address instead of the address of wlan0
+#     server = MatrixCommandReceiver(matrix, "0.0.0.0", 8080)
+#
+# Limit the frame rate of every data_id, see flow.py
+#     server = MatrixCommandReceiver(matrix, flow=FlowController(matrix, 2))
+#
+# Serve the metrics of a matrix in the Prometheus text format, see metrics.py
+#     matrix = LCDMatrix([...], metrics=Metrics())
+#     server = MatrixCommandReceiver(matrix, metrics_port=9100)
+#
+# Record all received commands to replay them later, see replay.py
+#     server = MatrixCommandReceiver(matrix, recorder=CommandRecorder(path))
+#
+# Accept print commands as UDP datagrams sent to a multicast group as well,
+# see MatrixDatagramSender
+#     server = MatrixCommandReceiver(matrix, udp_port=5005,
+#                                    multicast_group="239.0.0.42")
+#
+# Messages with "ack" are answered with their outcome and the queue depth,
+# see AsyncMatrixCommandSender
+
+
+class DatagramHandler(asyncio.DatagramProtocol):
+    def __init__(self, receiver) -> None:
+        """ Hands received datagrams to the matrix worker """
+        self.receiver = receiver
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        receiver = self.receiver
+        if receiver.backlog >= receiver.max_backlog:
+            # The matrix worker is behind, UDP has no backpressure
+            receiver.count("messages_dropped_total", "overload")
+            return
+        receiver.backlog += 1
+        receiver.loop.run_in_executor(
+            receiver.executor, receiver.handle_datagram, data
+        ).add_done_callback(self.done)
+
+    def done(self, future) -> None:
+        self.receiver.backlog -= 1
 
 
 class MatrixCommandReceiver:
-    def __init__(self, matrix) -> None:
+    def __init__(self, matrix, address: str = None, port: int = 80,
+                 interface: str = "wlan0", max_line: int = 65536,
+                 flow=None, metrics=None,
+                 metrics_port: int = None, recorder=None,
+                 udp_port: int = None,
+                 multicast_group: str = None,
+                 max_backlog: int = 256) -> None:
+        """ Listens on address:port, defaults to the address of the
+            given network interface.
+            Every connection is served by the asyncio event loop. The
+            matrix is only used by a single worker thread so a slow
+            display operation never blocks the event loop and commands
+            are applied in the order they were received.
+            A connection starting with BINARY_MAGIC uses the binary
+            protocol, all other connections send json lines.
+            Print commands using a data_id pass the FlowController flow
+            if one is given.
+            metrics defaults to the Metrics of the matrix. Received
+            messages are counted there, the stats command replies with all
+            values and with metrics_port they are served over HTTP.
+            A CommandRecorder recorder logs every received command except
+            stats, binary frames as the json message doing the same. It
+            is closed when the receiver stops.
+            Port 0 listens on a free port, port is set once listening.
+            The threading.Event ready is set when all sockets listen.
+            With udp_port print and batch commands are also accepted as
+            UDP datagrams, which joins multicast_group if given. Stale
+            datagrams are dropped using the sequence numbers of their
+            data_ids. Other commands need the TCP connection. Datagrams
+            arriving while max_backlog messages wait for the matrix worker
+            are dropped, so a flood does not hold up the TCP commands.
+            A json message with "ack" is answered with its outcome and the
+            queue_depth on its connection.
+        """
         if not isinstance(matrix, LCDMatrix):
             print("Given Matrix is not a valid 1602 LCDMatrix")
             exit(1)
         self.matrix = matrix
+        self.address = address
+        self.port = port
+        self.interface = interface
+        self.max_line = max_line
         self.state = False
-        self.selector = DefaultSelector()
-        self.selector.register(self._get_lsock(), EVENT_READ, data=None)
+        self.ready = Event()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.flow = flow
+        if flow and not flow.executor:
+            flow.executor = self.executor
+        self.metrics = matrix.metrics if metrics is None else metrics
+        self.metrics_port = metrics_port
+        self.recorder = recorder
+        self.udp_port = udp_port
+        self.multicast_group = multicast_group
+        # json encoded data_id -> last sequence number received by UDP,
+        # least recently updated first
+        self.sequences = {}
+        if self.metrics is not None and flow:
+            self.metrics.add_collector(flow.collect_metrics)
+        self.loop = None
+        self.stop_event = None
+        self.connections = {}
+        # Messages handed to the matrix worker and not finished
+        self.backlog = 0
+        self.max_backlog = max_backlog
+        # Dispatch tables, json commands are checked in this order
+        self.json_commands = {
+            "exit": self.on_exit,
+            "selftest": self.on_selftest,
+            "lock": self.on_lock,
+            "unlock": self.on_unlock,
+            "batch": self.on_batch,
+            "print": self.on_print,
+            "stats": self.on_stats,
+        }
+        self.print_commands = {
+            "on_id": (matrix.display_on_id, "id"),
+            "on_index": (matrix.display_on_index, "index"),
+            "on_next": (matrix.display_on_next, "id"),
+            "on_next_or_id": (matrix.display_on_next_or_id, "id"),
+            "on_shift": (matrix.display_and_shift, "id"),
+        }
+        self.binary_commands = {
+            OP_EXIT: self.on_binary_exit,
+            OP_SELFTEST: self.on_binary_selftest,
+            OP_LOCK_ID: self.on_binary_lock,
+            OP_LOCK_INDEX: self.on_binary_lock,
+            OP_UNLOCK_ID: self.on_binary_unlock,
+            OP_UNLOCK_INDEX: self.on_binary_unlock,
+            OP_INTERN: self.on_binary_intern,
+            OP_BATCH_BEGIN: self.on_binary_batch_begin,
+            OP_BATCH_END: self.on_binary_batch_end,
+        }
+        for opcode in PRINT_COMMANDS:
+            self.binary_commands[opcode] = self.on_binary_print
+
+    def get_address(self) -> str:
+        if self.address:
+            return self.address
+        return ifaddresses(self.interface)[AF_INET][0]["addr"]
 
-    def _get_lsock(self) -> socket:
-        lsock = socket(AF_INET, SOCK_STREAM)
-        connected = False
-        while not connected:
+    async def wait_for_address(self) -> str:
+        """ Wait until the interface got an address """
+        while True:
             try:
-                lsock.bind((ifaddresses("wlan0")[AF_INET][0]["addr"], 80))
-                connected = True
+                return self.get_address()
             except (ValueError, KeyError):
-                sleep(.1)
-                continue
-        lsock.listen()
-        lsock.setblocking(False)
-        return lsock
-
-    def accept_wrapper(self, sock) -> None:
-        conn, addr = sock.accept()
-        conn.setblocking(False)
-        data = SimpleNamespace(addr=addr, buffer="")
-        self.selector.register(conn, EVENT_READ, data=data)
-
-    def service_connection(self, key, mask) -> None:
-        sock = key.fileobj
-        data = key.data
-        if mask & EVENT_READ:
-            data.buffer = sock.recv(2048).decode()
-            if not data.buffer:
-                # Close connection because no data was send
-                self.selector.unregister(sock)
-                sock.close()
-            parts = data.buffer.split("\n")
-            msgs = parts[0:len(parts)-1]
-            data.buffer = parts[len(parts)-1]
-            for msg in msgs:
-                if msg == "":
-                    # Close connection because of connection end
-                    # message was send (\n\n)
-                    self.selector.unregister(sock)
-                    sock.close()
-                    continue
-                try:
-                    json_msg = loads(msg)
-                except JSONDecodeError:
-                    # not a valid json obj was send
-                    continue
-                if "exit" in json_msg and json_msg["exit"]:
-                    self.matrix.exit()
-                elif "selftest" in json_msg and json_msg["selftest"]:
-                    self.matrix.self_test()
-                elif "lock" in json_msg and json_msg["lock"]:
-                    if "data" not in json_msg:
-                        continue
-                    if "id" in json_msg["data"]:
-                        self.matrix.lock_display(id=json_msg["data"]["id"])
-                    elif "index" in json_msg["data"]:
-                        self.matrix.lock_display(
-                            index=json_msg["data"]["index"]
-                        )
-                elif "unlock" in json_msg and json_msg["unlock"]:
-                    if "data" not in json_msg:
-                        continue
-                    if "id" in json_msg["data"]:
-                        self.matrix.unlock_display(
-                            id=json_msg["data"]["id"]
-                        )
-                    elif "index" in json_msg["data"]:
-                        self.matrix.unlock_display(
-                            id=json_msg["data"]["index"]
-                        )
-                elif "print" in json_msg and json_msg["print"]:
-                    if "data" not in json_msg:
-                        # no data key was send
-                        continue
-                    if json_msg["print"] == "on_id":
-                        self.matrix.display_on_id(
-                            json_msg["data"]["lines"],
-                            json_msg["data"]["id"]
-                        )
-                    if json_msg["print"] == "on_next":
-                        self.matrix.display_on_next(
-                            json_msg["data"]["lines"],
-                            json_msg["data"]["id"]
-                        )
-                    if json_msg["print"] == "on_next_or_id":
-                        self.matrix.display_on_next_or_id(
-                            json_msg["data"]["lines"],
-                            json_msg["data"]["id"]
-                        )
-                    if json_msg["print"] == "on_shift":
-                        self.matrix.display_and_shift(
-                            json_msg["data"]["lines"],
-                            json_msg["data"]["id"]
-                        )
+                await asyncio.sleep(.1)
 
-    def start(self) -> None:
+    async def run_in_matrix(self, function, *args):
+        """ Run a function using the matrix in the matrix worker thread """
+        self.backlog += 1
         try:
-            self.state = True
-            self.matrix.display_on_next(
-                ["Receiver Ready", ifaddresses("wlan0")[AF_INET][0]["addr"]],
-                "service"
+            return await self.loop.run_in_executor(
+                self.executor, function, *args
             )
+        finally:
+            self.backlog -= 1
+
+    async def handle_connection(self, reader, writer) -> None:
+        """ Read messages from a connection and handle every message.
+            The protocol is chosen by the first byte of the connection.
+            The next data is only read after the previous messages were
+            handled, so a fast producer is slowed down by TCP instead of
+            filling the memory of the receiver.
+        """
+        decoder = None
+        # interned data_ids and open batch of a binary connection
+        connection = SimpleNamespace(ids={}, batch=None)
+        self.connections[writer] = asyncio.current_task()
+        try:
             while self.state:
-                events = self.selector.select(timeout=None)
-                for key, mask in events:
-                    if key.data is None:
-                        self.accept_wrapper(key.fileobj)
+                data = await reader.read(4096)
+                if not data:
+                    # Connection was closed by the sender
+                    break
+                if decoder is None:
+                    if data[0] == BINARY_MAGIC:
+                        decoder = BinaryDecoder()
                     else:
-                        self.service_connection(key, mask)
+                        decoder = LineDecoder(self.max_line)
+                if isinstance(decoder, BinaryDecoder):
+                    for frame in decoder.feed(data):
+                        if frame.opcode == OP_CLOSE:
+                            return
+                        await self.run_in_matrix(
+                            self.handle_frame, frame, connection
+                        )
+                    continue
+                for line in decoder.feed(data):
+                    if line == "":
+                        # Connection end message was send (\n\n)
+                        return
+                    reply = await self.run_in_matrix(self.handle_line, line)
+                    if reply is not None:
+                        writer.write(reply.encode("UTF-8"))
+                        await writer.drain()
+        except ValueError:
+            # Broken binary stream, the framing can not be recovered
+            pass
+        except (ConnectionError, asyncio.CancelledError):
+            # Connection was reset or the receiver was stopped
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    def count(self, name: str, command: str) -> None:
+        if self.metrics is not None:
+            self.metrics.inc(name, (("command", command),))
+
+    def handle_line(self, line: str) -> str:
+        """ Handle a json line, returns the reply to send if any """
+        try:
+            json_msg = loads(line)
+        except JSONDecodeError:
+            # not a valid json obj was send
+            self.count("messages_dropped_total", "invalid")
+            return None
+        if not isinstance(json_msg, dict):
+            self.count("messages_dropped_total", "invalid")
+            return None
+        return self.handle_message(json_msg)
+
+    def record(self, json_msg: dict) -> None:
+        if self.recorder:
+            self.recorder.record(json_msg)
+
+    def handle_message(self, json_msg: dict) -> str:
+        for command, handler in self.json_commands.items():
+            if command in json_msg and json_msg[command]:
+                self.count("messages_received_total", command)
+                if command != "stats":
+                    self.record(json_msg)
+                try:
+                    reply = handler(json_msg)
+                except (KeyError, TypeError, IndexError, AttributeError):
+                    # message is missing data or has the wrong format
+                    self.count("messages_dropped_total", command)
+                    return self.ack_reply(json_msg, OUTCOME_INVALID)
+                if reply is None:
+                    return self.ack_reply(json_msg, OUTCOME_OK)
+                return reply
+        self.count("messages_dropped_total", "unknown")
+        return self.ack_reply(json_msg, OUTCOME_INVALID)
+
+    def ack_reply(self, json_msg: dict, outcome: str, **values) -> str:
+        """ Reply line to a message with "ack", None without """
+        if "ack" not in json_msg:
+            return None
+        return dumps(dict(
+            ack=json_msg["ack"],
+            outcome=outcome,
+            depth=self.queue_depth(),
+            **values
+        )) + "\n"
+
+    def queue_depth(self) -> int:
+        """ Messages waiting for the matrix worker besides the current
+            one, frames waiting in the FlowController and lines and
+            commands waiting for their display
+        """
+        depth = max(self.backlog - 1, 0) + sum(
+            display.mailbox.depth() for display in self.matrix.displays
+        )
+        if self.flow:
+            depth += self.flow.depth()
+        return depth
+
+    def handle_datagram(self, data: bytes) -> None:
+        """ Handle the json messages of a datagram """
+        for line in data.decode("UTF-8", errors="replace").split("\n"):
+            if not line:
+                continue
+            try:
+                json_msg = loads(line)
+            except JSONDecodeError:
+                self.count("messages_dropped_total", "invalid")
+                continue
+            if not isinstance(json_msg, dict) or not any(
+                json_msg.get(command) for command in DATAGRAM_COMMANDS
+            ):
+                self.count("messages_dropped_total", "datagram")
+                continue
+            try:
+                json_msg = self.drop_stale(json_msg)
+            except (AttributeError, TypeError):
+                self.count("messages_dropped_total", "invalid")
+                continue
+            if json_msg is None:
+                self.count("messages_dropped_total", "stale")
+                continue
+            self.handle_message(json_msg)
+
+    def drop_stale(self, json_msg: dict) -> dict:
+        """ Returns the message without stale updates, None if the
+            whole message is stale
+        """
+        if json_msg.get("batch"):
+            updates = [
+                update for update in json_msg["batch"]
+                if not self.is_stale(update.get("id"), update.get("seq"))
+            ]
+            if not updates:
+                return None
+            return dict(json_msg, batch=updates)
+        data = json_msg.get("data") or {}
+        if self.is_stale(data.get("id"), json_msg.get("seq")):
+            return None
+        return json_msg
+
+    def is_stale(self, data_id, sequence) -> bool:
+        """ Check if a newer message of the data_id was received already.
+            Messages without data_id or sequence number are never stale.
+        """
+        if data_id is None or sequence is None:
+            return False
+        key = dumps(data_id)
+        last = self.sequences.get(key)
+        if last is not None and sequence <= last:
+            return True
+        self.sequences.pop(key, None)
+        self.sequences[key] = sequence
+        if len(self.sequences) > MAX_SEQUENCES:
+            del self.sequences[next(iter(self.sequences))]
+        return False
+
+    def udp_socket(self, address: str) -> socket:
+        """ Socket for the datagrams, member of the multicast group """
+        sock = socket(AF_INET, SOCK_DGRAM)
+        try:
+            sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            if self.multicast_group:
+                # Datagrams to the group are not addressed to address
+                sock.bind(("", self.udp_port))
+                sock.setsockopt(
+                    IPPROTO_IP,
+                    IP_ADD_MEMBERSHIP,
+                    inet_aton(self.multicast_group) + inet_aton(address)
+                )
+            else:
+                sock.bind((address, self.udp_port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def on_stats(self, json_msg: dict) -> str:
+        """ Reply with all metrics as a json line """
+        stats = {} if self.metrics is None else self.metrics.snapshot()
+        if "ack" in json_msg:
+            return self.ack_reply(json_msg, OUTCOME_OK, stats=stats)
+        return dumps(stats) + "\n"
+
+    def on_exit(self, json_msg: dict) -> None:
+        self.matrix.exit()
+
+    def on_selftest(self, json_msg: dict) -> None:
+        self.matrix.self_test()
+
+    def on_lock(self, json_msg: dict) -> None:
+        if "data" not in json_msg:
+            return
+        if "id" in json_msg["data"]:
+            self.matrix.lock_display(id=json_msg["data"]["id"])
+        elif "index" in json_msg["data"]:
+            self.matrix.lock_display(index=json_msg["data"]["index"])
+
+    def on_unlock(self, json_msg: dict) -> None:
+        if "data" not in json_msg:
+            return
+        if "id" in json_msg["data"]:
+            self.matrix.unlock_display(id=json_msg["data"]["id"])
+        elif "index" in json_msg["data"]:
+            self.matrix.unlock_display(index=json_msg["data"]["index"])
+
+    def on_batch(self, json_msg: dict) -> None:
+        self.matrix.apply_batch(json_msg["batch"])
+
+    def on_print(self, json_msg: dict) -> str:
+        if "data" not in json_msg:
+            # no data key was send
+            return self.ack_reply(json_msg, OUTCOME_INVALID)
+        if json_msg["print"] not in self.print_commands:
+            return self.ack_reply(json_msg, OUTCOME_INVALID)
+        function, key = self.print_commands[json_msg["print"]]
+        outcome = self.print_lines(function, key, json_msg["data"]["lines"],
+                                   json_msg["data"][key])
+        return self.ack_reply(json_msg, outcome)
+
+    def print_lines(self, function, key: str, lines: list, target) -> str:
+        """ Call a print function of the matrix, through the flow
+            controller for data_ids. Returns the outcome.
+        """
+        if self.flow and key == "id":
+            state, display = self.flow.submit(function, lines, target)
+            if state != "written":
+                # deferred, coalesced or dropped by the flow controller
+                return state
+        else:
+            display = function(lines, target)
+        if function == self.matrix.display_and_shift:
+            # Shifting always shows the lines on the first display
+            return OUTCOME_DISPLAYED
+        if display is None:
+            if key == "id" and function != self.matrix.display_on_id \
+                    and self.matrix.displays:
+                return OUTCOME_LOCKED
+            return OUTCOME_NO_DISPLAY
+        if display.mailbox.replaced:
+            return OUTCOME_COALESCED
+        return OUTCOME_DISPLAYED
+
+    def handle_frame(self, frame, connection) -> None:
+        if frame.opcode not in self.binary_commands:
+            self.count("messages_dropped_total", "unknown")
+            return
+        command = OPCODE_NAMES[frame.opcode]
+        self.count("messages_received_total", command)
+        try:
+            self.binary_commands[frame.opcode](frame, connection)
+        except (KeyError, ValueError, TypeError, IndexError,
+                AttributeError):
+            # unknown interned id or invalid payload, the connection and
+            # the frames pipelined after this one are kept
+            self.count("messages_dropped_total", command)
+            return
+
+    def on_binary_exit(self, frame, connection) -> None:
+        self.record({"exit": True})
+        self.matrix.exit()
+
+    def on_binary_selftest(self, frame, connection) -> None:
+        self.record({"selftest": True})
+        self.matrix.self_test()
+
+    def on_binary_lock(self, frame, connection) -> None:
+        if frame.opcode == OP_LOCK_ID:
+            data_id = connection.ids[frame.target]
+            self.record({"lock": True, "data": {"id": data_id}})
+            self.matrix.lock_display(id=data_id)
+        else:
+            self.record({"lock": True, "data": {"index": frame.target}})
+            self.matrix.lock_display(index=frame.target)
+
+    def on_binary_unlock(self, frame, connection) -> None:
+        if frame.opcode == OP_UNLOCK_ID:
+            data_id = connection.ids[frame.target]
+            self.record({"unlock": True, "data": {"id": data_id}})
+            self.matrix.unlock_display(id=data_id)
+        else:
+            self.record({"unlock": True, "data": {"index": frame.target}})
+            self.matrix.unlock_display(index=frame.target)
+
+    def on_binary_intern(self, frame, connection) -> None:
+        if frame.target >= MAX_INTERNED:
+            # Keeps the interned data_ids of a connection bounded
+            raise ValueError(f"Interned key {frame.target} too large")
+        connection.ids[frame.target] = loads(frame.payload.decode("UTF-8"))
+
+    def on_binary_batch_begin(self, frame, connection) -> None:
+        connection.batch = []
+
+    def on_binary_batch_end(self, frame, connection) -> None:
+        if connection.batch is not None:
+            self.record({"batch": connection.batch})
+            self.matrix.apply_batch(connection.batch)
+        connection.batch = None
+
+    def on_binary_print(self, frame, connection) -> None:
+        command = PRINT_COMMANDS[frame.opcode]
+        _, key = self.print_commands[command]
+        update = {"print": command, "lines": frame.lines}
+        if key == "index":
+            update["index"] = frame.target
+        elif frame.flags & FLAG_NO_ID:
+            update["id"] = None
+        else:
+            update["id"] = connection.ids[frame.target]
+        if connection.batch is not None:
+            connection.batch.append(update)
+            return
+        self.record({
+            "print": command,
+            "data": {"lines": update["lines"], key: update[key]}
+        })
+        function, _ = self.print_commands[command]
+        self.print_lines(function, key, update["lines"], update[key])
+
+    async def serve(self) -> None:
+        """ Run the receiver until stop is called """
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        address = await self.wait_for_address()
+        # Connections are served as soon as the server listens
+        self.state = True
+        server = await asyncio.start_server(
+            self.handle_connection, address, self.port
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        datagrams = None
+        if self.udp_port is not None:
+            datagrams, _ = await self.loop.create_datagram_endpoint(
+                lambda: DatagramHandler(self),
+                sock=self.udp_socket(address)
+            )
+            self.udp_port = datagrams.get_extra_info("sockname")[1]
+        metrics_server = None
+        if self.metrics is not None and self.metrics_port:
+            metrics_server = await asyncio.start_server(
+                self.handle_metrics_request, address, self.metrics_port
+            )
+        self.ready.set()
+        await self.run_in_matrix(
+            self.matrix.display_on_next,
+            ["Receiver Ready", address],
+            "service"
+        )
+        async with server:
+            await self.stop_event.wait()
+            self.state = False
+            tasks = list(self.connections.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if metrics_server:
+                metrics_server.close()
+            if datagrams:
+                datagrams.close()
+            if self.recorder:
+                self.recorder.close()
+
+    async def handle_metrics_request(self, reader, writer) -> None:
+        """ Answer every HTTP request with the metrics in the Prometheus
+            text format
+        """
+        try:
+            # Skip the request line and headers
+            while (await reader.readline()).strip():
+                pass
+            body = self.metrics.render().encode("UTF-8")
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode("UTF-8")
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def stop(self) -> None:
+        """ Stop a running receiver, can be called from any thread """
+        if self.loop and self.stop_event:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    def start(self) -> None:
+        try:
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
             pass
         finally:
-            self.selector.close()
+            self.state = False
+            self.ready.clear()
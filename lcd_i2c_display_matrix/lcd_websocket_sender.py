@@ -1,6 +1,16 @@
-from socket import socket, AF_INET, SOCK_STREAM
-from json import dumps
+import asyncio
+from itertools import count
+from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY
+from socket import MSG_PEEK, MSG_DONTWAIT, SOCK_DGRAM
+from socket import IPPROTO_IP, IP_MULTICAST_TTL, IP_MULTICAST_IF, inet_aton
+from ipaddress import ip_address
+from json import dumps, loads
+from json.decoder import JSONDecodeError
 from random import choice
+from threading import RLock, Timer
+from time import time
+from .protocol import encode_message, encode_frame, encode_intern, OP_CLOSE
+from .protocol import MAX_DATAGRAM, DATAGRAM_COMMANDS
 
 # Exmaple Usage:
 # if __name__ == "__main__":
@@ -13,14 +23,166 @@ from random import choice
 #     for x in range(20):
 #         sender.send("on_next", ["Some Value", f"{x}"], f"value{x}")
 #     sender.do_exit()
+#
+# Keep one connection open and send messages in batches of 20:
+#     with MatricCommandSender("10.10.10.5", 80, True, 20) as sender:
+#         for x in range(100):
+#             sender.send("on_next", ["Some Value", f"{x}"], "value")
+#
+# Use the compact binary protocol:
+#     sender = MatricCommandSender("10.10.10.5", 80, True, 20, True)
+#
+# Send print commands to every matrix in a multicast group by UDP:
+#     with MatrixDatagramSender("239.0.0.42", 5005, 20) as sender:
+#         sender.send("on_next_or_id", ["Temp", "21.5"], "temp")
+#
+# Wait for the outcome of every message with asyncio:
+#     async with AsyncMatrixCommandSender("10.10.10.5", 80, 8) as sender:
+#         ack = await sender.display_on_id(["Temp", "21.5"], "temp")
+#         print((await ack)["outcome"])       # "displayed", "no_display", ...
+#         if sender.depth > 20:
+#             await asyncio.sleep(.5)         # the receiver is backed up
 
 
 class MatrixCommandSender:
-    def __init__(self, address, port) -> None:
+    def __init__(self, address, port, persistent: bool = False,
+                 batch_size: int = 1, binary: bool = False,
+                 max_delay: float = 0.05) -> None:
+        """ Without persistent every message opens a new connection.
+            With persistent a single connection is kept open and messages
+            are pipelined on it. Messages are collected until batch_size
+            messages are waiting and then sent at once, flush sends them
+            earlier. A message waits at most max_delay seconds, after
+            that a timer sends the collected messages. Nagle is disabled
+            since the batching is done here.
+            A broken connection is reconnected on the next flush.
+            With binary the messages are sent as binary frames instead of
+            json, data_ids are interned once per connection.
+        """
         self.address = address
         self.port = port
+        self.persistent = persistent
+        self.batch_size = batch_size
+        self.binary = binary
+        self.max_delay = max_delay
+        self.sock = None
+        self.buffer = []
+        # Held while the buffer is changed or sent, the timer flushes
+        # from its own thread
+        self.lock = RLock()
+        self.timer = None
+        # data_ids interned on the current connection
+        self.interned = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def connect(self) -> socket:
+        """ Returns the persistent connection, reconnects if necessary """
+        if self.sock and not self.is_alive():
+            self.disconnect()
+        if not self.sock:
+            sock = socket(AF_INET, SOCK_STREAM)
+            try:
+                sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+                sock.connect((self.address, self.port))
+                if self.binary and self.interned:
+                    # The new connection does not know the interned ids
+                    sock.sendall(b"".join(
+                        encode_intern(key, loads(name))
+                        for name, key in self.interned.items()
+                    ))
+            except OSError:
+                sock.close()
+                raise
+            self.sock = sock
+        return self.sock
+
+    def is_alive(self) -> bool:
+        """ Check if the receiver closed the persistent connection """
+        try:
+            return self.sock.recv(1, MSG_PEEK | MSG_DONTWAIT) != b""
+        except BlockingIOError:
+            # Nothing to read, the connection is still open
+            return True
+        except OSError:
+            return False
+
+    def disconnect(self) -> None:
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def flush(self) -> None:
+        """ Send all buffered messages on the persistent connection """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            buffer, self.buffer = self.buffer, []
+            if buffer:
+                self.send_buffer(buffer)
+
+    def flush_timer(self) -> None:
+        """ Called by the timer once a message waited max_delay """
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"Sending the buffered messages failed: {e}")
+
+    def send_buffer(self, buffer: list) -> None:
+        """ Send the messages of the buffer.
+            If sending fails the messages which were not handed to the
+            connection completely are sent again once on a new connection.
+            The receiver drops the cut off message of the old connection.
+            Messages handed over before are not repeated, so commands
+            like on_next or on_shift are never applied twice. A message
+            the old connection could not deliver any more is lost.
+        """
+        data = b"".join(buffer)
+        sent = 0
+        try:
+            sock = self.connect()
+            while sent < len(data):
+                sent += sock.send(data[sent:])
+            return
+        except OSError:
+            self.disconnect()
+        # Skip the messages which were handed over completely
+        start = 0
+        for message in buffer:
+            if start + len(message) > sent:
+                break
+            start += len(message)
+        self.connect().sendall(data[start:])
+
+    def close(self) -> None:
+        """ Send the remaining messages and end the persistent connection """
+        if not self.persistent:
+            return
+        with self.lock:
+            try:
+                self.flush()
+                if self.sock and self.binary:
+                    self.sock.sendall(encode_frame(OP_CLOSE))
+                elif self.sock:
+                    # An empty line ends the connection on the receiver
+                    self.sock.sendall(("\n").encode("UTF-8"))
+            except OSError:
+                pass
+            finally:
+                self.disconnect()
 
     def check_connect(self) -> bool:
+        if self.persistent:
+            try:
+                self.connect()
+                return True
+            except OSError:
+                return False
         try:
             with socket(AF_INET, SOCK_STREAM) as s:
                 s.connect((self.address, self.port))
@@ -30,106 +192,405 @@ class MatrixCommandSender:
             return False
 
     def send(self, command: str, lines: list, id: str) -> None:
-        output = dumps({
+        self.send_message({
             "print": command,
             "data": {
                 "lines": lines,
                 "id": id
             }
         })
-        self.use_socket(output)
+
+    def send_batch(self, updates: list) -> None:
+        """ Send many display updates in one message.
+            Every update is a dict like
+            {"print": "on_next_or_id", "lines": [line1, line2], "id": id}
+            or {"print": "on_index", "lines": [line1, line2], "index": 2}.
+            The receiver applies all of them at once.
+        """
+        self.send_message({"batch": updates})
 
     def diplay_on_id(self, lines: list, id: str) -> None:
-        self.use_socket(
-            dumps({
-                "on_id": True,
-                "data": {
-                    "lines": lines,
-                    "id": id
-                }
-            })
-        )
+        self.send_message({
+            "print": "on_id",
+            "data": {
+                "lines": lines,
+                "id": id
+            }
+        })
 
     def display_on_next(self, lines: list, id: str = None) -> None:
-        self.use_socket(
-            dumps({
-                "on_next": True,
-                "data": {
-                    "lines": lines,
-                    "id": id if id else choice(range(0, 1000))
-                }
-            })
-        )
+        self.send_message({
+            "print": "on_next",
+            "data": {
+                "lines": lines,
+                "id": id if id else choice(range(0, 1000))
+            }
+        })
 
     def display_on_next_or_id(self, lines: list, id: str) -> None:
-        self.use_socket(
-            dumps({
-                "on_next_or_id": True,
-                "data": {
-                    "lines": lines,
-                    "id": id
-                }
-            })
-        )
+        self.send_message({
+            "print": "on_next_or_id",
+            "data": {
+                "lines": lines,
+                "id": id
+            }
+        })
 
     def display_on_shift(self, lines: list, id: str = None) -> None:
-        self.use_socket(
-            dumps({
-                "on_shift": True,
-                "data": {
-                    "lines": lines,
-                    "id": id
-                }
-            })
-        )
+        self.send_message({
+            "print": "on_shift",
+            "data": {
+                "lines": lines,
+                "id": id
+            }
+        })
 
     def lock_by_id(self, id: str) -> None:
-        self.use_socket(
-            dumps({
-                "lock": True,
-                "data": {
-                    "id": id
-                }
-            })
-        )
+        self.send_message({
+            "lock": True,
+            "data": {
+                "id": id
+            }
+        })
 
     def lock_by_index(self, index: int) -> None:
-        self.use_socket(
-            dumps({
-                "lock": True,
-                "data": {
-                    "index": index
-                }
-            })
-        )
+        self.send_message({
+            "lock": True,
+            "data": {
+                "index": index
+            }
+        })
 
     def unlock_by_id(self, id: str) -> None:
-        self.use_socket(
-            dumps({
-                "unlock": True,
-                "data": {
-                    "id": id
-                }
-            })
-        )
+        self.send_message({
+            "unlock": True,
+            "data": {
+                "id": id
+            }
+        })
 
     def unlock_by_index(self, index: int) -> None:
-        self.use_socket(
-            dumps({
-                "unlock": True,
-                "data": {
-                    "index": index
-                }
-            })
-        )
+        self.send_message({
+            "unlock": True,
+            "data": {
+                "index": index
+            }
+        })
 
     def do_selftest(self) -> None:
-        self.use_socket(dumps({"selftest": True}))
+        self.send_message({"selftest": True})
 
     def do_exit(self) -> None:
-        self.use_socket(dumps({"exit": True}))
+        self.send_message({"exit": True})
+
+    def get_stats(self, timeout: float = 5) -> dict:
+        """ Ask the receiver for its metrics.
+            Uses its own json connection to wait for the reply.
+        """
+        with socket(AF_INET, SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect((self.address, self.port))
+            s.sendall((dumps({"stats": True}) + "\n").encode("UTF-8"))
+            reply = b""
+            while not reply.endswith(b"\n"):
+                data = s.recv(65536)
+                if not data:
+                    break
+                reply += data
+            s.sendall(("\n").encode("UTF-8"))
+        return loads(reply.decode("UTF-8"))
+
+    def send_message(self, msg: dict) -> None:
+        """ Send a message as json or binary frames """
+        if not self.binary:
+            self.use_socket(dumps(msg))
+            return
+        if not self.persistent:
+            # Every message uses a new connection
+            self.interned = {}
+        frames = encode_message(msg, self.interned)
+        if self.persistent:
+            self.queue_data(frames)
+            return
+        with socket(AF_INET, SOCK_STREAM) as s:
+            s.connect((self.address, self.port))
+            s.sendall(frames + encode_frame(OP_CLOSE))
+
+    def queue_data(self, data: bytes) -> None:
+        """ Add data to the buffer of the persistent connection """
+        with self.lock:
+            self.buffer.append(data)
+            if len(self.buffer) >= self.batch_size:
+                self.flush()
+            elif self.max_delay is not None and not self.timer:
+                self.timer = Timer(self.max_delay, self.flush_timer)
+                self.timer.daemon = True
+                self.timer.start()
 
     def use_socket(self, msg) -> None:
+        if self.persistent:
+            self.queue_data((msg + "\n").encode("UTF-8"))
+            return
         with socket(AF_INET, SOCK_STREAM) as s:
             s.connect((self.address, self.port))
             s.sendall((msg + "\n\n").encode("UTF-8"))
+
+
+class MatrixDatagramSender(MatrixCommandSender):
+    def __init__(self, address, port, batch_size: int = 1,
+                 ttl: int = 1, interface: str = None,
+                 max_delay: float = 0.05) -> None:
+        """ Sends print and batch commands as UDP datagrams to a receiver
+            started with udp_port. With a multicast group as address one
+            datagram reaches all receivers which joined the group, ttl
+            limits how many routers it passes. interface is the address
+            of the network interface sending to the group.
+            Messages are collected until batch_size messages are waiting
+            or the first waited max_delay seconds and then sent in as few
+            datagrams as possible.
+            Every message for a data_id gets the next sequence number of
+            the data_id so the receiver drops reordered datagrams. The
+            numbers start at the current time in milliseconds, so they
+            keep growing when the sender is restarted.
+            Nothing is acknowledged, a lost datagram is not sent again.
+            Only print and batch commands can be sent, the others raise
+            a ValueError. A batch too large for one datagram is split into
+            several batches.
+        """
+        super().__init__(address, port, True, batch_size,
+                         max_delay=max_delay)
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        if ip_address(address).is_multicast:
+            self.sock.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, ttl)
+            if interface:
+                self.sock.setsockopt(
+                    IPPROTO_IP, IP_MULTICAST_IF, inet_aton(interface)
+                )
+        # json encoded data_id -> last sequence number
+        self.sequences = {}
+
+    def next_sequence(self, data_id) -> int:
+        key = dumps(data_id)
+        sequence = max(
+            self.sequences.get(key, 0) + 1, int(time() * 1000)
+        )
+        self.sequences[key] = sequence
+        return sequence
+
+    def check_connect(self) -> bool:
+        return True
+
+    def send_message(self, msg: dict) -> None:
+        """ Add the sequence numbers and queue the message """
+        if not any(msg.get(command) for command in DATAGRAM_COMMANDS):
+            raise ValueError(
+                "Only print and batch commands can be sent as datagrams"
+            )
+        if msg.get("batch"):
+            msg = dict(msg, batch=[
+                update if update.get("id") is None
+                else dict(update, seq=self.next_sequence(update["id"]))
+                for update in msg["batch"]
+            ])
+        elif (msg.get("data") or {}).get("id") is not None:
+            msg = dict(msg, seq=self.next_sequence(msg["data"]["id"]))
+        self.queue_message(msg)
+
+    def queue_message(self, msg: dict) -> None:
+        """ Queue a message, a batch which does not fit into a datagram
+            is queued as two halves
+        """
+        data = (dumps(msg) + "\n").encode("UTF-8")
+        if len(data) <= MAX_DATAGRAM:
+            self.queue_data(data)
+            return
+        batch = msg.get("batch") or []
+        if len(batch) < 2:
+            raise ValueError(
+                f"A message of {len(data)} bytes does not fit into a "
+                "datagram"
+            )
+        self.queue_message(dict(msg, batch=batch[:len(batch) // 2]))
+        self.queue_message(dict(msg, batch=batch[len(batch) // 2:]))
+
+    def send_buffer(self, buffer: list) -> None:
+        """ Send the queued messages, a datagram holds as many as fit.
+            A failing datagram does not keep the following ones from
+            being sent, the first error is raised afterwards.
+        """
+        datagrams = [b""]
+        for data in buffer:
+            if len(datagrams[-1]) + len(data) > MAX_DATAGRAM:
+                datagrams.append(b"")
+            datagrams[-1] += data
+        error = None
+        for datagram in datagrams:
+            if not datagram:
+                continue
+            try:
+                self.sock.sendto(datagram, (self.address, self.port))
+            except OSError as e:
+                error = error or e
+        if error:
+            raise error
+
+    def close(self) -> None:
+        """ Send the remaining messages and close the socket """
+        try:
+            self.flush()
+        except OSError:
+            pass
+        finally:
+            self.sock.close()
+
+
+class AsyncMatrixCommandSender:
+    def __init__(self, address, port, max_in_flight: int = 8) -> None:
+        """ asyncio sender asking the receiver to acknowledge every
+            message. Sending returns a future which is resolved with the
+            reply {"ack": id, "outcome": outcome, "depth": depth} or fails
+            with a ConnectionError if the connection is lost.
+            At most max_in_flight messages wait for their reply, sending
+            more waits until a reply arrives.
+            depth is the queue depth reported by the latest reply, so a
+            producer can slow down while the receiver is backed up.
+        """
+        self.address = address
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.slots = None
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.ids = count()
+        # correlation id -> future of the reply
+        self.in_flight = {}
+        self.depth = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def connect(self) -> None:
+        """ Open the connection, reconnects if it was lost """
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_in_flight)
+        if self.writer and not self.writer.is_closing():
+            return
+        self.reader, self.writer = await asyncio.open_connection(
+            self.address, self.port
+        )
+        self.reader_task = asyncio.create_task(self.read_replies())
+
+    async def read_replies(self) -> None:
+        """ Resolve the futures with the replies of the receiver """
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = loads(line)
+                except JSONDecodeError:
+                    continue
+                if not isinstance(reply, dict) or "ack" not in reply:
+                    continue
+                self.depth = reply.get("depth", self.depth)
+                future = self.in_flight.pop(reply["ack"], None)
+                if future and not future.done():
+                    future.set_result(reply)
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+            in_flight, self.in_flight = self.in_flight, {}
+            for future in in_flight.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("Connection to the receiver lost")
+                    )
+
+    async def send_message(self, msg: dict) -> asyncio.Future:
+        """ Send a message and return the future of its reply """
+        await self.connect()
+        await self.slots.acquire()
+        ack = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda _: self.slots.release())
+        self.in_flight[ack] = future
+        try:
+            self.writer.write((dumps(dict(msg, ack=ack)) + "\n").encode(
+                "UTF-8"
+            ))
+            await self.writer.drain()
+        except ConnectionError as e:
+            self.in_flight.pop(ack, None)
+            if not future.done():
+                future.set_exception(e)
+        return future
+
+    async def send(self, command: str, lines: list,
+                   id: str) -> asyncio.Future:
+        return await self.send_message({
+            "print": command,
+            "data": {
+                "lines": lines,
+                "id": id
+            }
+        })
+
+    async def send_batch(self, updates: list) -> asyncio.Future:
+        """ See MatrixCommandSender.send_batch """
+        return await self.send_message({"batch": updates})
+
+    async def display_on_id(self, lines: list, id: str) -> asyncio.Future:
+        return await self.send("on_id", lines, id)
+
+    async def display_on_next(self, lines: list,
+                              id: str = None) -> asyncio.Future:
+        return await self.send(
+            "on_next", lines, id if id else choice(range(0, 1000))
+        )
+
+    async def display_on_next_or_id(self, lines: list,
+                                    id: str) -> asyncio.Future:
+        return await self.send("on_next_or_id", lines, id)
+
+    async def display_on_shift(self, lines: list,
+                               id: str = None) -> asyncio.Future:
+        return await self.send("on_shift", lines, id)
+
+    async def display_on_index(self, lines: list,
+                               index: int) -> asyncio.Future:
+        return await self.send_message({
+            "print": "on_index",
+            "data": {
+                "lines": lines,
+                "index": index
+            }
+        })
+
+    async def get_stats(self) -> dict:
+        """ Metrics of the receiver, see MatrixCommandSender.get_stats """
+        reply = await (await self.send_message({"stats": True}))
+        return reply.get("stats", {})
+
+    async def close(self) -> None:
+        """ Wait for the replies in flight and end the connection """
+        if not self.writer:
+            return
+        await asyncio.gather(
+            *self.in_flight.values(), return_exceptions=True
+        )
+        try:
+            if not self.writer.is_closing():
+                # An empty line ends the connection on the receiver
+                self.writer.write(("\n").encode("UTF-8"))
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        await self.reader_task
+        self.writer = None
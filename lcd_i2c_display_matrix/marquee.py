@@ -0,0 +1,98 @@
+from time import monotonic
+
+# Example usage:
+# display.start_marquee("Breaking news: scrolling on the controller", speed=6)
+# matrix.marquee_row(["Text scrolling across a whole row", None], row=0)
+
+# Cells per line in the DDRAM of the HD44780
+DDRAM_LINE_LENGTH = 40
+
+
+class Marquee:
+    def __init__(self, lines: list, speed: float = 4.0, offset: int = 0,
+                 start: float = None, width: int = 16, encode=None) -> None:
+        """
+            Scrolls two lines of text using the display shift of the
+            controller. Both lines are loaded into the 40 DDRAM cells of
+            their line once, every step shifts the whole display by one
+            cell with a single command byte.
+            Text shorter than 40 chars is padded with spaces and never
+            rewritten. For longer text only the cell scrolling into the
+            window is written when the window wraps.
+            speed is given in steps per second. offset starts the text
+            that many chars later, used to scroll a text across displays.
+            encode converts the text to character codes, e.g. the encode
+            of a CharacterMap. Custom glyphs are not used.
+        """
+        self.texts = []
+        self.codes = []
+        for line in lines:
+            text = "" if line is None else f"{line}"
+            text = text.ljust(DDRAM_LINE_LENGTH, " ")
+            self.texts.append(text)
+            self.codes.append(
+                encode(text) if encode
+                else text.encode("latin-1", errors="replace")
+            )
+        self.interval = 1 / speed
+        self.offset = offset
+        self.width = width
+        self.step = 0
+        self.next_step = start if start is not None else monotonic()
+        # Character codes stored in the DDRAM, None if unknown
+        self.ddram = [[None] * DDRAM_LINE_LENGTH for _ in self.texts]
+
+    def wanted(self, line: int, position: int) -> int:
+        """ Code of the char at text position for a line """
+        codes = self.codes[line]
+        return codes[(position + self.offset) % len(codes)]
+
+    def writes(self, step: int) -> list:
+        """ Returns (line, cell, codes) runs which have to be written so
+            the window at step shows the right text.
+            The whole DDRAM line is written on the first step.
+        """
+        runs = []
+        for line in range(len(self.texts)):
+            if step == 0:
+                positions = range(DDRAM_LINE_LENGTH)
+            else:
+                positions = range(step, step + self.width)
+            for position in positions:
+                cell = position % DDRAM_LINE_LENGTH
+                code = self.wanted(line, position)
+                if self.ddram[line][cell] == code:
+                    continue
+                self.ddram[line][cell] = code
+                if runs and runs[-1][0] == line \
+                        and runs[-1][1] + len(runs[-1][2]) == cell:
+                    runs[-1][2].append(code)
+                else:
+                    runs.append((line, cell, [code]))
+        return runs
+
+    def reset(self) -> None:
+        """ Start again with loading the DDRAM, e.g. after a reinit """
+        self.step = 0
+        self.ddram = [[None] * DDRAM_LINE_LENGTH for _ in self.texts]
+
+    def visible(self) -> list:
+        """ Text of the lines currently shown in the window """
+        start = max(self.step - 1, 0) + self.offset
+        lines = []
+        for text in self.texts:
+            lines.append("".join(
+                text[(start + i) % len(text)] for i in range(self.width)
+            ))
+        return lines
+
+    def due(self, now: float = None) -> bool:
+        return (now if now is not None else monotonic()) >= self.next_step
+
+    def advance(self) -> None:
+        """ Move to the next step, skip steps if the display fell behind """
+        self.step += 1
+        self.next_step += self.interval
+        now = monotonic()
+        if self.next_step < now - self.interval:
+            self.next_step = now
@@ -1,10 +1,37 @@
+from bisect import bisect_right, insort
+from contextlib import contextmanager, nullcontext
+from json import dumps
+from threading import Thread, Lock
 from .display import Display, LCDIdentifierDoesNotExist
+from .scheduler import BusScheduler, parse_identifier
+from time import monotonic, perf_counter
+from .discovery import DiscoveryReport, StateStore, probe_address
+from .discovery import initialise_interleaved
+from .LCD import SMBus
+from .timing import TimingStore
+from .canvas import Canvas
+from .render import Renderer
 
 # Example Dict
 # display_data = [
 #     {"location": (0, 0), "identifier": 0x20},
 #     {"location": (1, 0), "identifier": 0x26}
 # ]
+#
+# Example batch
+# updates = [
+#     {"print": "on_next_or_id", "lines": ["Temp", "21.5"], "id": "temp"},
+#     {"print": "on_id", "lines": [None, "54%"], "id": "humidity"},
+#     {"print": "on_index", "lines": ["Index", "3"], "index": 3}
+# ]
+#
+# Identifiers on multiple buses
+# identifiers = [(1, 0x20), (1, 0x21), (3, 0x20), (3, 0x21, 0x70, 0)]
+
+
+def id_key(data_id) -> str:
+    """ Hashable key of a data_id, json data_ids may be lists or dicts """
+    return dumps(data_id, sort_keys=True, default=str)
 
 
 class DisplayIndexError(Exception):
@@ -35,21 +62,385 @@ class DisplayDataIdError(Exception):
 
 
 class Matrix:
-    def __init__(self, identifiers: list = None) -> None:
+    def __init__(self, identifiers: list = None,
+                 shared_bus: bool = True, timing=None,
+                 timing_file: str = None, bus_factory=None,
+                 rom: str = "A00", metrics=None,
+                 warm: bool = False, fps: float = None,
+                 state_file: str = None) -> None:
+        """ Creates a display for every identifier.
+            With shared_bus all displays on an I2C bus are written by a
+            single BusScheduler owning the bus instead of one thread each.
+            Every bus gets its own scheduler so buses update in parallel.
+            timing is a TimingProfile or profile name used by all displays.
+            "calibrate" finds the fastest reliable timing for every display
+            once and saves it in the timing_file.
+            bus_factory is called with the bus number to open a bus.
+            Use it to run the matrix on a SimulatedSMBus.
+            rom is the character ROM of the displays, "A00" or "A02".
+            metrics is a Metrics object recording the latency, queue depth
+            and bus usage of every display, None records nothing.
+            With warm displays which kept their state since the last stop
+            are taken over without initialising them again. The states
+            are saved to the state_file by stop.
+            The result of bringing up the displays is kept in report.
+            With fps a Renderer writes all displays in frames of that rate,
+            see start_render_loop.
+        """
         self.displays = []
-        self.create_displays(identifiers)
+        # id_key(data_id) -> sorted positions of the displays using it
+        self.id_index = {}
+        # sorted positions of all unlocked displays
+        self.free_positions = []
+        self.bus_factory = bus_factory
+        self.shared_bus = shared_bus
+        self.schedulers = {}
+        self.timing = timing
+        self.rom = rom
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_collector(self.collect_metrics)
+        self.timing_store = None
+        if timing_file or timing == "calibrate":
+            self.timing_store = TimingStore(timing_file)
+        self.report = None
+        self.renderer = None
+        # Open transactions, see transaction
+        self.holds = 0
+        self.hold_lock = Lock()
+        self.state_store = None
+        if warm or state_file:
+            self.state_store = StateStore(state_file)
+        self.create_displays(identifiers, warm)
         self.last_used = -1
+        if fps:
+            self.start_render_loop(fps)
 
-    def create_displays(self, identifiers: list) -> None:
-        """ Creates all displays provided in the identifiers list. """
+    def create_displays(self, identifiers: list,
+                        warm: bool = False) -> DiscoveryReport:
+        """ Creates all displays provided in the identifiers list.
+            An entry can be an identifier or a dict with "identifier" and
+            the "location" (column, row) of the display in the wall.
+            A dict can set the "rom" of a single display.
+            Every bus is brought up by its own thread. Missing addresses
+            are found by probing them first, the displays found on a bus
+            are initialised together. Displays are added in the order of
+            the identifiers. Returns a DiscoveryReport.
+        """
+        start = perf_counter()
+        report = DiscoveryReport()
+        # [identifier, location, rom, display] grouped by bus
+        buses = {}
+        entries = []
         for identifier in identifiers:
+            location = None
+            rom = self.rom
+            if isinstance(identifier, dict):
+                location = identifier.get("location")
+                rom = identifier.get("rom", rom)
+                identifier = identifier["identifier"]
+            try:
+                bus_number = parse_identifier(identifier)[0]
+            except ValueError as e:
+                print(f"Identifier {identifier} can not be used: {e}")
+                report.fail(identifier, e)
+                continue
+            entry = [identifier, location, rom, None]
+            entries.append(entry)
+            buses.setdefault(bus_number, []).append(entry)
+        states = {}
+        if warm and self.state_store:
+            states = self.state_store.take()
+        threads = []
+        for bus_number, bus_entries in buses.items():
+            self.get_scheduler(bus_number)
+            threads.append(Thread(
+                target=self.bring_up,
+                args=(bus_number, bus_entries, states, report)
+            ))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for identifier, location, rom, display in entries:
+            if display:
+                self.add_display(display, location)
+        report.seconds = perf_counter() - start
+        self.report = report
+        return report
+
+    def bring_up(self, bus_number: int, entries: list, states: dict,
+                 report: DiscoveryReport) -> None:
+        """ Probe, create and initialise the displays of one bus.
+            Displays with a saved state in states are warm started.
+        """
+        scheduler = self.get_scheduler(bus_number)
+        if scheduler:
+            bus = scheduler.bus
+            lock = scheduler.bus_lock
+        else:
+            bus = (self.bus_factory or SMBus)(bus_number)
+            lock = nullcontext()
+        cold = {}
+        with lock:
+            for entry in entries:
+                identifier, _, rom, _ = entry
+                try:
+                    _, address, mux = parse_identifier(identifier)
+                    if scheduler:
+                        scheduler.select_channel(mux)
+                    if not probe_address(bus, address):
+                        raise LCDIdentifierDoesNotExist(identifier)
+                    display = Display(
+                        identifier,
+                        scheduler,
+                        self.timing,
+                        self.timing_store,
+                        self.bus_factory,
+                        rom,
+                        init=False
+                    )
+                    if display.lcd.initialised:
+                        # Calibrating initialised the display
+                        report.found.append(display.name)
+                    elif display.lcd.warm_start(states.get(display.name)):
+                        # The kept text is only known as cells, the first
+                        # lines are always handed to the LCD
+                        display.current_lines = [None, None]
+                        report.warm.append(display.name)
+                    else:
+                        cold[display.lcd] = display
+                except LCDIdentifierDoesNotExist:
+                    print(
+                        f"Identifier {identifier} is not a valid identifier!"
+                        "Skipping this display"
+                    )
+                    report.missing.append(identifier)
+                    continue
+                except (ValueError, OSError) as e:
+                    print(f"Identifier {identifier} can not be used: {e}")
+                    report.fail(identifier, e)
+                    continue
+                entry[3] = display
+
+            def select(lcd):
+                if scheduler:
+                    scheduler.select_channel(cold[lcd].mux)
+
+            try:
+                initialise_interleaved(list(cold), select)
+            except OSError as e:
+                for display in cold.values():
+                    print(f"Display {display.name} can not be used: {e}")
+                    report.fail(display.identifier, e)
+                for entry in entries:
+                    if entry[3] in cold.values():
+                        entry[3] = None
+                return
+        report.found += [display.name for display in cold.values()]
+
+    def add_display(self, display: Display, location: tuple = None) -> None:
+        """ Appends a display and adds it to the indexes """
+        display.position = len(self.displays)
+        display.location = tuple(location) if location else None
+        self.displays.append(display)
+        self.id_index.setdefault(
+            id_key(display.data_id), []
+        ).append(display.position)
+        if not display.locked:
+            self.free_positions.append(display.position)
+        display.on_change = self.display_changed
+        if self.metrics is not None:
+            display.enable_metrics(self.metrics)
+        if self.renderer:
+            display.mailbox.set_framed(True)
+
+    def create_canvas(self) -> Canvas:
+        """ Returns a character canvas spanning all displays with a
+            location.
+        """
+        return Canvas(self)
+
+    def collect_metrics(self) -> list:
+        """ Queue depth and bus usage of every display for Metrics """
+        samples = []
+        for display in self.displays:
+            labels = (("display", display.name),)
+            samples += [
+                ("queue_depth", "gauge", labels, display.mailbox.depth()),
+                ("display_on", "gauge", labels, int(display.is_on())),
+                ("bus_bytes_total", "counter", labels, display.lcd.bus_bytes),
+                ("bus_transactions_total", "counter", labels,
+                 display.lcd.bus_transactions),
+            ]
+        if self.renderer:
+            samples += self.renderer.collect_metrics()
+        return samples
+
+    def row_displays(self, row: int) -> list:
+        """ Displays with a location in the row sorted by column """
+        return sorted(
+            [
+                display for display in self.displays
+                if display.location and display.location[1] == row
+            ],
+            key=lambda display: display.location[0]
+        )
+
+    def marquee_row(self, lines: list, row: int = 0,
+                    speed: float = 4.0) -> None:
+        """ Scroll two lines across all displays of a row.
+            Every display scrolls the same text 16 chars further on, all
+            of them start at the same time so they step together.
+        """
+        displays = self.row_displays(row)
+        width = 16 * len(displays)
+        lines = ["" if line is None else f"{line}".ljust(width)
+                 for line in lines]
+        start = monotonic()
+        for column, display in enumerate(displays):
+            if not display.is_on():
+                display.toggle_display()
+            display.start_marquee(lines[0], lines[1], speed,
+                                  offset=16 * column, start=start)
+
+    def stop_marquee_row(self, row: int = 0) -> None:
+        for display in self.row_displays(row):
+            display.stop_marquee()
+
+    def display_changed(self, display: Display, attribute: str,
+                        old, new) -> None:
+        """ Keeps the indexes up to date when a display changes its
+            data_id or is locked / unlocked.
+        """
+        if attribute == "data_id":
+            new_key = id_key(new)
+            positions = self.id_index[id_key(old)]
+            positions.remove(display.position)
+            if not positions:
+                del self.id_index[id_key(old)]
+            insort(self.id_index.setdefault(new_key, []), display.position)
+        elif attribute == "locked":
+            if new:
+                self.free_positions.remove(display.position)
+            else:
+                insort(self.free_positions, display.position)
+
+    def get_scheduler(self, bus_number: int) -> BusScheduler:
+        """ Returns the scheduler of a bus and creates it on first use """
+        if not self.shared_bus:
+            return None
+        if bus_number not in self.schedulers:
+            self.schedulers[bus_number] = BusScheduler(
+                bus_number,
+                self.bus_factory
+            )
+        return self.schedulers[bus_number]
+
+    def start_render_loop(self, fps: float = 20) -> Renderer:
+        """ Write all displays together fps times a second.
+            Lines set from now on wait for the next frame instead of
+            being written at once.
+        """
+        if not self.renderer:
+            self.renderer = Renderer(self, fps)
+        return self.renderer
+
+    def stop_render_loop(self) -> None:
+        """ Write lines at once again, waiting lines are written now """
+        if self.renderer:
+            self.renderer.stop()
+            self.renderer = None
+
+    def stop(self) -> None:
+        """ Stops the bus schedulers and the threads of displays without
+            scheduler after writing all pending lines.
+            Saves the state of the displays for the next warm start.
+        """
+        self.stop_render_loop()
+        for scheduler in self.schedulers.values():
+            scheduler.stop()
+        for display in self.displays:
+            display.stop()
+        if self.state_store:
+            self.state_store.save({
+                display.name: display.lcd.shadow for display in self.displays
+            })
+
+    @contextmanager
+    def transaction(self):
+        """ Hold all bus schedulers while the block enqueues updates.
+            The updates are written to the displays after the block ends,
+            so all displays change together. Displays with their own
+            thread collect the updates in the back buffer of their
+            mailbox meanwhile. With a render loop the updates are shown in
+            the same frame.
+        """
+        with self.renderer.lock if self.renderer else nullcontext():
+            for scheduler in self.schedulers.values():
+                scheduler.hold()
+            self.hold_writers(True)
             try:
-                self.displays.append(Display(identifier))
-            except LCDIdentifierDoesNotExist:
-                print(
-                    f"Identifier {identifier} is not a valid identifier!"
-                    "Skipping this display"
-                )
+                yield self
+            finally:
+                self.hold_writers(False)
+                for scheduler in self.schedulers.values():
+                    scheduler.release()
+
+    def hold_writers(self, hold: bool) -> None:
+        """ Hold or release the displays writing from their own thread.
+            Only the outermost transaction changes them, a render loop
+            holds them already.
+        """
+        with self.hold_lock:
+            self.holds += 1 if hold else -1
+            if self.renderer or self.holds != int(hold):
+                return
+            for display in self.displays:
+                if not display.scheduler:
+                    display.mailbox.set_framed(hold)
+
+    def apply_batch(self, updates: list) -> None:
+        """ Applies many display updates as one transaction.
+            Every update is a dict with "print", "lines" and "id" or
+            "index" (for "on_index"). Updates for the same target are
+            merged, the last lines win while a line set to None keeps the
+            earlier text. Shift updates are applied in order.
+            Raises TypeError if updates is not a list of dicts.
+        """
+        if not isinstance(updates, list) or not all(
+            isinstance(update, dict) for update in updates
+        ):
+            raise TypeError("A batch is a list of update dicts")
+        merged = {}
+        for position, update in enumerate(updates):
+            command = update.get("print", "on_next_or_id")
+            if command == "on_shift":
+                key = ("shift", position)
+            elif command == "on_index":
+                key = ("index", update["index"])
+            else:
+                key = ("id", id_key(update["id"]))
+            if key in merged:
+                lines = merged[key]["lines"]
+                update = dict(update, lines=[
+                    new if new is not None else old
+                    for old, new in zip(lines, update["lines"])
+                ])
+            merged[key] = update
+        with self.transaction():
+            for update in merged.values():
+                command = update.get("print", "on_next_or_id")
+                if command == "on_index":
+                    self.display_on_index(update["lines"], update["index"])
+                elif command == "on_id":
+                    self.display_on_id(update["lines"], update["id"])
+                elif command == "on_next":
+                    self.display_on_next(update["lines"], update["id"])
+                elif command == "on_next_or_id":
+                    self.display_on_next_or_id(update["lines"], update["id"])
+                elif command == "on_shift":
+                    self.display_and_shift(update["lines"], update.get("id"))
 
     def exit(self) -> None:
         """ Turns of Backlight for every display. """
@@ -63,58 +454,77 @@ class Matrix:
             if not display.is_on():
                 continue
             display.set_text(
-                f"ID:    {hex(display.identifier)}",
-                f"Index: {self.displays.index(display)}"
+                f"ID:    {display.name}",
+                f"Index: {display.position}"
             )
 
+    def data_id_positions(self, data_id) -> list:
+        """ Sorted positions of the displays showing the data_id """
+        return self.id_index.get(id_key(data_id), [])
+
     def find_data_id_display(self, id) -> Display:
-        """ search self.displays for a display with the set id as data_id. """
-        for display in self.displays:
-            if display.data_id == id:
-                return display
-        return None
+        """ Returns the first display with the set id as data_id. """
+        positions = self.data_id_positions(id)
+        if not positions:
+            return None
+        return self.displays[positions[0]]
 
-    def display_on_id(self, lines: list, data_id: str) -> bool:
+    def display_on_id(self, lines: list, data_id: str) -> Display:
         """ Displays some text on a display using the data_id and the provided
             lines list [line1, line2]
+            Returns the display or None if no display shows the data_id.
         """
         id_display = self.find_data_id_display(data_id)
         if id_display:
             id_display.set_text(lines[0], lines[1])
-            return True
-        return False
+            return id_display
+        return None
+
+    def display_on_index(self, lines: list, index: int) -> Display:
+        """ Displays some text on the display at index in self.displays
+            Returns the display or None if the index does not exist.
+        """
+        if index not in range(len(self.displays)):
+            return None
+        display = self.displays[index]
+        if not display.is_on():
+            display.toggle_display()
+        display.set_text(lines[0], lines[1])
+        return display
 
     def find_next_free_display(self) -> Display:
-        """ Search self.display for the next unlocked display """
-        displays_to_check = list(range(self.last_used + 1, len(self.displays)))
-        displays_to_check += list(range(0, self.last_used + 1))
-        for index in displays_to_check:
-            if self.displays[index].locked:
-                continue
-            return self.displays[index]
-        return None
+        """ Returns the next unlocked display after the last used one """
+        if not self.free_positions:
+            return None
+        index = bisect_right(self.free_positions, self.last_used)
+        if index == len(self.free_positions):
+            index = 0
+        return self.displays[self.free_positions[index]]
 
-    def display_on_next(self, lines: list, data_id: str) -> None:
-        """ Displays some text provided by lines [line1, line2]. """
+    def display_on_next(self, lines: list, data_id: str) -> Display:
+        """ Displays some text provided by lines [line1, line2].
+            Returns the display or None if all displays are locked.
+        """
         next_display = self.find_next_free_display()
         if not next_display:
             # No unlocked active display found
             # Return without displaying the data
-            return
+            return None
         if not next_display.is_on():
             next_display.toggle_display()
         next_display.set_text(lines[0], lines[1])
         next_display.data_id = data_id
-        self.last_used = self.displays.index(next_display)
+        self.last_used = next_display.position
+        return next_display
 
-    def display_on_next_or_id(self, lines: list, data_id) -> None:
+    def display_on_next_or_id(self, lines: list, data_id) -> Display:
         """ Tries to write data on a display with the provided data_id.
             If the display does not exist, then the next unlocked display is
             searched and written on
+            Returns the display or None if nothing was displayed.
         """
-        if self.display_on_id(lines, data_id):
-            return
-        self.display_on_next(lines, data_id)
+        return self.display_on_id(lines, data_id) \
+            or self.display_on_next(lines, data_id)
 
     def lock_display(self, index: int = None, id: str = None) -> None:
         """ Locks a display specified by data_id or the index in the list.
@@ -148,19 +558,33 @@ class Matrix:
         """ Add new text to the first display which is not a maintainance
             or locked display.
             All displays will be shifted by one.
+            The displays form the ring of slots, every display takes the
+            lines it will show once its pending lines are written from the
+            display before it. Only displays whose text changes get new
+            lines and the LCD writes just the cells which differ.
         """
-        for display in self.displays:
-            if display.data_id == "maintainance" or display.locked:
-                continue
-            old_lines = display.current_lines
+        displays = [
+            display for display in self.displays
+            if display.data_id != "maintainance" and not display.locked
+        ]
+        if not displays:
+            return
+        slots = [
+            [display.pending_lines(), display.data_id] for display in displays
+        ]
+        # A line set to None keeps the text of the first display
+        first = slots[0][0]
+        slots.insert(0, [
+            [first[index] if lines[index] is None else f"{lines[index]}"
+             for index in range(2)],
+            id
+        ])
+        for display, (slot_lines, slot_id) in zip(displays, slots):
             if not display.is_on():
                 display.toggle_display()
-            old_id = display.data_id
-            display.set_text(lines[0], lines[1])
-            display.data_id = id
-            lines = old_lines
-            id = old_id
-        # next_display.set_text(lines[0], lines[1])
+            if display.pending_lines() != slot_lines:
+                display.set_text(slot_lines[0], slot_lines[1])
+            display.data_id = slot_id
 
 # NOTE: Display switching is work in progess and currently not needed that much
 #
@@ -0,0 +1,156 @@
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+
+# Example usage:
+# metrics = Metrics()
+# matrix = Matrix([...], metrics=metrics)
+# server = MatrixCommandReceiver(matrix, metrics_port=9100)
+#     curl http://<address>:9100/metrics
+# or ask a running receiver:
+#     MatrixCommandSender("10.10.10.5", 80).get_stats()
+#
+# Without a Metrics object nothing is recorded, every instrumented place
+# only checks if its metrics attribute is None.
+
+# Upper bounds in seconds of the latency and write time histograms
+TIME_BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5
+]
+
+
+class Histogram:
+    def __init__(self, buckets: list) -> None:
+        """ Counts observed values in buckets with an upper bound """
+        self.buckets = buckets
+        # The last count is for values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """ Returns (upper bound, count of values up to it) pairs """
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+def _labels(labels: tuple) -> str:
+    """ Prometheus label set of (name, value) pairs """
+    if not labels:
+        return ""
+    text = ",".join(
+        '{}="{}"'.format(
+            name, f"{value}".replace("\\", "\\\\").replace('"', '\\"')
+        )
+        for name, value in labels
+    )
+    return "{" + text + "}"
+
+
+class Metrics:
+    def __init__(self, prefix: str = "lcd_matrix_") -> None:
+        """
+            Collects counters and histograms of the display pipeline.
+            Values are identified by their name and a tuple of
+            (label, value) pairs. Gauges are read from collectors, which
+            are only called when the metrics are rendered.
+        """
+        self.prefix = prefix
+        self.lock = Lock()
+        self.counters = Counter()
+        self.histograms = {}
+        self.collectors = []
+        self.help = {}
+
+    def describe(self, name: str, text: str) -> None:
+        self.help[name] = text
+
+    def inc(self, name: str, labels: tuple = (), value: int = 1) -> None:
+        with self.lock:
+            self.counters[name, labels] += value
+
+    def observe(self, name: str, value: float, labels: tuple = ()) -> None:
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = Histogram(TIME_BUCKETS)
+                self.histograms[name, labels] = histogram
+            histogram.observe(value)
+
+    def add_collector(self, collector) -> None:
+        """ collector returns a list of (name, type, labels, value) with
+            type "counter" or "gauge"
+        """
+        self.collectors.append(collector)
+
+    def collect(self) -> list:
+        """ Returns (name, type, labels, value) of all counters and the
+            values of the collectors
+        """
+        with self.lock:
+            samples = [
+                (name, "counter", labels, value)
+                for (name, labels), value in self.counters.items()
+            ]
+        for collector in self.collectors:
+            samples += collector()
+        return samples
+
+    def snapshot(self) -> dict:
+        """ All values as a json serialisable dict """
+        values = {}
+        for name, _, labels, value in self.collect():
+            key = name + _labels(labels)
+            values[key] = value
+        with self.lock:
+            for (name, labels), histogram in self.histograms.items():
+                values[name + _labels(labels)] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": {
+                        f"{bound}": count
+                        for bound, count in histogram.cumulative()
+                    },
+                }
+        return values
+
+    def render(self) -> str:
+        """ All values in the Prometheus text format """
+        families = {}
+        for name, kind, labels, value in self.collect():
+            families.setdefault((name, kind), []).append((labels, value))
+        lines = []
+        for (name, kind), samples in sorted(families.items()):
+            if name in self.help:
+                lines.append(f"# HELP {self.prefix}{name} {self.help[name]}")
+            name = self.prefix + name
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples, key=lambda s: f"{s[0]}"):
+                lines.append(f"{name}{_labels(labels)} {value}")
+        with self.lock:
+            histograms = sorted(
+                self.histograms.items(), key=lambda item: f"{item[0]}"
+            )
+            types = set()
+            for (name, labels), histogram in histograms:
+                name = self.prefix + name
+                if name not in types:
+                    types.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, count in histogram.cumulative():
+                    bucket = labels + (("le", bound),)
+                    lines.append(f"{name}_bucket{_labels(bucket)} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(
+                    f"{name}_count{_labels(labels)} {histogram.count}"
+                )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,258 @@
+from json import dumps
+from struct import Struct
+
+# Framing of the messages exchanged between MatrixCommandSender and
+# MatrixCommandReceiver.
+# Every message is a json object terminated by "\n".
+# An empty line ("\n\n" after a message) ends the connection.
+# Connections can use a binary protocol instead, see below.
+#
+# Without a connection json messages can be sent as UDP datagrams, also to
+# a multicast group. A datagram holds one or more messages of up to
+# MAX_DATAGRAM bytes, only the DATAGRAM_COMMANDS are accepted. A message
+# or batch update for a data_id can carry a sequence number "seq", which
+# has to grow for every message of the data_id. Messages with a sequence
+# number not above the last one of their data_id are stale and dropped.
+# A receiver keeps the sequence numbers of the MAX_SEQUENCES data_ids
+# updated most recently.
+MAX_DATAGRAM = 65507
+MAX_SEQUENCES = 4096
+DATAGRAM_COMMANDS = ["print", "batch"]
+#
+# A json message with "ack": <correlation id> sent over a connection is
+# answered by the line {"ack": <correlation id>, "outcome": <outcome>,
+# "depth": <messages and lines waiting in the receiver>}.
+OUTCOME_DISPLAYED = "displayed"
+# The lines replaced lines which were not shown yet
+OUTCOME_COALESCED = "coalesced"
+# Waiting for the rate window of the data_id, see FlowController
+OUTCOME_DEFERRED = "deferred"
+# Waited longer than the max_age of its class
+OUTCOME_DROPPED = "dropped"
+OUTCOME_NO_DISPLAY = "no_display"
+# All displays are locked
+OUTCOME_LOCKED = "locked"
+# Outcome of all other commands
+OUTCOME_OK = "ok"
+OUTCOME_INVALID = "invalid"
+
+
+class LineDecoder:
+    def __init__(self, max_line: int = 65536) -> None:
+        """
+            Incremental decoder splitting a byte stream into lines.
+            Data is buffered as bytes until a full line arrived, so
+            multibyte UTF-8 characters split across reads are decoded
+            correctly. Lines longer than max_line are dropped.
+        """
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.discarding = False
+
+    def feed(self, data: bytes) -> list:
+        """ Add received data and return all complete lines as str """
+        self.buffer += data
+        lines = []
+        while True:
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(self.buffer[:end])
+            del self.buffer[:end + 1]
+            if self.discarding:
+                # Rest of a line which was too long
+                self.discarding = False
+                continue
+            lines.append(line.decode("UTF-8", errors="replace"))
+        if len(self.buffer) > self.max_line:
+            self.buffer.clear()
+            self.discarding = True
+        return lines
+
+
+# Binary protocol
+# A connection starting with BINARY_MAGIC uses binary frames instead of
+# json lines. Every frame starts with a header:
+#     magic (B), opcode (B), flags (B), target (H), payload length (H)
+# target is the display index or a per connection interned data_id.
+# Print frames carry two lines of LINE_WIDTH bytes as payload.
+# OP_INTERN assigns the json encoded data_id in the payload to the target.
+# A connection interns up to MAX_INTERNED data_ids. After that the sender
+# reassigns the key of the least recently used data_id and the receiver
+# drops OP_INTERN frames with a larger key.
+BINARY_MAGIC = 0xB7
+HEADER = Struct(">BBBHH")
+LINE_WIDTH = 16
+MAX_INTERNED = 4096
+
+OP_CLOSE = 0x00
+OP_EXIT = 0x01
+OP_SELFTEST = 0x02
+OP_LOCK_ID = 0x03
+OP_LOCK_INDEX = 0x04
+OP_UNLOCK_ID = 0x05
+OP_UNLOCK_INDEX = 0x06
+OP_ON_ID = 0x10
+OP_ON_NEXT = 0x11
+OP_ON_NEXT_OR_ID = 0x12
+OP_ON_SHIFT = 0x13
+OP_ON_INDEX = 0x14
+OP_INTERN = 0x20
+OP_BATCH_BEGIN = 0x30
+OP_BATCH_END = 0x31
+
+FLAG_LINE_1 = 0b001
+FLAG_LINE_2 = 0b010
+FLAG_NO_ID = 0b100
+
+PRINT_OPCODES = {
+    "on_id": OP_ON_ID,
+    "on_next": OP_ON_NEXT,
+    "on_next_or_id": OP_ON_NEXT_OR_ID,
+    "on_shift": OP_ON_SHIFT,
+    "on_index": OP_ON_INDEX,
+}
+PRINT_COMMANDS = {opcode: name for name, opcode in PRINT_OPCODES.items()}
+OPCODE_NAMES = {
+    OP_CLOSE: "close",
+    OP_EXIT: "exit",
+    OP_SELFTEST: "selftest",
+    OP_LOCK_ID: "lock",
+    OP_LOCK_INDEX: "lock",
+    OP_UNLOCK_ID: "unlock",
+    OP_UNLOCK_INDEX: "unlock",
+    OP_INTERN: "intern",
+    OP_BATCH_BEGIN: "batch",
+    OP_BATCH_END: "batch",
+}
+OPCODE_NAMES.update(PRINT_COMMANDS)
+
+
+class Frame:
+    def __init__(self, opcode: int, flags: int, target: int,
+                 payload: bytes) -> None:
+        self.opcode = opcode
+        self.flags = flags
+        self.target = target
+        self.payload = payload
+
+    @property
+    def lines(self) -> list:
+        """ The two lines of a print frame, None if not set """
+        lines = []
+        for index, flag in enumerate((FLAG_LINE_1, FLAG_LINE_2)):
+            if not self.flags & flag:
+                lines.append(None)
+                continue
+            line = self.payload[index * LINE_WIDTH:(index + 1) * LINE_WIDTH]
+            lines.append(line.rstrip(b"\x00").decode("latin-1"))
+        return lines
+
+
+class BinaryDecoder:
+    def __init__(self) -> None:
+        """ Incremental decoder splitting a byte stream into Frames """
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        """ Add received data and return all complete frames """
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            magic, opcode, flags, target, length = \
+                HEADER.unpack_from(self.buffer)
+            if magic != BINARY_MAGIC:
+                raise ValueError("Binary frame without magic byte")
+            if len(self.buffer) < HEADER.size + length:
+                break
+            payload = bytes(self.buffer[HEADER.size:HEADER.size + length])
+            del self.buffer[:HEADER.size + length]
+            frames.append(Frame(opcode, flags, target, payload))
+        return frames
+
+
+def encode_frame(opcode: int, flags: int = 0, target: int = 0,
+                 payload: bytes = b"") -> bytes:
+    return HEADER.pack(BINARY_MAGIC, opcode, flags, target, len(payload)) \
+        + payload
+
+
+def encode_lines(lines: list) -> tuple:
+    """ Returns flags and payload for the lines of a print frame """
+    flags = 0
+    payload = b""
+    for index, flag in enumerate((FLAG_LINE_1, FLAG_LINE_2)):
+        line = lines[index] if index < len(lines) else None
+        if line is not None:
+            flags |= flag
+            line = f"{line}"
+        else:
+            line = ""
+        payload += line[:LINE_WIDTH].encode("latin-1", errors="replace") \
+            .ljust(LINE_WIDTH, b"\x00")
+    return flags, payload
+
+
+def encode_intern(key: int, data_id) -> bytes:
+    return encode_frame(OP_INTERN, 0, key, dumps(data_id).encode("UTF-8"))
+
+
+def intern_id(data_id, interned: dict) -> tuple:
+    """ Returns (key, frames) for a data_id. frames contains the
+        OP_INTERN frame if the data_id was not interned before.
+        interned is kept in the order the data_ids were last used.
+    """
+    name = dumps(data_id)
+    if name in interned:
+        key = interned[name] = interned.pop(name)
+        return key, b""
+    if len(interned) < MAX_INTERNED:
+        key = len(interned)
+    else:
+        # Reassign the key of the least recently used data_id
+        key = interned.pop(next(iter(interned)))
+    interned[name] = key
+    return key, encode_intern(key, data_id)
+
+
+def encode_message(msg: dict, interned: dict) -> bytes:
+    """ Encode a json message of the sender into binary frames.
+        interned maps the data_ids known by the connection to their keys
+        and is updated with new data_ids.
+    """
+    data = msg.get("data", {})
+    if msg.get("exit"):
+        return encode_frame(OP_EXIT)
+    if msg.get("selftest"):
+        return encode_frame(OP_SELFTEST)
+    for command, by_id, by_index in (
+        ("lock", OP_LOCK_ID, OP_LOCK_INDEX),
+        ("unlock", OP_UNLOCK_ID, OP_UNLOCK_INDEX)
+    ):
+        if not msg.get(command):
+            continue
+        if "id" in data:
+            key, frames = intern_id(data["id"], interned)
+            return frames + encode_frame(by_id, 0, key)
+        return encode_frame(by_index, 0, data["index"])
+    if msg.get("batch"):
+        frames = encode_frame(OP_BATCH_BEGIN)
+        for update in msg["batch"]:
+            frames += encode_print(
+                update.get("print", "on_next_or_id"), update, interned
+            )
+        return frames + encode_frame(OP_BATCH_END)
+    if msg.get("print"):
+        return encode_print(msg["print"], data, interned)
+    raise ValueError(f"Message can not be encoded: {msg}")
+
+
+def encode_print(command: str, data: dict, interned: dict) -> bytes:
+    flags, payload = encode_lines(data["lines"])
+    opcode = PRINT_OPCODES[command]
+    if opcode == OP_ON_INDEX:
+        return encode_frame(opcode, flags, data["index"], payload)
+    if data.get("id") is None:
+        return encode_frame(opcode, flags | FLAG_NO_ID, 0, payload)
+    key, frames = intern_id(data["id"], interned)
+    return frames + encode_frame(opcode, flags, key, payload)
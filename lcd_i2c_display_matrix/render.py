@@ -0,0 +1,103 @@
+from threading import Thread, Event, RLock
+from time import monotonic
+
+# Example usage:
+# matrix = Matrix([0x20, 0x21, 0x22, 0x23], fps=20)
+# canvas = matrix.create_canvas()
+# canvas.draw_text(0, 0, "Shown in the next frame")
+# canvas.commit()
+# print(matrix.renderer.stats())
+# matrix.stop_render_loop()     # lines are written at once again
+
+
+class Renderer:
+    def __init__(self, matrix, fps: float = 20) -> None:
+        """
+            Writes all displays of a matrix in frames of a fixed rate.
+            Lines set on a display are collected in the back buffer of its
+            mailbox instead of waking its writer, so producers never wait
+            for the bus. Every tick the back buffers of all displays are
+            swapped into the pending frames while the bus schedulers are
+            held, then every bus writes the frame in one pass. A display
+            only writes the lines and cells which differ from what it
+            shows, so the bus load is bounded by the frame rate.
+            Updates made inside matrix.transaction are always shown in
+            the same frame. Power and marquee commands are not framed.
+        """
+        self.matrix = matrix
+        self.interval = 1 / fps
+        # Held while swapping and by matrix.transaction
+        self.lock = RLock()
+        self.frames = 0
+        # Frames swapped while lines of the last frame were not written
+        self.overruns = 0
+        # Ticks left out because the loop fell behind
+        self.skipped = 0
+        self.stop_event = Event()
+        for display in matrix.displays:
+            display.mailbox.set_framed(True)
+        self.thread = Thread(
+            target=self.render_thread,
+            args=(),
+            daemon=True
+        )
+        self.thread.start()
+
+    def tick(self) -> int:
+        """ Swap the back buffers of all displays and start writing them.
+            Returns the number of displays with new lines.
+        """
+        schedulers = list(self.matrix.schedulers.values())
+        with self.lock:
+            for scheduler in schedulers:
+                scheduler.hold()
+            try:
+                displays = self.matrix.displays
+                if any(display.mailbox.has_lines() for display in displays):
+                    self.overruns += 1
+                changed = len([
+                    display for display in displays
+                    if display.mailbox.swap()
+                ])
+                self.frames += 1
+            finally:
+                for scheduler in schedulers:
+                    scheduler.release()
+        return changed
+
+    def render_thread(self) -> None:
+        """ Calls tick every interval until the renderer is stopped.
+            Ticks which are already over are left out instead of being
+            caught up with.
+        """
+        next_tick = monotonic()
+        while not self.stop_event.wait(max(next_tick - monotonic(), 0)):
+            self.tick()
+            next_tick += self.interval
+            behind = monotonic() - next_tick
+            if behind > 0:
+                missed = int(behind / self.interval) + 1
+                self.skipped += missed
+                next_tick += missed * self.interval
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+        }
+
+    def collect_metrics(self) -> list:
+        """ Frame counters for Metrics """
+        return [
+            (f"render_{name}_total", "counter", (), value)
+            for name, value in self.stats().items()
+        ]
+
+    def stop(self) -> None:
+        """ Stops the loop, lines set from now on are written at once """
+        self.stop_event.set()
+        self.thread.join()
+        with self.lock:
+            for display in self.matrix.displays:
+                display.mailbox.set_framed(False)
@@ -0,0 +1,246 @@
+from argparse import ArgumentParser
+from heapq import heappush, heappop
+from json import dumps, loads
+from json.decoder import JSONDecodeError
+from random import Random
+from threading import Thread, Lock, Event
+from time import time, perf_counter, sleep
+from .emulator import simulated_buses
+from .matrix import Matrix
+from .metrics import Metrics
+from .lcd_websocket_listener import MatrixCommandReceiver
+from .lcd_websocket_sender import MatrixCommandSender
+
+# Example usage:
+# Record everything a receiver gets
+#     recorder = CommandRecorder("commands.log")
+#     server = MatrixCommandReceiver(matrix, recorder=recorder)
+#
+# Send the log again at 4 times the speed, None sends it at once
+#     with MatrixCommandSender("10.10.10.5", 80, True, 20) as sender:
+#         replay("commands.log", sender, speed=4)
+#
+# 8 producers with 16 data_ids each updating 10 times a second
+#     generate_load(sender, producers=8, ids=16, rate=10, duration=30)
+#
+# Measure a receiver and matrix on a simulated bus without hardware:
+#     python -m lcd_i2c_display_matrix.replay replay commands.log --speed 0
+#     python -m lcd_i2c_display_matrix.replay load --producers 8 --rate 20
+# or against a running receiver with --address and --port.
+#
+# Every line of a log is [unix time, message] with the message in the json
+# format of the receiver. Binary frames are logged as the json message
+# doing the same.
+
+
+class CommandRecorder:
+    def __init__(self, path: str, flush_interval: float = 1) -> None:
+        """
+            Appends every message to the log at path.
+            Lines are buffered and written by a thread every
+            flush_interval seconds, a crash loses at most that much.
+            A partly written last line is skipped by read_log.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.file = open(path, "a", encoding="UTF-8")
+        self.lock = Lock()
+        self.recorded = 0
+        self.stop_event = Event()
+        self.thread = Thread(
+            target=self.flush_thread,
+            args=(),
+            daemon=True
+        )
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def record(self, msg: dict) -> None:
+        """ Append a message, its "ack" is left out since a replaying
+            sender does not read the replies
+        """
+        msg = {key: value for key, value in msg.items() if key != "ack"}
+        line = dumps([round(time(), 4), msg], separators=(",", ":"))
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(line + "\n")
+            self.recorded += 1
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def flush_thread(self) -> None:
+        """ Writes the buffered lines until the recorder is closed """
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """ Write the buffered lines and close the log """
+        self.stop_event.set()
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_log(path: str):
+    """ Yields (unix time, message) of every valid line of a log """
+    with open(path, encoding="UTF-8") as log:
+        for line in log:
+            try:
+                timestamp, msg = loads(line)
+            except (JSONDecodeError, ValueError, TypeError):
+                # Broken line, e.g. cut off by a crash
+                continue
+            if isinstance(msg, dict):
+                yield timestamp, msg
+
+
+def replay(path: str, sender: MatrixCommandSender,
+           speed: float = 1) -> int:
+    """ Send all messages of a log through the sender.
+        speed 1 keeps the recorded gaps between messages, 2 halves them
+        and None or 0 sends the messages as fast as possible.
+        Returns the number of messages sent.
+    """
+    sent = 0
+    first = None
+    start = perf_counter()
+    for timestamp, msg in read_log(path):
+        if first is None:
+            first = timestamp
+        if speed:
+            delay = start + (timestamp - first) / speed - perf_counter()
+            if delay > 0:
+                if sender.persistent:
+                    # Do not hold back messages while waiting
+                    sender.flush()
+                sleep(delay)
+        sender.send_message(msg)
+        sent += 1
+    if sender.persistent:
+        sender.flush()
+    return sent
+
+
+def generate_load(sender: MatrixCommandSender, producers: int = 4,
+                  ids: int = 8, rate: float = 10, duration: float = 10,
+                  command: str = "on_next_or_id", seed: int = None) -> dict:
+    """ Send the updates of producers sources for duration seconds.
+        Every producer has its own set of ids data_ids and updates a
+        random one of them rate times a second. The producers start
+        shifted so their updates are spread evenly.
+        Returns the number of messages sent and the achieved rate.
+    """
+    random = Random(seed)
+    interval = 1 / rate
+    # (due, producer) of the next update of every producer
+    queue = []
+    for producer in range(producers):
+        heappush(queue, (interval * producer / producers, producer))
+    sent = 0
+    start = perf_counter()
+    while queue:
+        due, producer = heappop(queue)
+        if due >= duration:
+            break
+        delay = start + due - perf_counter()
+        if delay > 0:
+            if sender.persistent:
+                sender.flush()
+            sleep(delay)
+        data_id = f"load{producer}.{random.randrange(ids)}"
+        sender.send(command, [f"{data_id}", f"{sent}"], data_id)
+        sent += 1
+        heappush(queue, (due + interval, producer))
+    if sender.persistent:
+        sender.flush()
+    seconds = perf_counter() - start
+    return {
+        "sent": sent,
+        "seconds": seconds,
+        "messages_per_second": sent / seconds if seconds else 0,
+    }
+
+
+def simulated_receiver(displays: int = 8, clock: int = 100000) -> tuple:
+    """ Start a receiver on 127.0.0.1 for a matrix on simulated buses.
+        Returns (receiver, port, buses).
+    """
+    identifiers, buses = simulated_buses(displays, clock)
+    matrix = Matrix(
+        identifiers,
+        bus_factory=lambda number: buses[number],
+        metrics=Metrics()
+    )
+    receiver = MatrixCommandReceiver(matrix, "127.0.0.1", 0)
+    Thread(target=receiver.start, args=(), daemon=True).start()
+    receiver.ready.wait()
+    return receiver, receiver.port, buses
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Replay recorded commands or generate synthetic load"
+    )
+    parser.add_argument("mode", choices=["replay", "load"])
+    parser.add_argument("log", nargs="?", help="log file to replay")
+    parser.add_argument("--address", help="receiver to send to, without "
+                        "it a matrix on a simulated bus is started")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument("--displays", type=int, default=8,
+                        help="displays of the simulated matrix")
+    parser.add_argument("--binary", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--speed", type=float, default=1,
+                        help="replay speed, 0 sends as fast as possible")
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--ids", type=int, default=8,
+                        help="data ids of every producer")
+    parser.add_argument("--rate", type=float, default=10,
+                        help="updates per second of every producer")
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+    if args.mode == "replay" and not args.log:
+        parser.error("replay needs a log file")
+
+    receiver = None
+    address, port = args.address, args.port
+    if not address:
+        receiver, port, buses = simulated_receiver(args.displays)
+        address = "127.0.0.1"
+    with MatrixCommandSender(address, port, True, args.batch_size,
+                             args.binary) as sender:
+        start = perf_counter()
+        if args.mode == "replay":
+            result = {"sent": replay(args.log, sender, args.speed)}
+        else:
+            result = generate_load(sender, args.producers, args.ids,
+                                   args.rate, args.duration)
+    if receiver:
+        # Wait until the receiver handled everything
+        sleep(1)
+        receiver.stop()
+        received = sum(
+            value for name, _, _, value in receiver.metrics.collect()
+            if name == "messages_received_total"
+        )
+        seconds = perf_counter() - start
+        result.update({
+            "received": received,
+            "received_per_second": received / seconds,
+            "bus_bytes": sum(bus.bytes for bus in buses.values()),
+        })
+        receiver.matrix.stop()
+    print(dumps(result))
+
+
+if __name__ == "__main__":
+    main()
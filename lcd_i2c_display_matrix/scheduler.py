@@ -0,0 +1,152 @@
+from threading import Thread, Condition, RLock
+from collections import deque
+from time import monotonic
+from .LCD import SMBus
+
+# Identifiers can be given as
+#     0x27                  address on bus 1
+#     (3, 0x27)             address on /dev/i2c-3
+#     (1, 0x27, 0x70, 2)    address behind channel 2 of a TCA9548A at 0x70
+
+
+def parse_identifier(identifier) -> tuple:
+    """ Returns (bus_number, address, mux) for a display identifier.
+        mux is (mux_address, channel) or None.
+    """
+    if isinstance(identifier, int):
+        return 1, identifier, None
+    if isinstance(identifier, (tuple, list)):
+        if len(identifier) == 2:
+            return identifier[0], identifier[1], None
+        if len(identifier) == 4 and identifier[3] in range(8):
+            return identifier[0], identifier[1], \
+                (identifier[2], identifier[3])
+    raise ValueError(
+        f"{identifier} is not an address, (bus, address) or "
+        "(bus, address, mux_address, mux_channel)"
+    )
+
+
+class BusScheduler:
+    def __init__(self, bus_number: int = 1, bus_factory=None) -> None:
+        """
+            Owns one I2C bus handle and a single worker thread which writes
+            the pending lines of all displays on this bus.
+            Displays with pending data are served round robin one line per
+            turn, displays with a lower priority value go first.
+            Displays with a running marquee are queued again when their
+            next step is due.
+            bus_factory is called with the bus number to open the bus,
+            e.g. to use a SimulatedSMBus. Defaults to SMBus.
+        """
+        self.bus_number = bus_number
+        self.bus = (bus_factory or SMBus)(bus_number)
+        # Every access to the bus has to hold the bus lock
+        self.bus_lock = RLock()
+        self.condition = Condition()
+        self.ready = deque()
+        self.displays = []
+        # Selected channel of every multiplexer on this bus
+        self.channels = {}
+        # While held no new lines are written
+        self.held = 0
+        self.running = True
+        self.thread = Thread(
+            target=self.scheduler_thread,
+            args=(),
+            daemon=True
+        )
+        self.thread.start()
+
+    def register(self, display) -> None:
+        """ Adds a display to the list of displays served by this bus """
+        if display not in self.displays:
+            self.displays.append(display)
+
+    def notify(self, display) -> None:
+        """ Marks a display as having pending data and wakes the worker. """
+        with self.condition:
+            if display not in self.ready:
+                self.ready.append(display)
+            self.condition.notify()
+
+    def hold(self) -> None:
+        """ Pause writing new lines until release is called.
+            A line which is currently written is finished.
+        """
+        with self.condition:
+            self.held += 1
+
+    def release(self) -> None:
+        """ Continue writing lines after hold """
+        with self.condition:
+            self.held = max(self.held - 1, 0)
+            self.condition.notify()
+
+    def select_channel(self, mux) -> None:
+        """ Routes the bus to the multiplexer channel of a display.
+            All channels of other multiplexers are closed so displays
+            with the same address behind different multiplexers do not
+            answer at the same time. Has to be called holding the bus_lock.
+        """
+        for mux_address, channel in self.channels.items():
+            if channel is None or (mux and mux[0] == mux_address):
+                continue
+            self.bus.write_byte(mux_address, 0)
+            self.channels[mux_address] = None
+        if mux and self.channels.get(mux[0]) != mux[1]:
+            self.bus.write_byte(mux[0], 1 << mux[1])
+            self.channels[mux[0]] = mux[1]
+
+    def queue_due(self) -> float:
+        """ Queue the displays whose marquee step is due.
+            Returns the seconds until the next step of the other displays,
+            None if no marquee is running. Has to be called holding the
+            condition.
+        """
+        now = monotonic()
+        timeout = None
+        for display in self.displays:
+            deadline = display.next_deadline()
+            if deadline is None or display in self.ready:
+                continue
+            if deadline <= now:
+                self.ready.append(display)
+            elif timeout is None or deadline - now < timeout:
+                timeout = deadline - now
+        return timeout
+
+    def stop(self) -> None:
+        """ Stops the worker after all pending lines have been written """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def scheduler_thread(self) -> None:
+        """ Thread to write the pending lines of all registered displays.
+            Each turn the first display of the highest priority writes a
+            single line and is put back to the end of the ready queue if
+            it has more data pending.
+        """
+        while True:
+            with self.condition:
+                while self.running:
+                    timeout = self.queue_due()
+                    if self.ready and not self.held:
+                        break
+                    self.condition.wait(timeout)
+                if not self.ready:
+                    return
+                display = min(self.ready, key=lambda ready: ready.priority)
+                self.ready.remove(display)
+            try:
+                with self.bus_lock:
+                    self.select_channel(display.mux)
+                    pending = display.write_pending()
+            except OSError as e:
+                # A failing display must not stop the other displays
+                print(f"Writing to display {display.name} failed: {e}")
+                pending = False
+            if pending:
+                self.notify(display)
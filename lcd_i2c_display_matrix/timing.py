@@ -0,0 +1,163 @@
+from json import dump, load
+from json.decoder import JSONDecodeError
+from os import makedirs
+from os.path import dirname, expanduser
+from threading import Lock
+
+# Example usage:
+# lcd.timing = PROFILES["datasheet"]
+# profile = calibrate(lcd)
+# TimingStore().save(0x27, profile)
+
+
+class TimingProfile:
+    def __init__(self, name: str, e_pulse: float, e_delay: float,
+                 cmd_delay: float = 0.002) -> None:
+        """
+            Delays used when strobing bytes into a HD44780 one by one.
+            e_pulse is the time enable is held high, e_delay the time before
+            and after the pulse. cmd_delay is the additional wait after
+            clear and home commands which need ~1.5ms on every controller.
+        """
+        self.name = name
+        self.e_pulse = e_pulse
+        self.e_delay = e_delay
+        self.cmd_delay = cmd_delay
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "e_pulse": self.e_pulse,
+            "e_delay": self.e_delay,
+            "cmd_delay": self.cmd_delay
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            data["name"],
+            data["e_pulse"],
+            data["e_delay"],
+            data.get("cmd_delay", 0.002)
+        )
+
+    def __repr__(self) -> str:
+        return f"TimingProfile({self.name}, e_pulse={self.e_pulse}, " \
+            f"e_delay={self.e_delay}, cmd_delay={self.cmd_delay})"
+
+
+PROFILES = {
+    # Delays of the original LCD implementation
+    "conservative": TimingProfile("conservative", 0.0005, 0.0005, 0.002),
+    # Enable pulse >= 450ns, command execution 37us, clear/home 1.52ms
+    "datasheet": TimingProfile("datasheet", 0.000001, 0.00005, 0.00153),
+}
+
+# Delays tried by calibrate, from slow to fast
+CALIBRATION_STEPS = [
+    0.0005, 0.0002, 0.0001, 0.00005, 0.00002, 0.00001, 0.000005, 0
+]
+
+CALIBRATION_PATTERNS = [
+    "0123456789ABCDEF",
+    "FEDCBA9876543210",
+    "\xff \xff \xff \xff \xff \xff \xff \xff ",
+]
+
+
+def get_profile(timing) -> TimingProfile:
+    """ Returns a TimingProfile for a profile name or profile """
+    if timing is None:
+        return PROFILES["conservative"]
+    if isinstance(timing, TimingProfile):
+        return timing
+    if timing not in PROFILES:
+        raise ValueError(
+            f"timing must be one of {', '.join(PROFILES)} or a TimingProfile"
+        )
+    return PROFILES[timing]
+
+
+def calibrate(lcd, rounds: int = 3) -> TimingProfile:
+    """ Steps the strobe delays of the given LCD down and writes known
+        patterns using single byte writes. The patterns are read back
+        from the DDRAM to verify them.
+        The returned profile uses one step slower than the fastest
+        reliable setting as safety margin.
+        The content of the display is lost.
+    """
+    original = lcd.timing
+    cmd_delay = original.cmd_delay
+    passed = None
+    for step, delay in enumerate(CALIBRATION_STEPS):
+        lcd.set_timing(TimingProfile("calibrating", delay, delay, cmd_delay))
+        if not _check_patterns(lcd, rounds):
+            break
+        passed = step
+    lcd.invalidate()
+    if passed is None:
+        lcd.set_timing(original)
+        return original
+    delay = CALIBRATION_STEPS[max(passed - 1, 0)]
+    profile = TimingProfile("calibrated", delay, delay, cmd_delay)
+    lcd.set_timing(profile)
+    return profile
+
+
+def _check_patterns(lcd, rounds: int) -> bool:
+    """ Write and read back all calibration patterns """
+    try:
+        for _ in range(rounds):
+            for pattern in CALIBRATION_PATTERNS:
+                lcd.lcd_byte(lcd.LCD_LINE_1, lcd.LCD_CMD)
+                for char in pattern:
+                    lcd.lcd_byte(ord(char), lcd.LCD_CHR)
+                codes = lcd.read_ddram(lcd.LCD_LINE_1, len(pattern))
+                if codes != [ord(char) for char in pattern]:
+                    return False
+    except OSError:
+        return False
+    return True
+
+
+class TimingStore:
+    def __init__(self, path: str = None) -> None:
+        """
+            Keeps the timing profile of every display in a json file so
+            a calibrated profile survives restarts.
+        """
+        self.path = expanduser(
+            path or "~/.config/lcd_i2c_display_matrix/timing.json"
+        )
+        # The buses are brought up by parallel threads
+        self.lock = Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return load(f)
+        except (OSError, JSONDecodeError):
+            return {}
+
+    def load(self, identifier) -> TimingProfile:
+        """ Returns the saved profile of a display or None """
+        with self.lock:
+            data = self._read().get(str(identifier))
+        if not data:
+            return None
+        try:
+            return TimingProfile.from_dict(data)
+        except (KeyError, TypeError):
+            return None
+
+    def save(self, identifier, profile: TimingProfile) -> None:
+        """ Saves the profile of a display """
+        with self.lock:
+            data = self._read()
+            data[str(identifier)] = profile.to_dict()
+            try:
+                makedirs(dirname(self.path), exist_ok=True)
+                with open(self.path, "w") as f:
+                    dump(data, f, indent=2)
+            except OSError as e:
+                print(f"Could not save timing profile to {self.path}: {e}")
@@ -9,7 +9,7 @@ setup(
     author_email="dominichoessl@gmail.com",
     license="",
     packages=['lcd_i2c_display_matrix'],
-    install_requires=['smbus', 'netifaces'],
+    install_requires=['smbus2', 'netifaces'],
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -0,0 +1,40 @@
+from threading import Thread
+from time import monotonic, sleep
+import pytest
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.lcd_websocket_listener import (
+    MatrixCommandReceiver
+)
+from lcd_i2c_display_matrix.matrix import Matrix
+from lcd_i2c_display_matrix.metrics import Metrics
+
+
+def _wait_for(condition, timeout: float = 2) -> bool:
+    """ Poll condition until it is true, False after timeout seconds """
+    end = monotonic() + timeout
+    while not condition():
+        if monotonic() > end:
+            return False
+        sleep(.01)
+    return True
+
+
+@pytest.fixture
+def wait_for():
+    return _wait_for
+
+
+@pytest.fixture
+def receiver():
+    """ Yields (receiver, bus) of a receiver on 127.0.0.1 for a matrix
+        of 4 displays on a simulated bus
+    """
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21, 0x22, 0x23],
+                    bus_factory=lambda number: bus, metrics=Metrics())
+    server = MatrixCommandReceiver(matrix, "127.0.0.1", 0)
+    Thread(target=server.start, args=(), daemon=True).start()
+    server.ready.wait()
+    yield server, bus
+    server.stop()
+    matrix.stop()
@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from lcd_i2c_display_matrix.lcd_websocket_sender import (
+    AsyncMatrixCommandSender
+)
+from lcd_i2c_display_matrix.protocol import (
+    OUTCOME_COALESCED, OUTCOME_DISPLAYED, OUTCOME_INVALID, OUTCOME_LOCKED,
+    OUTCOME_NO_DISPLAY, OUTCOME_OK
+)
+
+
+def run(port: int, talk, max_in_flight: int = 8):
+    """ Run the coroutine talk with a connected sender """
+    async def main():
+        async with AsyncMatrixCommandSender(
+            "127.0.0.1", port, max_in_flight
+        ) as sender:
+            return await talk(sender)
+    return asyncio.run(main())
+
+
+def test_replies_carry_the_outcome(receiver):
+    server, bus = receiver
+
+    async def talk(sender):
+        futures = [
+            await sender.display_on_next_or_id(["shown", ""], "a"),
+            await sender.display_on_id(["nowhere", ""], "missing"),
+            await sender.send("on_sideways", ["", ""], "a"),
+            await sender.send_message({"lock": True, "data": {"id": "a"}}),
+        ]
+        return [await future for future in futures]
+
+    replies = run(server.port, talk)
+    assert [reply["ack"] for reply in replies] == [0, 1, 2, 3]
+    assert [reply["outcome"] for reply in replies] == [
+        OUTCOME_DISPLAYED, OUTCOME_NO_DISPLAY, OUTCOME_INVALID, OUTCOME_OK
+    ]
+    assert all(reply["depth"] >= 0 for reply in replies)
+
+
+def test_locked_wall_is_reported(receiver):
+    server, bus = receiver
+    for display in server.matrix.displays:
+        display.locked = True
+
+    async def talk(sender):
+        return await (await sender.display_on_next(["full", ""], "b"))
+
+    assert run(server.port, talk)["outcome"] == OUTCOME_LOCKED
+
+
+def test_replaced_lines_are_coalesced_and_counted_in_depth(receiver,
+                                                           wait_for):
+    server, bus = receiver
+    scheduler = server.matrix.schedulers[1]
+    scheduler.hold()
+
+    async def talk(sender):
+        first = await (await sender.display_on_index(["first", ""], 2))
+        second = await (await sender.display_on_index(["second", ""], 2))
+        return first, second, sender.depth
+
+    try:
+        first, second, depth = run(server.port, talk)
+    finally:
+        scheduler.release()
+    assert first["outcome"] == OUTCOME_DISPLAYED
+    assert second["outcome"] == OUTCOME_COALESCED
+    # Both lines of display 2 are waiting while the bus is held
+    assert second["depth"] >= 2
+    assert depth == second["depth"]
+    assert wait_for(lambda: bus.devices[0x22].visible_lines()[0] == "second")
+
+
+def test_in_flight_messages_are_limited(receiver):
+    server, bus = receiver
+
+    async def talk(sender):
+        futures = []
+        for index in range(6):
+            futures.append(
+                await sender.display_on_next_or_id([f"{index}", ""], "c")
+            )
+            assert len(sender.in_flight) <= 2
+        return await asyncio.gather(*futures)
+
+    replies = run(server.port, talk, max_in_flight=2)
+    assert [reply["ack"] for reply in replies] == list(range(6))
+
+
+def test_lost_connection_fails_the_futures():
+    async def hang_up(reader, writer):
+        # Read the message and close without a reply
+        await reader.readline()
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(hang_up, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        sender = AsyncMatrixCommandSender("127.0.0.1", port)
+        future = await sender.display_on_index(["never", ""], 1)
+        with pytest.raises(ConnectionError):
+            await future
+        assert sender.in_flight == {}
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+from lcd_i2c_display_matrix.benchmark import check_thresholds, run_benchmark
+
+
+def test_frames_reach_glass():
+    result = run_benchmark("on_next", displays=2, rate=20, duration=.3,
+                           drain=.3)
+    assert result["pushed"] > 0
+    assert result["on_glass"] + result["coalesced"] == result["pushed"]
+    assert result["bus_bytes_per_frame"] > 0
+    assert result["latency_ms_max"] >= result["latency_ms_p50"]
+
+
+def test_thresholds():
+    result = {
+        "scenario": "on_next",
+        "bus_bytes_per_frame": 120.0,
+        "latency_ms_p95": 4.0,
+        "frames_per_second": 50.0,
+    }
+    assert check_thresholds(result, 200, 5, 40) == []
+    failures = check_thresholds(result, 100, 3, 60)
+    assert len(failures) == 3
+    assert failures[0].startswith("on_next: 120.0 bus bytes per frame")
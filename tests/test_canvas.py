@@ -0,0 +1,70 @@
+import pytest
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.matrix import Matrix
+
+
+@pytest.fixture
+def wall():
+    """ 2x2 displays, 32x4 characters """
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([
+        {"location": (0, 0), "identifier": 0x20},
+        {"location": (1, 0), "identifier": 0x21},
+        {"location": (0, 1), "identifier": 0x22},
+        {"location": (1, 1), "identifier": 0x23},
+    ], bus_factory=lambda number: bus)
+    yield matrix, bus
+    matrix.stop()
+
+
+def test_text_spans_displays(wall, wait_for):
+    matrix, bus = wall
+    canvas = matrix.create_canvas()
+    assert (canvas.width, canvas.height) == (32, 4)
+    canvas.draw_text(10, 3, "across two panels")
+    canvas.commit()
+    assert wait_for(lambda: [
+        bus.devices[0x22].visible_lines()[1],
+        bus.devices[0x23].visible_lines()[1],
+    ] == ["          across", " two panels"])
+
+
+def test_commit_sends_only_changed_lines(wall, wait_for):
+    matrix, bus = wall
+    canvas = matrix.create_canvas()
+    canvas.commit()
+    assert canvas.dirty == set()
+    canvas.draw_text(0, 1, "x")
+    # Drawing what is there already changes nothing
+    canvas.draw_text(0, 0, " ")
+    assert canvas.dirty == {(matrix.displays[0], 1)}
+    assert wait_for(lambda: not any(
+        display.mailbox.has_pending() for display in matrix.displays
+    ))
+    bus.reset_counters()
+    canvas.commit()
+    assert wait_for(
+        lambda: bus.devices[0x20].visible_lines()[1] == "x"
+    )
+    assert [bus.address_bytes[address] for address in (0x21, 0x22, 0x23)] \
+        == [0, 0, 0]
+
+
+def test_cells_outside_the_canvas_are_ignored(wall):
+    matrix, bus = wall
+    canvas = matrix.create_canvas()
+    canvas.draw_text(30, 0, "cut off")
+    assert canvas.get_char(31, 0) == "u"
+    assert canvas.get_char(32, 0) is None
+    canvas.set_char(-1, 0, "x")
+    assert canvas.get_char(-1, 0) is None
+
+
+def test_table_aligns_numbers(wall):
+    matrix, bus = wall
+    canvas = matrix.create_canvas()
+    canvas.draw_table(0, 0, [["temp", 21], ["humidity", 5]])
+    assert "".join(canvas.get_char(x, 0) for x in range(11)) \
+        == "temp     21"
+    assert "".join(canvas.get_char(x, 1) for x in range(11)) \
+        == "humidity  5"
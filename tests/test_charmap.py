@@ -0,0 +1,43 @@
+import pytest
+from lcd_i2c_display_matrix.charmap import CharacterMap
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.LCD import LCD
+
+
+def test_a00():
+    charmap = CharacterMap("A00")
+    assert charmap.encode("Grüße 21°C") \
+        == b"Gr\xf5\xe2e 21\xdfC"
+    assert charmap.encode("¥→") == b"\x5c\x7e"
+    # Not in the ROM, the base char or "?" is used
+    assert charmap.encode("é\\") == b"e?"
+
+
+def test_a02():
+    charmap = CharacterMap("A02")
+    assert charmap.encode("Grüße 21°C") == "Grüße 21°C".encode("latin-1")
+    assert charmap.encode("→") == b"?"
+
+
+def test_unknown_rom():
+    with pytest.raises(ValueError):
+        CharacterMap("A01")
+
+
+def test_registered_glyph_replaces_the_fallback():
+    glyphs = {}
+    charmap = CharacterMap("A00", glyphs)
+    assert charmap.encode("é") == b"e"
+    glyphs["é"] = [0] * 8
+    charmap.forget("é")
+    assert charmap.encode("é", lambda char: 3) == b"\x03"
+    # Without a free slot the fallback is used
+    assert charmap.encode("é", lambda char: None) == b"e"
+
+
+def test_rom_of_the_lcd():
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    lcd = LCD(bus=bus, i2c_addr=0x20, rom="A02")
+    lcd.message("Größe", 1)
+    assert bus.devices[0x20].visible_codes()[0][:5] \
+        == list("Größe".encode("latin-1"))
@@ -0,0 +1,104 @@
+from json import dumps
+from socket import socket, AF_INET, SOCK_DGRAM
+from threading import Thread
+import pytest
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.lcd_websocket_listener import (
+    MatrixCommandReceiver
+)
+from lcd_i2c_display_matrix.lcd_websocket_sender import MatrixDatagramSender
+from lcd_i2c_display_matrix.matrix import Matrix
+from lcd_i2c_display_matrix.metrics import Metrics
+from lcd_i2c_display_matrix.protocol import MAX_SEQUENCES
+
+
+@pytest.fixture
+def datagrams():
+    """ Yields (receiver, bus, sender) with the sender sending every
+        message at once to the UDP port of the receiver
+    """
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21, 0x22, 0x23],
+                    bus_factory=lambda number: bus, metrics=Metrics())
+    server = MatrixCommandReceiver(matrix, "127.0.0.1", 0, udp_port=0)
+    Thread(target=server.start, args=(), daemon=True).start()
+    server.ready.wait()
+    sender = MatrixDatagramSender("127.0.0.1", server.udp_port)
+    yield server, bus, sender
+    sender.close()
+    server.stop()
+    matrix.stop()
+
+
+def dropped(server, reason: str) -> int:
+    return server.metrics.counters[
+        "messages_dropped_total", (("command", reason),)
+    ]
+
+
+def test_stale_datagrams_are_dropped(datagrams, wait_for):
+    server, bus, sender = datagrams
+
+    def send(text: str, seq: int) -> None:
+        msg = {"print": "on_next_or_id",
+               "data": {"lines": [text, ""], "id": "clock"}, "seq": seq}
+        with socket(AF_INET, SOCK_DGRAM) as s:
+            s.sendto(dumps(msg).encode("UTF-8"),
+                     ("127.0.0.1", server.udp_port))
+
+    send("newer", 5)
+    assert wait_for(
+        lambda: server.matrix.find_data_id_display("clock") is not None
+    )
+    send("older", 4)
+    assert wait_for(lambda: dropped(server, "stale") == 1)
+    display = server.matrix.find_data_id_display("clock")
+    assert display.pending_lines()[0] == "newer"
+
+
+def test_sequences_keep_the_latest_data_ids(datagrams):
+    server, bus, sender = datagrams
+    for index in range(MAX_SEQUENCES + 1):
+        assert not server.is_stale(f"id{index}", 1)
+    assert len(server.sequences) == MAX_SEQUENCES
+    # The least recently updated data_id was forgotten
+    assert '"id0"' not in server.sequences
+    assert server.is_stale(f"id{MAX_SEQUENCES}", 1)
+
+
+def test_large_batches_are_split(datagrams, wait_for):
+    server, bus, sender = datagrams
+    sender.send_batch([
+        {"print": "on_index", "lines": [f"{index}", " " * 120], "index": 1}
+        for index in range(1000)
+    ])
+    assert wait_for(
+        lambda: bus.devices[0x21].visible_lines()[0] == "999"
+    )
+    assert dropped(server, "invalid") == 0
+
+
+def test_oversized_messages_are_rejected(datagrams, wait_for):
+    server, bus, sender = datagrams
+    with pytest.raises(ValueError):
+        sender.send("on_next_or_id", ["x" * 70000, ""], "large")
+    # Nothing is left behind which keeps the sender from working
+    assert sender.buffer == []
+    sender.send("on_next_or_id", ["fits", ""], "large")
+    assert wait_for(lambda: server.matrix.find_data_id_display("large")
+                    is not None)
+
+
+def test_only_print_and_batch_are_sent(datagrams):
+    server, bus, sender = datagrams
+    for command in (
+        lambda: sender.lock_by_id("clock"),
+        lambda: sender.lock_by_index(1),
+        lambda: sender.unlock_by_id("clock"),
+        lambda: sender.unlock_by_index(1),
+        sender.do_selftest,
+        sender.do_exit,
+    ):
+        with pytest.raises(ValueError):
+            command()
+    assert sender.buffer == []
@@ -0,0 +1,88 @@
+from threading import Event, Thread
+from time import perf_counter
+import pytest
+from lcd_i2c_display_matrix.display import Mailbox
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.matrix import Matrix
+
+
+def test_mailbox_keeps_the_latest_lines():
+    mailbox = Mailbox()
+    mailbox.put("first", "line 2")
+    assert not mailbox.replaced
+    mailbox.put("second", None)
+    assert mailbox.replaced
+    assert mailbox.depth() == 2
+    assert mailbox.take_line()[:2] == (0, "second")
+    assert mailbox.take_line()[:2] == (1, "line 2")
+    assert mailbox.take_line() is None
+    assert not mailbox.has_pending()
+
+
+def test_mailbox_wakes_a_waiting_writer():
+    mailbox = Mailbox()
+    stop = Event()
+    woken = []
+
+    def writer():
+        mailbox.wait(stop, 2)
+        woken.append(perf_counter())
+
+    thread = Thread(target=writer)
+    thread.start()
+    start = perf_counter()
+    mailbox.put("wake up")
+    thread.join()
+    assert woken[0] - start < 1
+
+
+def test_mailbox_calls_the_listener():
+    calls = []
+    mailbox = Mailbox(listener=lambda: calls.append(True))
+    mailbox.put("a")
+    mailbox.put_power(False)
+    assert len(calls) == 2
+    assert mailbox.take_power() is False
+    assert mailbox.take_power() is None
+
+
+@pytest.fixture
+def display():
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    matrix = Matrix([0x20], bus_factory=lambda number: bus)
+    yield matrix.displays[0], bus.devices[0x20], bus
+    matrix.stop()
+
+
+def test_backlight_keeps_the_text(display, wait_for):
+    display, device, bus = display
+    display.set_text("Hello", "World")
+    assert wait_for(lambda: device.visible_lines() == ["Hello", "World"])
+    bus.reset_counters()
+    display.set_backlight(False)
+    assert wait_for(lambda: not device.backlight)
+    # A single write to the PCF8574
+    assert bus.transactions == 1
+    assert device.display_on
+    assert device.visible_lines() == ["Hello", "World"]
+    # Writing text keeps the backlight off
+    display.set_text("Hello", "again")
+    assert wait_for(lambda: device.visible_lines()[1] == "again")
+    assert not device.backlight
+    display.set_backlight(True)
+    assert wait_for(lambda: device.backlight)
+
+
+def test_power_off_keeps_the_ddram(display, wait_for):
+    display, device, bus = display
+    display.set_text("kept", "text")
+    assert wait_for(lambda: device.visible_lines() == ["kept", "text"])
+    display.turn_off()
+    assert wait_for(lambda: not device.display_on and not device.backlight)
+    assert [chr(code) for code in device.ddram[0][:4]] == list("kept")
+    bus.reset_counters()
+    display.turn_on()
+    assert wait_for(lambda: device.display_on and device.backlight)
+    assert device.visible_lines() == ["kept", "text"]
+    # Nothing is initialised or rewritten
+    assert bus.transactions == 1
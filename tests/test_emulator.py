@@ -0,0 +1,56 @@
+import pytest
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.LCD import LCD
+from lcd_i2c_display_matrix.matrix import Matrix
+
+
+def test_lcd_lines_reach_glass():
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    lcd = LCD(bus=bus, i2c_addr=0x20)
+    lcd.message("Hello", 1)
+    lcd.message("World", 2)
+    device = bus.devices[0x20]
+    assert device.visible_lines() == ["Hello", "World"]
+    assert device.display_on and device.backlight
+
+
+def test_transactions_are_counted():
+    bus = SimulatedSMBus(1, addresses=[0x20], clock=100000)
+    bus.write_byte(0x20, 0)
+    bus.write_i2c_block_data(0x20, 0, [0, 0, 0])
+    assert bus.transactions == 2
+    # Every transaction also sends the address byte
+    assert bus.bytes == 2 + 5
+    assert bus.address_bytes[0x20] == 7
+    assert bus.bus_time == pytest.approx((2 + 9 * 2 + 2 + 9 * 5) / 100000)
+    bus.reset_counters()
+    assert (bus.transactions, bus.bytes, bus.bus_time) == (0, 0, 0)
+
+
+def test_missing_address_is_not_acknowledged():
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    with pytest.raises(OSError) as error:
+        bus.write_byte(0x21, 0)
+    assert error.value.errno == 5
+
+
+def test_listener_sees_every_write():
+    writes = []
+    bus = SimulatedSMBus(
+        1, addresses=[0x20],
+        listener=lambda address, device: writes.append(address)
+    )
+    bus.write_byte(0x20, 0)
+    assert writes == [0x20]
+
+
+def test_matrix_on_simulated_bus(wait_for):
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21], bus_factory=lambda number: bus)
+    try:
+        matrix.display_on_index(["hello", "world"], 1)
+        assert wait_for(
+            lambda: bus.devices[0x21].visible_lines() == ["hello", "world"]
+        )
+    finally:
+        matrix.stop()
@@ -0,0 +1,58 @@
+from time import sleep
+import pytest
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.flow import FlowController
+from lcd_i2c_display_matrix.matrix import Matrix
+
+
+@pytest.fixture
+def flow():
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21], bus_factory=lambda number: bus)
+    flow = FlowController(matrix, rate=10, classes={"fire": "alert"})
+    yield flow, matrix
+    flow.stop()
+    matrix.stop()
+
+
+def test_frames_within_the_window_are_deferred_and_coalesced(flow, wait_for):
+    flow, matrix = flow
+    write = matrix.display_on_next_or_id
+    assert flow.submit(write, ["first", "a"], "news")[0] == "written"
+    assert flow.submit(write, ["second", "b"], "news") == ("deferred", None)
+    assert flow.submit(write, ["third", None], "news") == ("coalesced", None)
+    assert flow.depth() == 1
+    wait_for(lambda: flow.depth() == 0)
+    display = matrix.find_data_id_display("news")
+    wait_for(lambda: display.current_lines == ["third", "b"])
+    assert flow.stats()["coalesced"] == {"normal": 1}
+
+
+def test_list_data_ids_are_keyed_by_id_key(flow, wait_for):
+    flow, matrix = flow
+    write = matrix.display_on_next_or_id
+    assert flow.submit(write, ["first", ""], ["x", 1])[0] == "written"
+    assert flow.submit(write, ["second", ""], ["x", 1])[0] == "deferred"
+    assert flow.submit(write, ["third", ""], ["x", 1])[0] == "coalesced"
+    wait_for(lambda: flow.depth() == 0)
+    assert len(matrix.data_id_positions(["x", 1])) == 1
+
+
+def test_alerts_are_never_delayed(flow):
+    flow, matrix = flow
+    write = matrix.display_on_next_or_id
+    assert flow.submit(write, ["fire", ""], "fire")[0] == "written"
+    assert flow.submit(write, ["still fire", ""], "fire")[0] == "written"
+    position = matrix.data_id_positions("fire")[0]
+    assert matrix.displays[position].priority == 0
+
+
+def test_ended_windows_are_pruned(flow):
+    flow, matrix = flow
+    write = matrix.display_on_next_or_id
+    for index in range(5):
+        flow.submit(write, ["line", ""], f"id{index}")
+    assert len(flow.last_sent) == 5
+    sleep(flow.window + .05)
+    flow.submit(write, ["line", ""], "last")
+    assert list(flow.last_sent) == ['"last"']
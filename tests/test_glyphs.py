@@ -0,0 +1,52 @@
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.LCD import LCD
+
+
+def make_lcd(glyphs: int = 9):
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    lcd = LCD(bus=bus, i2c_addr=0x20)
+    chars = [chr(0x2460 + index) for index in range(glyphs)]
+    for index, char in enumerate(chars):
+        lcd.glyphs.register(char, [index + 1] * 8)
+    return bus, lcd, chars
+
+
+def test_glyph_is_uploaded_once():
+    bus, lcd, chars = make_lcd()
+    lcd.message(chars[0] * 3, 1)
+    lcd.message(chars[0] + "x", 2)
+    assert lcd.glyphs.uploads == 1
+    device = bus.devices[0x20]
+    slot = lcd.glyphs.loaded_slot(chars[0])
+    assert device.visible_codes()[0][:3] == [slot] * 3
+    assert device.cgram[slot * 8:slot * 8 + 8] == [1] * 8
+
+
+def test_least_recently_used_hidden_slot_is_replaced():
+    bus, lcd, chars = make_lcd()
+    lcd.message("".join(chars[:8]), 1)
+    lcd.message("", 1)
+    # chars[0] was used first and is not visible any more
+    lcd.message(chars[8], 2)
+    assert lcd.glyphs.loaded_slot(chars[0]) is None
+    assert lcd.glyphs.loaded_slot(chars[8]) == 0
+
+
+def test_visible_glyphs_are_not_replaced():
+    bus, lcd, chars = make_lcd()
+    lcd.message("".join(chars[:8]), 1)
+    # All slots are visible on line 1, line 2 falls back to a ROM char
+    lcd.message(chars[8], 2)
+    assert lcd.glyphs.loaded_slot(chars[8]) is None
+    assert bus.devices[0x20].visible_codes()[0][:8] == list(range(8))
+
+
+def test_glyphs_of_a_line_are_not_evicted():
+    bus, lcd, chars = make_lcd()
+    lcd.message("".join(chars[:8]), 1)
+    lcd.message("", 1)
+    # The line needs a slot already holding one of its glyphs
+    lcd.message(chars[0] + chars[8], 1)
+    codes = bus.devices[0x20].visible_codes()[0]
+    assert codes[0] != codes[1]
+    assert codes[0] < 8 and codes[1] < 8
@@ -0,0 +1,69 @@
+from lcd_i2c_display_matrix import LCD as lcd_module
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.LCD import LCD
+
+
+def make_lcd(**kwargs):
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    return bus, LCD(bus=bus, i2c_addr=0x20, **kwargs)
+
+
+def test_line_is_one_transfer():
+    bus, lcd = make_lcd()
+    bus.reset_counters()
+    lcd.message("Hello World 1234", 1)
+    assert bus.transactions == 1
+    # Address command and 16 chars, 6 port bytes each, and the address
+    assert bus.bytes == 17 * 6 + 1
+
+
+def test_block_writes_without_i2c_rdwr(monkeypatch):
+    # python3-smbus has no i2c_msg
+    monkeypatch.setattr(lcd_module, "i2c_msg", None)
+    bus, lcd = make_lcd()
+    bus.reset_counters()
+    lcd.message("Hello World 1234", 1)
+    # 102 port bytes in blocks of 33
+    assert bus.transactions == 4
+    assert bus.devices[0x20].visible_lines()[0] == "Hello World 1234"
+
+
+def test_byte_writes_without_block_support():
+    bus, lcd = make_lcd(block_write=False)
+    lcd.message("Hello", 1)
+    lcd.message("World", 2)
+    assert bus.devices[0x20].visible_lines() == ["Hello", "World"]
+
+
+def test_unchanged_message_is_not_written():
+    bus, lcd = make_lcd()
+    lcd.message("Hello", 1)
+    bus.reset_counters()
+    lcd.message("Hello", 1)
+    assert bus.bytes == 0
+
+
+def test_only_changed_cells_are_written():
+    bus, lcd = make_lcd()
+    lcd.message("temperature 21C", 1)
+    bus.reset_counters()
+    lcd.message("temperature 22C", 1)
+    # Address command and one char
+    assert bus.bytes == 2 * 6 + 1
+    assert bus.devices[0x20].visible_lines()[0] == "temperature 22C"
+
+
+def test_changed_runs_merge_single_gaps():
+    bus, lcd = make_lcd()
+    lcd.message("aaaaaaaaaaaaaaaa", 1)
+    codes = list(lcd.encode("abaaabab" + "a" * 8, 1))
+    assert lcd.changed_runs(codes, 1) == [[1, 2], [5, 8]]
+
+
+def test_invalidated_shadow_rewrites_the_line():
+    bus, lcd = make_lcd()
+    lcd.message("Hello", 1)
+    lcd.invalidate()
+    bus.reset_counters()
+    lcd.message("Hello", 1)
+    assert bus.bytes == 17 * 6 + 1
@@ -0,0 +1,75 @@
+from time import sleep
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.marquee import DDRAM_LINE_LENGTH, Marquee
+from lcd_i2c_display_matrix.matrix import Matrix
+
+
+def test_short_text_is_loaded_once():
+    marquee = Marquee(["Breaking news", None])
+    writes = marquee.writes(0)
+    assert [(line, cell, len(codes)) for line, cell, codes in writes] \
+        == [(0, 0, DDRAM_LINE_LENGTH), (1, 0, DDRAM_LINE_LENGTH)]
+    # The text fits into the DDRAM, shifting needs no writes
+    for step in range(1, 100):
+        assert marquee.writes(step) == []
+
+
+def test_long_text_writes_the_cells_scrolling_in():
+    text = "".join(chr(ord("a") + index % 26) for index in range(50))
+    marquee = Marquee([text, None])
+    marquee.writes(0)
+    # Position 40 is the first char beyond the DDRAM, it replaces the
+    # char of position 0 in cell 0
+    assert marquee.writes(25) == [(0, 0, [ord(text[40])])]
+
+
+def test_windows():
+    marquee = Marquee(["0123456789abcdefghij", None], offset=2)
+    assert marquee.visible()[0] == "23456789abcdefgh"
+    marquee.advance()
+    marquee.advance()
+    assert marquee.visible()[0] == "3456789abcdefghi"
+
+
+def test_marquee_on_glass_and_stop_freezes(wait_for):
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    matrix = Matrix([0x20], bus_factory=lambda number: bus)
+    device = bus.devices[0x20]
+    display = matrix.displays[0]
+    text = "0123456789abcdefghijklmnopqrstuvwxyz"
+    try:
+        display.start_marquee(text, "second line", speed=50)
+        assert wait_for(lambda: device.shift > 3)
+        display.stop_marquee()
+        assert wait_for(lambda: device.shift == 0)
+        sleep(.1)
+        frozen = device.visible_lines()
+        # The text visible when stopping is kept unshifted
+        assert frozen[0] != text[:16]
+        assert frozen[0] in text.ljust(DDRAM_LINE_LENGTH) * 2
+        assert display.current_lines == [
+            line.ljust(16) for line in frozen
+        ]
+        assert display.marquee is None
+    finally:
+        matrix.stop()
+
+
+def test_marquee_row_steps_together(wait_for):
+    bus = SimulatedSMBus(1, addresses=[0x20, 0x21])
+    matrix = Matrix([
+        {"location": (0, 0), "identifier": 0x20},
+        {"location": (1, 0), "identifier": 0x21},
+    ], bus_factory=lambda number: bus)
+    try:
+        matrix.marquee_row(["left half of it right half of it", None],
+                           speed=20)
+        assert wait_for(lambda: all(
+            display.marquee for display in matrix.displays
+        ))
+        left, right = (display.marquee for display in matrix.displays)
+        assert right.offset - left.offset == 16
+        assert abs(left.step - right.step) <= 1
+    finally:
+        matrix.stop_marquee_row()
+        matrix.stop()
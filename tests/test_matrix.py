@@ -0,0 +1,226 @@
+import pytest
+from lcd_i2c_display_matrix.discovery import StateStore
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.matrix import Matrix
+from lcd_i2c_display_matrix.scheduler import parse_identifier
+
+
+def test_every_bus_gets_a_scheduler(wait_for):
+    buses = {
+        1: SimulatedSMBus(1, addresses=[0x20]),
+        3: SimulatedSMBus(3, addresses=[0x20]),
+    }
+    matrix = Matrix([(1, 0x20), (3, 0x20)],
+                    bus_factory=lambda number: buses[number])
+    try:
+        assert sorted(matrix.schedulers) == [1, 3]
+        assert [display.name for display in matrix.displays] \
+            == ["0x20", "3:0x20"]
+        matrix.display_on_index(["bus 3", ""], 1)
+        assert wait_for(
+            lambda: buses[3].devices[0x20].visible_lines()[0] == "bus 3"
+        )
+        assert buses[1].devices[0x20].visible_lines()[0] == ""
+    finally:
+        matrix.stop()
+
+
+def test_mux_channel_selection():
+    # The emulated devices at the mux addresses keep the last written byte
+    bus = SimulatedSMBus(1, addresses=[0x20, 0x21, 0x70, 0x71])
+    matrix = Matrix(
+        [(1, 0x20, 0x70, 3), [1, 0x21, 0x71, 5]],
+        bus_factory=lambda number: bus
+    )
+    scheduler = matrix.schedulers[1]
+    try:
+        assert [display.mux for display in matrix.displays] \
+            == [(0x70, 3), (0x71, 5)]
+        with scheduler.bus_lock:
+            scheduler.select_channel(matrix.displays[0].mux)
+        assert bus.devices[0x70].port == 1 << 3
+        # Channels of other multiplexers are closed
+        assert bus.devices[0x71].port == 0
+        with scheduler.bus_lock:
+            scheduler.select_channel(matrix.displays[1].mux)
+        assert bus.devices[0x70].port == 0
+        assert bus.devices[0x71].port == 1 << 5
+        assert scheduler.channels == {0x70: None, 0x71: 5}
+    finally:
+        matrix.stop()
+
+
+def test_mux_needs_a_scheduler():
+    bus = SimulatedSMBus(1, addresses=[0x20, 0x70])
+    matrix = Matrix([(1, 0x20, 0x70, 0)], shared_bus=False,
+                    bus_factory=lambda number: bus)
+    assert matrix.displays == []
+    assert list(matrix.report.failed.values())[0].args[0] \
+        .startswith("Displays behind a multiplexer")
+
+
+def test_parse_identifier():
+    assert parse_identifier(0x27) == (1, 0x27, None)
+    assert parse_identifier([3, 0x27]) == (3, 0x27, None)
+    assert parse_identifier((1, 0x27, 0x70, 2)) == (1, 0x27, (0x70, 2))
+    with pytest.raises(ValueError):
+        parse_identifier((1, 0x20, 0x70))
+
+
+@pytest.fixture
+def wall():
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21, 0x22], bus_factory=lambda number: bus)
+    yield matrix, bus
+    matrix.stop()
+
+
+def test_batch_requires_a_list(wall):
+    matrix, bus = wall
+    with pytest.raises(TypeError):
+        matrix.apply_batch({"print": "on_next"})
+    with pytest.raises(TypeError):
+        matrix.apply_batch([["on_next"]])
+
+
+def test_batch_merges_updates_of_a_data_id(wall):
+    matrix, bus = wall
+    matrix.apply_batch([
+        {"print": "on_next_or_id", "lines": ["a", "b"], "id": ["temp", 1]},
+        {"print": "on_index", "lines": ["index", ""], "index": 2},
+        {"print": "on_next_or_id", "lines": [None, "c"], "id": ["temp", 1]},
+    ])
+    display = matrix.find_data_id_display(["temp", 1])
+    assert display.pending_lines() == ["a", "c"]
+    assert len(matrix.data_id_positions(["temp", 1])) == 1
+    assert matrix.displays[2].pending_lines() == ["index", ""]
+
+
+@pytest.mark.parametrize("shared_bus", [True, False])
+def test_transaction_writes_after_the_block(shared_bus, wait_for):
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21], shared_bus=shared_bus,
+                    bus_factory=lambda number: bus)
+    devices = [bus.devices[0x20], bus.devices[0x21]]
+    try:
+        with matrix.transaction():
+            matrix.display_on_index(["left", ""], 0)
+            matrix.display_on_index(["right", ""], 1)
+            # Nested transactions end with the outermost one
+            with matrix.transaction():
+                pass
+            assert not wait_for(
+                lambda: any(device.visible_lines()[0] for device in devices),
+                .2
+            )
+        assert wait_for(lambda: [
+            device.visible_lines()[0] for device in devices
+        ] == ["left", "right"])
+    finally:
+        matrix.stop()
+
+
+def test_data_id_index(wall):
+    matrix, bus = wall
+    first = matrix.display_on_next(["a", "b"], "first")
+    second = matrix.display_on_next(["c", "d"], {"sensor": [1, 2]})
+    assert first is not second
+    assert matrix.find_data_id_display("first") is first
+    # Unhashable data_ids are found by their json
+    assert matrix.find_data_id_display({"sensor": [1, 2]}) is second
+    assert matrix.display_on_id(["e", "f"], {"sensor": [1, 2]}) is second
+    assert matrix.display_on_id(["e", "f"], "missing") is None
+    second.data_id = "renamed"
+    assert matrix.find_data_id_display({"sensor": [1, 2]}) is None
+    assert matrix.data_id_positions("renamed") == [second.position]
+
+
+def test_on_next_or_id_reuses_the_display(wall):
+    matrix, bus = wall
+    display = matrix.display_on_next_or_id(["1", ""], "ticker")
+    assert matrix.display_on_next_or_id(["2", ""], "ticker") is display
+    assert display.pending_lines()[0] == "2"
+
+
+def test_next_display_skips_locked_displays(wall):
+    matrix, bus = wall
+    matrix.displays[1].locked = True
+    assert matrix.free_positions == [0, 2]
+    used = [
+        matrix.display_on_next([f"{index}", ""], f"id{index}").position
+        for index in range(3)
+    ]
+    assert used == [0, 2, 0]
+    for display in matrix.displays:
+        display.locked = True
+    assert matrix.display_on_next(["x", ""], "x") is None
+    matrix.displays[1].locked = False
+    assert matrix.free_positions == [1]
+
+
+def test_shift_moves_the_messages_down_the_wall(wall, wait_for):
+    matrix, bus = wall
+    for index in range(4):
+        matrix.display_and_shift([f"message {index}", None], f"id{index}")
+    assert [display.data_id for display in matrix.displays] \
+        == ["id3", "id2", "id1"]
+    assert wait_for(lambda: [
+        bus.devices[address].visible_lines()[0]
+        for address in (0x20, 0x21, 0x22)
+    ] == ["message 3", "message 2", "message 1"])
+
+
+def test_shift_keeps_the_line_being_written():
+    # The first message is still on the bus when the second arrives
+    bus = SimulatedSMBus(1, addresses=[0x20, 0x21], clock=10000,
+                         realtime=True)
+    matrix = Matrix([0x20, 0x21], bus_factory=lambda number: bus)
+    try:
+        matrix.display_and_shift(["first", ""], "first")
+        mailbox = matrix.displays[0].mailbox
+        while mailbox.pending[0] is not None:
+            pass
+        matrix.display_and_shift(["second", ""], "second")
+        assert [display.pending_lines()[0] for display in matrix.displays] \
+            == ["second", "first"]
+    finally:
+        matrix.stop()
+
+
+def test_list_identifiers_are_reported_as_tuples():
+    bus = SimulatedSMBus(1, addresses=[0x20, 0x70])
+    matrix = Matrix([[1, 0x20, 0x70, 9], [1, 0x21]],
+                    bus_factory=lambda number: bus)
+    try:
+        assert list(matrix.report.failed) == [(1, 0x20, 0x70, 9)]
+        assert matrix.report.missing == [[1, 0x21]]
+        assert "Failed: (1, 32, 112, 9)" in str(matrix.report)
+    finally:
+        matrix.stop()
+
+
+def test_warm_start_takes_over_the_displays(tmp_path, wait_for):
+    state_file = str(tmp_path / "state.json")
+    bus = SimulatedSMBus(1, addresses=[0x20, 0x21])
+    matrix = Matrix([0x20, 0x21], bus_factory=lambda number: bus,
+                    state_file=state_file)
+    matrix.display_on_index(["kept", "text"], 1)
+    assert wait_for(
+        lambda: bus.devices[0x21].visible_lines() == ["kept", "text"]
+    )
+    matrix.stop()
+    bus.reset_counters()
+    matrix = Matrix([0x20, 0x21], bus_factory=lambda number: bus,
+                    state_file=state_file, warm=True)
+    try:
+        assert sorted(matrix.report.warm) == ["0x20", "0x21"]
+        assert bus.devices[0x21].visible_lines() == ["kept", "text"]
+        # The text on glass is not known as lines, clearing it is written
+        matrix.display_on_index(["", ""], 1)
+        assert wait_for(
+            lambda: bus.devices[0x21].visible_lines() == ["", ""]
+        )
+        # A state is only taken over once
+        assert StateStore(state_file).take() == {}
+    finally:
+        matrix.stop()
@@ -0,0 +1,75 @@
+from socket import socket, create_connection, AF_INET, SOCK_STREAM
+from threading import Thread
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.lcd_websocket_listener import (
+    MatrixCommandReceiver
+)
+from lcd_i2c_display_matrix.lcd_websocket_sender import MatrixCommandSender
+from lcd_i2c_display_matrix.matrix import Matrix
+from lcd_i2c_display_matrix.metrics import Metrics
+
+
+def test_histograms_are_cumulative():
+    metrics = Metrics()
+    for value in (0.0001, 0.003, 0.003, 10):
+        metrics.observe("line_write_seconds", value, (("display", "0x20"),))
+    snapshot = metrics.snapshot()['line_write_seconds{display="0x20"}']
+    assert snapshot["count"] == 4
+    assert snapshot["buckets"]["0.0005"] == 1
+    assert snapshot["buckets"]["0.005"] == 3
+    assert snapshot["buckets"]["+Inf"] == 4
+
+
+def test_render_uses_the_prometheus_text_format():
+    metrics = Metrics()
+    metrics.describe("messages_received_total", "Received messages")
+    metrics.inc("messages_received_total", (("command", "on_next"),), 2)
+    metrics.add_collector(
+        lambda: [("queue_depth", "gauge", (("display", 'a"b'),), 3)]
+    )
+    lines = metrics.render().splitlines()
+    assert "# HELP lcd_matrix_messages_received_total Received messages" \
+        in lines
+    assert "# TYPE lcd_matrix_messages_received_total counter" in lines
+    assert 'lcd_matrix_messages_received_total{command="on_next"} 2' \
+        in lines
+    assert 'lcd_matrix_queue_depth{display="a\\"b"} 3' in lines
+
+
+def test_stats_command_counts_messages(receiver, wait_for):
+    server, bus = receiver
+    sender = MatrixCommandSender("127.0.0.1", server.port)
+    sender.send("on_index", ["stats", ""], 0)
+    sender.flush()
+    key = 'messages_received_total{command="print"}'
+    assert wait_for(lambda: sender.get_stats().get(key) == 1)
+    stats = sender.get_stats()
+    assert stats['bus_bytes_total{display="0x20"}'] > 0
+    assert 'queue_depth{display="0x23"}' in stats
+
+
+def test_metrics_endpoint_serves_the_metrics():
+    with socket(AF_INET, SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        metrics_port = s.getsockname()[1]
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20], bus_factory=lambda number: bus,
+                    metrics=Metrics())
+    server = MatrixCommandReceiver(matrix, "127.0.0.1", 0,
+                                   metrics_port=metrics_port)
+    Thread(target=server.start, args=(), daemon=True).start()
+    server.ready.wait()
+    try:
+        with create_connection(("127.0.0.1", metrics_port)) as connection:
+            connection.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            reply = b""
+            data = connection.recv(65536)
+            while data:
+                reply += data
+                data = connection.recv(65536)
+        head, body = reply.decode("UTF-8").split("\r\n\r\n", 1)
+        assert head.startswith("HTTP/1.0 200 OK")
+        assert 'lcd_matrix_display_on{display="0x20"} 1' in body
+    finally:
+        server.stop()
+        matrix.stop()
@@ -0,0 +1,77 @@
+import pytest
+from lcd_i2c_display_matrix.protocol import (
+    BinaryDecoder, LineDecoder, MAX_INTERNED, OP_BATCH_BEGIN, OP_BATCH_END,
+    OP_INTERN, OP_ON_ID, OP_ON_INDEX, PRINT_COMMANDS, encode_frame,
+    encode_message, intern_id
+)
+
+
+def test_line_decoder_joins_split_characters():
+    decoder = LineDecoder()
+    data = '{"lines": ["Grüße"]}\n'.encode("UTF-8")
+    split = data.index("ü".encode("UTF-8")) + 1
+    assert decoder.feed(data[:split]) == []
+    assert decoder.feed(data[split:]) == ['{"lines": ["Grüße"]}']
+
+
+def test_line_decoder_splits_many_lines():
+    decoder = LineDecoder()
+    assert decoder.feed(b'{"a": 1}\n{"b"') == ['{"a": 1}']
+    assert decoder.feed(b': 2}\n\n') == ['{"b": 2}', ""]
+
+
+def test_line_decoder_drops_long_lines():
+    decoder = LineDecoder(max_line=8)
+    assert decoder.feed(b"x" * 20) == []
+    assert decoder.feed(b"yy\nok\n") == ["ok"]
+
+
+def test_binary_frames_round_trip():
+    interned = {}
+    data = encode_message({
+        "print": "on_id",
+        "data": {"lines": ["first", "second"], "id": {"sensor": 1}},
+    }, interned)
+    decoder = BinaryDecoder()
+    # Frames arrive in pieces
+    frames = decoder.feed(data[:3]) + decoder.feed(data[3:])
+    assert [frame.opcode for frame in frames] == [OP_INTERN, OP_ON_ID]
+    assert frames[0].payload == b'{"sensor": 1}'
+    assert frames[1].target == frames[0].target
+    assert frames[1].lines == ["first", "second"]
+
+
+def test_interned_ids_are_sent_once():
+    interned = {}
+    msg = {"print": "on_id", "data": {"lines": ["a"], "id": "x"}}
+    encode_message(msg, interned)
+    frames = BinaryDecoder().feed(encode_message(msg, interned))
+    assert [PRINT_COMMANDS[frame.opcode] for frame in frames] == ["on_id"]
+    assert frames[0].lines == ["a", None]
+
+
+def test_batch_frames():
+    frames = BinaryDecoder().feed(encode_message({"batch": [
+        {"print": "on_index", "lines": ["a", "b"], "index": 3},
+    ]}, {}))
+    assert [frame.opcode for frame in frames] == \
+        [OP_BATCH_BEGIN, OP_ON_INDEX, OP_BATCH_END]
+    assert frames[1].target == 3
+
+
+def test_binary_decoder_rejects_missing_magic():
+    with pytest.raises(ValueError):
+        BinaryDecoder().feed(b"\x00" + encode_frame(OP_ON_ID)[1:])
+
+
+def test_interned_keys_are_reused():
+    interned = {}
+    for index in range(MAX_INTERNED):
+        intern_id(f"id{index}", interned)
+    # id0 is used again, so id1 is the least recently used one
+    assert intern_id("id0", interned) == (0, b"")
+    key, frames = intern_id("new", interned)
+    assert key == 1
+    assert BinaryDecoder().feed(frames)[0].payload == b'"new"'
+    assert len(interned) == MAX_INTERNED
+    assert "\"id1\"" not in interned
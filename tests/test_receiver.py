@@ -0,0 +1,112 @@
+from json import dumps
+from socket import create_connection
+from lcd_i2c_display_matrix.lcd_websocket_sender import MatrixCommandSender
+
+
+def send_lines(port: int, *messages) -> None:
+    with create_connection(("127.0.0.1", port)) as connection:
+        connection.sendall(b"".join(
+            (dumps(msg) + "\n").encode("UTF-8") for msg in messages
+        ) + b"\n")
+
+
+def test_json_lines_reach_glass(receiver, wait_for):
+    server, bus = receiver
+    send_lines(
+        server.port,
+        {"print": "on_index", "data": {"lines": ["Hallo", "Welt"],
+                                       "index": 2}},
+        {"print": "on_next", "data": {"lines": ["next", ""], "id": "a"}},
+    )
+    assert wait_for(
+        lambda: bus.devices[0x22].visible_lines() == ["Hallo", "Welt"]
+    )
+    assert wait_for(
+        lambda: server.matrix.find_data_id_display("a") is not None
+    )
+
+
+def test_message_split_across_packets(receiver, wait_for):
+    server, bus = receiver
+    data = dumps({"print": "on_index",
+                  "data": {"lines": ["Grüße", ""], "index": 0}},
+                 ensure_ascii=False) + "\n\n"
+    data = data.encode("UTF-8")
+    split = data.index("ü".encode("UTF-8")) + 1
+    with create_connection(("127.0.0.1", server.port)) as connection:
+        connection.sendall(data[:split])
+        connection.sendall(data[split:])
+    assert wait_for(
+        lambda: server.matrix.displays[0].current_lines[0] == "Grüße"
+    )
+
+
+def test_invalid_lines_are_counted(receiver, wait_for):
+    server, bus = receiver
+    with create_connection(("127.0.0.1", server.port)) as connection:
+        connection.sendall(b"not json\n[1, 2]\n\n")
+    assert wait_for(lambda: server.metrics.snapshot().get(
+        'messages_dropped_total{command="invalid"}'
+    ) == 2)
+
+
+def test_connection_right_after_start_is_served(receiver, wait_for):
+    server, bus = receiver
+    # state is set before the server listens
+    assert server.state
+    send_lines(server.port, {"print": "on_index",
+                             "data": {"lines": ["early", ""], "index": 1}})
+    assert wait_for(
+        lambda: bus.devices[0x21].visible_lines()[0] == "early"
+    )
+
+
+def test_batch_with_a_list_data_id(receiver, wait_for):
+    server, bus = receiver
+    send_lines(server.port, {"batch": [
+        {"print": "on_next_or_id", "lines": ["a", "b"], "id": ["temp", 1]},
+        {"print": "on_next_or_id", "lines": [None, "c"], "id": ["temp", 1]},
+    ]})
+    assert wait_for(lambda: (
+        server.matrix.find_data_id_display(["temp", 1]) is not None
+        and server.matrix.find_data_id_display(["temp", 1])
+        .current_lines == ["a", "c"]
+    ))
+
+
+def test_binary_sender(receiver, wait_for):
+    server, bus = receiver
+    with MatrixCommandSender("127.0.0.1", server.port, True, 10,
+                             True) as sender:
+        sender.display_on_next_or_id(["binary", "frames"], {"id": [1]})
+        sender.send_batch([
+            {"print": "on_next_or_id", "lines": [None, "batch"],
+             "id": {"id": [1]}},
+        ])
+    assert wait_for(lambda: (
+        server.matrix.find_data_id_display({"id": [1]}) is not None
+        and server.matrix.find_data_id_display({"id": [1]})
+        .current_lines == ["binary", "batch"]
+    ))
+
+
+def test_failing_frame_keeps_the_binary_connection(receiver, wait_for):
+    server, bus = receiver
+
+    def broken(lines, index):
+        raise TypeError("broken handler")
+
+    server.print_commands["on_index"] = (broken, "index")
+    with MatrixCommandSender("127.0.0.1", server.port, True, 10,
+                             True) as sender:
+        sender.send_message({"print": "on_index",
+                             "data": {"lines": ["x", ""], "index": 0}})
+        sender.display_on_next_or_id(["after", "it"], "after")
+    assert wait_for(lambda: server.metrics.snapshot().get(
+        'messages_dropped_total{command="on_index"}'
+    ) == 1)
+    assert wait_for(lambda: (
+        server.matrix.find_data_id_display("after") is not None
+        and server.matrix.find_data_id_display("after")
+        .current_lines == ["after", "it"]
+    ))
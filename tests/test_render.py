@@ -0,0 +1,59 @@
+import pytest
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.matrix import Matrix
+
+
+@pytest.fixture
+def framed(wait_for):
+    """ Yields (matrix, bus) with a render loop which ticks once at the
+        start and then only when the test calls tick
+    """
+    bus = SimulatedSMBus(1, addresses=[0x20, 0x21])
+    matrix = Matrix([0x20, 0x21], bus_factory=lambda number: bus, fps=0.01)
+    assert wait_for(lambda: matrix.renderer.frames == 1)
+    yield matrix, bus
+    matrix.stop()
+
+
+def test_lines_are_held_until_the_next_tick(framed, wait_for):
+    matrix, bus = framed
+    matrix.display_on_index(["next frame", ""], 0)
+    matrix.display_on_index(["same frame", ""], 1)
+    assert matrix.displays[0].mailbox.back[0] == "next frame"
+    assert not matrix.displays[0].mailbox.has_lines()
+    assert bus.devices[0x20].visible_lines() == ["", ""]
+    assert matrix.renderer.tick() == 2
+    assert wait_for(lambda: [
+        bus.devices[address].visible_lines()[0] for address in (0x20, 0x21)
+    ] == ["next frame", "same frame"])
+    assert matrix.renderer.stats() == {
+        "frames": 2, "overruns": 0, "skipped": 0
+    }
+
+
+def test_stopping_the_loop_writes_the_held_lines(framed, wait_for):
+    matrix, bus = framed
+    matrix.display_on_index(["held", ""], 0)
+    matrix.stop_render_loop()
+    assert wait_for(
+        lambda: bus.devices[0x20].visible_lines()[0] == "held"
+    )
+    # Without the loop lines are written at once
+    matrix.display_on_index(["at once", ""], 0)
+    assert wait_for(
+        lambda: bus.devices[0x20].visible_lines()[0] == "at once"
+    )
+
+
+def test_unwritten_frames_count_as_overruns(framed):
+    matrix, bus = framed
+    scheduler = matrix.schedulers[1]
+    scheduler.hold()
+    try:
+        matrix.display_on_index(["first", ""], 0)
+        matrix.renderer.tick()
+        matrix.display_on_index(["second", ""], 0)
+        matrix.renderer.tick()
+    finally:
+        scheduler.release()
+    assert matrix.renderer.overruns == 1
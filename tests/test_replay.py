@@ -0,0 +1,105 @@
+from json import dumps
+from time import perf_counter
+from lcd_i2c_display_matrix.lcd_websocket_sender import MatrixCommandSender
+from lcd_i2c_display_matrix.replay import (
+    CommandRecorder, generate_load, read_log, replay, simulated_receiver
+)
+
+
+def on_index(text: str, index: int) -> dict:
+    return {"print": "on_index", "data": {"lines": [text, ""],
+                                          "index": index}}
+
+
+def received(server) -> int:
+    return sum(
+        value for name, _, _, value in server.metrics.collect()
+        if name == "messages_received_total"
+    )
+
+
+def test_recorder_writes_compact_lines(tmp_path):
+    path = str(tmp_path / "commands.log")
+    with CommandRecorder(path, flush_interval=60) as recorder:
+        recorder.record(dict(on_index("first", 0), ack=7))
+        recorder.record(on_index("second", 1))
+        assert recorder.recorded == 2
+    recorder.record(on_index("after close", 2))
+    with open(path) as log:
+        lines = log.read().splitlines()
+    assert len(lines) == 2
+    assert " " not in lines[0]
+    assert [msg for _, msg in read_log(path)] \
+        == [on_index("first", 0), on_index("second", 1)]
+
+
+def test_read_log_skips_broken_lines(tmp_path):
+    path = tmp_path / "commands.log"
+    path.write_text(
+        dumps([1.0, on_index("kept", 0)]) + "\n"
+        + "[2.0, \"not a message\"]\n"
+        + "42\n"
+        + dumps([3.0, on_index("cut off", 0)])[:20] + "\n"
+    )
+    assert list(read_log(str(path))) == [(1.0, on_index("kept", 0))]
+
+
+def test_replay_keeps_the_gaps_at_the_speed(tmp_path, receiver, wait_for):
+    server, bus = receiver
+    path = tmp_path / "commands.log"
+    path.write_text(
+        dumps([100.0, on_index("first", 1)]) + "\n"
+        + dumps([100.4, on_index("second", 2)]) + "\n"
+    )
+    with MatrixCommandSender("127.0.0.1", server.port, True) as sender:
+        start = perf_counter()
+        assert replay(str(path), sender, speed=2) == 2
+        assert 0.15 < perf_counter() - start < 1
+    assert wait_for(lambda: [
+        bus.devices[address].visible_lines()[0] for address in (0x21, 0x22)
+    ] == ["first", "second"])
+
+
+def test_generate_load_reaches_the_receiver(receiver, wait_for):
+    server, bus = receiver
+    before = received(server)
+    with MatrixCommandSender("127.0.0.1", server.port, True) as sender:
+        result = generate_load(sender, producers=2, ids=3, rate=50,
+                               duration=.2, seed=1)
+    assert 18 <= result["sent"] <= 22
+    assert wait_for(lambda: received(server) - before == result["sent"])
+    data_ids = {display.data_id for display in server.matrix.displays}
+    assert data_ids & {
+        f"load{producer}.{index}"
+        for producer in range(2) for index in range(3)
+    }
+
+
+def test_simulated_receiver_spreads_the_displays_over_buses(wait_for):
+    server, port, buses = simulated_receiver(displays=10)
+    try:
+        assert sorted(buses) == [1, 2]
+        assert len(server.matrix.displays) == 10
+        with MatrixCommandSender("127.0.0.1", port, True) as sender:
+            sender.send_message(on_index("bus 2", 9))
+        assert wait_for(
+            lambda: buses[2].devices[0x21].visible_lines()[0] == "bus 2"
+        )
+    finally:
+        server.stop()
+        server.matrix.stop()
+
+
+def test_receiver_records_the_commands(tmp_path, receiver, wait_for):
+    server, bus = receiver
+    path = str(tmp_path / "commands.log")
+    server.recorder = CommandRecorder(path, flush_interval=.05)
+    with MatrixCommandSender("127.0.0.1", server.port, True) as sender:
+        sender.send_message(on_index("recorded", 1))
+    assert wait_for(lambda: server.recorder.recorded == 1)
+    assert wait_for(lambda: [msg for _, msg in read_log(path)]
+                    == [on_index("recorded", 1)])
+    assert sender.get_stats()
+    server.recorder.close()
+    # The stats command is not recorded
+    assert len(list(read_log(path))) == 1
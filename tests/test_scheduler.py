@@ -0,0 +1,59 @@
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus
+from lcd_i2c_display_matrix.matrix import Matrix
+
+
+def test_one_scheduler_writes_all_displays_of_a_bus(wait_for):
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21, 0x22], bus_factory=lambda number: bus)
+    try:
+        assert list(matrix.schedulers) == [1]
+        scheduler = matrix.schedulers[1]
+        assert scheduler.displays == matrix.displays
+        for index in range(3):
+            matrix.display_on_index([f"display {index}", ""], index)
+        assert wait_for(lambda: [
+            bus.devices[address].visible_lines()[0]
+            for address in (0x20, 0x21, 0x22)
+        ] == ["display 0", "display 1", "display 2"])
+    finally:
+        matrix.stop()
+
+
+def test_held_scheduler_writes_after_release(wait_for):
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20], bus_factory=lambda number: bus)
+    scheduler = matrix.schedulers[1]
+    try:
+        scheduler.hold()
+        matrix.display_on_index(["held", ""], 0)
+        assert not wait_for(
+            lambda: bus.devices[0x20].visible_lines()[0] == "held", .2
+        )
+        scheduler.release()
+        assert wait_for(
+            lambda: bus.devices[0x20].visible_lines()[0] == "held"
+        )
+    finally:
+        matrix.stop()
+
+
+def test_stop_writes_pending_lines():
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20], bus_factory=lambda number: bus)
+    matrix.display_on_index(["last", "words"], 0)
+    matrix.stop()
+    assert bus.devices[0x20].visible_lines() == ["last", "words"]
+
+
+def test_stop_ends_the_threads_of_unscheduled_displays():
+    bus = SimulatedSMBus(1)
+    matrix = Matrix([0x20, 0x21], shared_bus=False,
+                    bus_factory=lambda number: bus)
+    threads = [display.thread for display in matrix.displays]
+    matrix.display_on_index(["last", "words"], 0)
+    matrix.displays[1].turn_off()
+    matrix.stop()
+    assert not any(thread.is_alive() for thread in threads)
+    assert bus.devices[0x20].visible_lines() == ["last", "words"]
+    assert matrix.displays[0].is_on()
+    assert not matrix.displays[1].is_on()
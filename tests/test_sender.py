@@ -0,0 +1,86 @@
+from lcd_i2c_display_matrix.lcd_websocket_sender import MatrixCommandSender
+
+
+class FailingSocket:
+    """ Accepts limit bytes, then the connection breaks """
+
+    def __init__(self, limit: int = None) -> None:
+        self.limit = limit
+        self.data = b""
+
+    def send(self, data) -> int:
+        if self.limit is not None and len(self.data) >= self.limit:
+            raise BrokenPipeError(32, "Broken pipe")
+        if self.limit is not None:
+            data = data[:self.limit - len(self.data)]
+        self.data += bytes(data)
+        return len(data)
+
+    def sendall(self, data) -> None:
+        self.send(data)
+
+    def close(self) -> None:
+        pass
+
+
+def failing_sender(*sockets) -> MatrixCommandSender:
+    sender = MatrixCommandSender("127.0.0.1", 0, True, 10)
+    sockets = list(sockets)
+
+    def connect():
+        if not sender.sock:
+            sender.sock = sockets.pop(0)
+        return sender.sock
+
+    sender.connect = connect
+    return sender
+
+
+def shown(server, data_id) -> str:
+    """ First line written to the display of the data_id """
+    display = server.matrix.find_data_id_display(data_id)
+    return display.current_lines[0] if display else None
+
+
+def test_pipelined_messages_reach_glass(receiver, wait_for):
+    server, bus = receiver
+    with MatrixCommandSender("127.0.0.1", server.port, True, 5) as sender:
+        for index in range(3):
+            sender.display_on_next([f"message {index}", ""], f"id{index}")
+    assert wait_for(lambda: [
+        shown(server, f"id{index}") for index in range(3)
+    ] == [f"message {index}" for index in range(3)])
+
+
+def test_waiting_messages_are_sent_after_max_delay(receiver, wait_for):
+    server, bus = receiver
+    sender = MatrixCommandSender("127.0.0.1", server.port, True, 100,
+                                 max_delay=.05)
+    try:
+        sender.send("on_next", ["slow producer", ""], "slow")
+        assert wait_for(lambda: shown(server, "slow") == "slow producer")
+        assert sender.buffer == []
+    finally:
+        sender.close()
+
+
+def test_retry_does_not_repeat_sent_messages():
+    first, second = FailingSocket(limit=12), FailingSocket()
+    sender = failing_sender(first, second)
+    messages = [f'{{"n": {index}}}\n'.encode() for index in range(4)]
+    for message in messages:
+        sender.queue_data(message)
+    sender.flush()
+    # The first connection took the first message and a part of the
+    # second one, the second one is sent again completely
+    assert first.data == b"".join(messages)[:12]
+    assert second.data == b"".join(messages[1:])
+    assert sender.buffer == []
+
+
+def test_retry_after_a_dead_connection_sends_everything():
+    first, second = FailingSocket(limit=0), FailingSocket()
+    sender = failing_sender(first, second)
+    sender.queue_data(b'{"n": 1}\n')
+    sender.flush()
+    assert second.data == b'{"n": 1}\n'
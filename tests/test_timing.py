@@ -0,0 +1,64 @@
+from json import load
+import pytest
+from lcd_i2c_display_matrix.emulator import SimulatedSMBus, simulated_buses
+from lcd_i2c_display_matrix.LCD import LCD
+from lcd_i2c_display_matrix.matrix import Matrix
+from lcd_i2c_display_matrix.timing import (
+    CALIBRATION_STEPS, PROFILES, TimingProfile, TimingStore, calibrate,
+    get_profile
+)
+
+
+def test_get_profile():
+    assert get_profile(None) is PROFILES["conservative"]
+    assert get_profile("datasheet") is PROFILES["datasheet"]
+    profile = TimingProfile("custom", 0.0001, 0.0001)
+    assert get_profile(profile) is profile
+    with pytest.raises(ValueError):
+        get_profile("fastest")
+
+
+def test_calibrate_keeps_a_safety_margin():
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    lcd = LCD(bus=bus, i2c_addr=0x20)
+    profile = calibrate(lcd, rounds=1)
+    # The emulator passes every step, one step slower is used
+    assert profile.name == "calibrated"
+    assert profile.e_pulse == CALIBRATION_STEPS[-2]
+    assert lcd.timing is profile
+
+
+def test_store_round_trip(tmp_path):
+    store = TimingStore(str(tmp_path / "timing.json"))
+    assert store.load("0x20") is None
+    store.save("0x20", PROFILES["datasheet"])
+    profile = store.load("0x20")
+    assert profile.to_dict() == PROFILES["datasheet"].to_dict()
+
+
+def test_saved_profile_is_used_instead_of_calibrating(tmp_path):
+    path = str(tmp_path / "timing.json")
+    saved = TimingProfile("calibrated", 0.00002, 0.00002, 0.0015)
+    TimingStore(path).save("0x20", saved)
+    bus = SimulatedSMBus(1, addresses=[0x20])
+    matrix = Matrix([0x20], timing="calibrate", timing_file=path,
+                    bus_factory=lambda number: bus)
+    try:
+        assert matrix.displays[0].timing.to_dict() == saved.to_dict()
+    finally:
+        matrix.stop()
+
+
+def test_parallel_bring_up_keeps_every_timing_profile(tmp_path):
+    timing_file = tmp_path / "timing.json"
+    identifiers, buses = simulated_buses(64, realtime=False)
+    matrix = Matrix(identifiers, timing="datasheet",
+                    timing_file=str(timing_file),
+                    bus_factory=lambda number: buses[number])
+    try:
+        assert len(matrix.displays) == 64
+        with open(timing_file) as f:
+            profiles = load(f)
+        assert len(profiles) == 64
+    finally:
+        matrix.stop()